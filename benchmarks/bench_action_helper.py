@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Measure events/s through Executor._action_helper
+
+Rules from examples/conf/sensors.yaml are run against memory://
+backend, actions are not executed.
+
+Usage: python benchmarks/bench_action_helper.py [events]
+"""
+import logging
+import os
+import random
+import sys
+import time
+
+from meact import backends
+from meact import executor
+from meact import utils
+from meact.executor.cooldown import CooldownTracker
+from meact.executor.dispatch import Dispatcher
+
+CONF_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples', 'conf')
+VALUES = {
+  'ping_gw': ('0', '1'),
+  'ping_internet': ('0', '1'),
+  'power': ('0', '1'),
+  'voltage': ('2.9', '3.1', '3.3'),
+  'rssi': ('-95', '-80', '-60'),
+  'motion': ('1', ),
+  'uptime': ('10', '3600'),
+  'geolocation': ('exit', 'enter'),
+}
+
+
+def create_executor():
+  ex = executor.Executor.__new__(executor.Executor)
+  ex.status = {'executor': 1, 'armed': 1}
+  ex.action_config = utils.load_config(os.path.join(CONF_DIR, 'global.yaml'))['executor']['action_config']
+  ex.db = backends.MemoryBackend()
+  ex.boards_map = dict((str(board_id), 'board {}'.format(board_id)) for board_id in range(20))
+  ex._validate_sensors_map(os.path.join(CONF_DIR, 'sensors.yaml'))
+  ex.cooldown = CooldownTracker(ex.db)
+  ex.cooldown.load(ex._action_window())
+  ex.dispatcher = Dispatcher(lambda sensor_data, action: 0, ex._action_done)
+
+  now = int(time.time())
+  ex.db.insert_metrics([{
+    'board_id': board_id,
+    'sensor_type': sensor_type,
+    'sensor_data': random.choice(values),
+    'last_update': now - random.randint(0, 3600)
+  } for board_id in ex.boards_map for sensor_type, values in VALUES.iteritems() for _ in range(5)])
+
+  return ex
+
+
+def main():
+  events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  logging.disable(logging.CRITICAL)
+  random.seed(0)
+
+  ex = create_executor()
+  data = []
+  for _ in xrange(events):
+    sensor_type = random.choice(VALUES.keys())
+    board_id = random.choice(ex.boards_map.keys())
+    data.append({
+      'board_id': board_id,
+      'board_desc': ex.boards_map[board_id],
+      'sensor_type': sensor_type,
+      'sensor_data': random.choice(VALUES[sensor_type])
+    })
+
+  start = time.time()
+  for sensor_data in data:
+    ex._action_helper(sensor_data, ex.sensors_map[sensor_data['sensor_type']])
+  elapsed = time.time() - start
+  ex.dispatcher.join()
+
+  print '{:<20} {:>8.3f}s {:>10.1f} events/s'.format('action_helper', elapsed, events / elapsed)
+
+
+if __name__ == "__main__":
+  main()
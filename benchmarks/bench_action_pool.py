@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Compare Process per action with pre-forked WorkerPool
+
+Usage: python benchmarks/bench_action_pool.py [actions]
+"""
+from multiprocessing import Process
+import sys
+import time
+
+from meact.executor.pool import WorkerPool
+
+
+def action(data, action_config):
+  sys.exit(0)
+
+
+def run_process(actions, data):
+  for _ in xrange(actions):
+    p = Process(target=action, args=(data, {}))
+    p.start()
+    p.join(10)
+
+
+def run_pool(actions, data):
+  worker_pool = WorkerPool(1)
+  try:
+    for _ in xrange(actions):
+      worker_pool.execute('action', action, (data, {}), 10)
+  finally:
+    worker_pool.close()
+
+
+def main():
+  actions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  # Executor holds sensors map, boards and metric buffers in memory
+  data = {'message': 'test', 'ballast': [str(i) for i in xrange(200000)]}
+
+  for name, run in (('process', run_process), ('pool', run_pool)):
+    start = time.time()
+    run(actions, {'message': data['message']})
+    elapsed = time.time() - start
+    print '{:<20} {:>8.3f}s {:>8.2f} ms/action'.format(name, elapsed, elapsed * 1000 / actions)
+
+
+if __name__ == "__main__":
+  main()
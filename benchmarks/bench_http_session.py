@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Compare request per connection with pooled keep-alive session
+
+Usage: python benchmarks/bench_http_session.py [requests]
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+import sys
+import time
+
+import requests
+
+from meact import utils
+
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # Response is written in small parts, avoid delayed ACK stalls
+  disable_nagle_algorithm = True
+
+  def do_GET(self):
+    body = '{"status": 1}'
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+def run_unpooled(url, notifications):
+  for _ in xrange(notifications):
+    requests.request('GET', url, timeout=2).raise_for_status()
+
+
+def run_pooled(url, notifications):
+  for _ in xrange(notifications):
+    utils.http_request(url)
+
+
+def main():
+  notifications = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+  server = Server(('127.0.0.1', 0), Handler)
+  thread = Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  url = 'http://127.0.0.1:{}/notify'.format(server.server_address[1])
+
+  try:
+    for name, run in (('unpooled', run_unpooled), ('pooled', run_pooled)):
+      start = time.time()
+      run(url, notifications)
+      elapsed = time.time() - start
+      print '{:<20} {:>8.3f}s {:>8.2f} ms/notification'.format(name, elapsed, elapsed * 1000 / notifications)
+  finally:
+    # Close keep-alive connection before server handler threads exit
+    utils.http_session().close()
+    time.sleep(0.1)
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()
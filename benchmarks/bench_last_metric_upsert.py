@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Compare last_metrics upsert with read-modify-write
+
+Usage: python benchmarks/bench_last_metric_upsert.py [metrics] [batch_size]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from meact import database
+
+
+def run(upsert, metrics, batch_size):
+  tmp_dir = tempfile.mkdtemp()
+  build_upsert = database._upsert_statement
+  try:
+    db = database.connect('sqlite:///' + os.path.join(tmp_dir, 'meact.db'))
+    database.create_db(db)
+
+    if not upsert:
+      database._upsert_statement = lambda dialect, table: None
+
+    batch = []
+    start = time.time()
+    for i in xrange(metrics):
+      batch.append({
+        'board_id': str(i % 50),
+        'sensor_type': ('voltage', 'rssi', 'temperature')[i % 3],
+        'sensor_data': str(i),
+      })
+      if len(batch) == batch_size:
+        database.insert_metrics(db, batch)
+        batch = []
+    database.insert_metrics(db, batch)
+    elapsed = time.time() - start
+  finally:
+    database._upsert_statement = build_upsert
+    shutil.rmtree(tmp_dir)
+
+  return elapsed
+
+
+def main():
+  metrics = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+  for name, upsert in (('read-modify-write', False), ('upsert', True)):
+    elapsed = run(upsert, metrics, batch_size)
+    print '{:<20} {:>8.3f}s {:>10.1f} metrics/s'.format(name, elapsed, metrics / elapsed)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare metric row store with compressed chunks
+
+Dataset is BOARDS boards reporting voltage, temperature and rssi every
+5 minutes (with few seconds of jitter) for given number of days.
+Reports database size per metric and get_metric range scan latency.
+
+Usage: python benchmarks/bench_metric_chunks.py [days]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from meact import database
+
+BOARDS = 10
+INTERVAL = 300
+# 2016-02-01 00:00:00
+START = 1454284800
+
+
+def dataset(days):
+  r = random.Random(1)
+  metrics = []
+
+  for board_id in xrange(BOARDS):
+    voltage, temperature = 3.3, 21.0
+    for i in xrange(days * 86400 / INTERVAL):
+      last_update = START + i * INTERVAL + r.randint(-2, 2)
+      voltage = min(3.4, max(2.8, round(voltage + r.choice([-0.01, 0, 0, 0.01]), 2)))
+      temperature = round(temperature + r.choice([-0.1, 0, 0, 0.1]), 1)
+      for sensor_type, sensor_data in (('voltage', voltage), ('temperature', temperature), ('rssi', r.randint(-90, -60))):
+        metrics.append({
+          'board_id': str(board_id),
+          'sensor_type': sensor_type,
+          'sensor_data': database.format_value(float(sensor_data)),
+          'last_update': last_update
+        })
+
+  return metrics
+
+
+def db_size(db, db_file):
+  db.execute('VACUUM')
+  return os.path.getsize(db_file)
+
+
+def measure(db, days, calls=20):
+  output = {}
+  end = START + days * 86400
+
+  for name, params in (
+          ('range 1 day', {'start': end - 86400, 'end': end}),
+          ('range 7 days', {'start': end - 7 * 86400, 'end': end}),
+          ('last 100', {'last_available': 100})):
+    t = time.time()
+    for i in xrange(calls):
+      database.get_metric(db, board_ids=str(i % BOARDS), sensor_type='voltage', **params)
+    output[name] = (time.time() - t) / calls
+
+  return output
+
+
+def main():
+  days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+
+  tmp_dir = tempfile.mkdtemp()
+  db_file = os.path.join(tmp_dir, 'meact.db')
+  try:
+    db = database.connect('sqlite:///' + db_file)
+    database.create_db(db)
+    metrics = dataset(days)
+    for i in xrange(0, len(metrics), 10000):
+      database.insert_metrics(db, metrics[i:i + 10000])
+
+    rows_size = db_size(db, db_file)
+    rows = measure(db, days)
+
+    db = database.connect('sqlite:///' + db_file, chunks={'interval': 86400})
+    t = time.time()
+    compressed = sum(r[3] for r in database.compress_metric(db, START + (days + 1) * 86400, execute=True))
+    compress_time = time.time() - t
+
+    chunks_size = db_size(db, db_file)
+    chunks = measure(db, days)
+    data_size = db.execute('SELECT sum(length(data)) FROM metric_chunks').scalar()
+  finally:
+    shutil.rmtree(tmp_dir)
+
+  print 'metrics {} ({} compressed in {:.1f}s)'.format(len(metrics), compressed, compress_time)
+  print 'db size  rows {:>8.1f}B/metric chunks {:>8.1f}B/metric ratio {:.1f}x (chunk data {:.1f}B/metric)'.format(
+          float(rows_size) / len(metrics), float(chunks_size) / len(metrics), float(rows_size) / chunks_size,
+          float(data_size) / compressed)
+  for name in sorted(rows):
+    print '{:<14} rows {:>8.2f}ms chunks {:>8.2f}ms'.format(name, rows[name] * 10**3, chunks[name] * 10**3)
+
+
+if __name__ == "__main__":
+  main()
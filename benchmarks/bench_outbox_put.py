@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""Measure Outbox.put latency in memory and with journal
+
+Usage: python benchmarks/bench_outbox_put.py [entries]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from meact.executor import plan
+from meact.executor.outbox import Outbox
+
+RULE = plan.Rule(id='d41d8cd98f00b204e9800998ecf8427e', actions=(plan.Action(name='sms'), plan.Action(name='mail')))
+
+
+def main():
+  entries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  tmpdir = tempfile.mkdtemp()
+
+  try:
+    for name, journal_file in (('memory', None), ('journal', tmpdir + '/outbox')):
+      outbox = Outbox(journal_file)
+      outbox.load(lambda sensor_type, rule_id: RULE)
+
+      start = time.time()
+      for i in xrange(entries):
+        outbox.put({'board_id': str(i), 'sensor_type': 'voltage', 'sensor_data': '3.1', 'message': 'Voltage 3.1'},
+                RULE)
+      elapsed = time.time() - start
+      print '{:<10} {:>8.3f}s {:>8.1f} us/put'.format(name, elapsed, elapsed * 1000000 / entries)
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+  main()
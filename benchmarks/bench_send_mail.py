@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Compare SMTP session per recipient with reused session in send_mail
+
+Usage: python benchmarks/bench_send_mail.py [mails]
+"""
+from threading import Event, Thread
+import asyncore
+import smtpd
+import sys
+import time
+
+from meact.executor.actions import send_mail
+
+
+class Server(smtpd.SMTPServer):
+
+  def process_message(self, peer, mailfrom, rcpttos, data):
+    pass
+
+
+def send(action_config):
+  try:
+    send_mail.send_mail({'message': 'power'}, action_config)
+  except SystemExit as e:
+    if e.code:
+      raise RuntimeError('send_mail failed with {}'.format(e.code))
+
+
+def run_per_recipient(action_config, mails):
+  for _ in xrange(mails):
+    for recipient in action_config['recipient']:
+      send_mail.close_smtp_session()
+      send(dict(action_config, recipient=[recipient]))
+
+
+def run_reused(action_config, mails):
+  for _ in xrange(mails):
+    send(action_config)
+
+
+def main():
+  mails = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+  server = Server(('127.0.0.1', 0), None)
+  stopped = Event()
+
+  def loop():
+    while not stopped.is_set():
+      asyncore.loop(timeout=0.01, count=1)
+  thread = Thread(target=loop)
+  thread.start()
+
+  try:
+    for recipients in (1, 5, 20):
+      action_config = {'sender': 'meact@example.com', 'host': '127.0.0.1', 'port': server.socket.getsockname()[1],
+              'tls': 0, 'enabled': 1, 'recipient': ['user{}@example.com'.format(i) for i in range(recipients)]}
+
+      for name, run in (('session per recipient', run_per_recipient), ('reused session', run_reused)):
+        start = time.time()
+        run(action_config, mails)
+        elapsed = time.time() - start
+        print '{:>2} recipients {:<22} {:>8.3f}s {:>8.2f} ms/mail'.format(recipients, name, elapsed,
+                elapsed * 1000 / mails)
+  finally:
+    send_mail.close_smtp_session()
+    stopped.set()
+    thread.join()
+    asyncore.close_all()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Compare publish.single per message with reused connection in send_mqtt
+
+Runs against minimal in-process broker (CONNECT/PUBLISH/DISCONNECT).
+
+Usage: python benchmarks/bench_send_mqtt.py [actions]
+"""
+from SocketServer import BaseRequestHandler, TCPServer, ThreadingMixIn
+from threading import Thread
+import socket
+import sys
+import time
+
+import paho.mqtt.client as paho
+import paho.mqtt.publish as publish
+
+from meact.executor.actions import send_mqtt
+
+
+class Broker(ThreadingMixIn, TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class Handler(BaseRequestHandler):
+
+  def read(self, size):
+    data = ''
+    while len(data) < size:
+      chunk = self.request.recv(size - len(data))
+      if not chunk:
+        raise EOFError
+      data += chunk
+    return data
+
+  def handle(self):
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+      while True:
+        header = ord(self.read(1))
+        length, multiplier = 0, 1
+        while True:
+          byte = ord(self.read(1))
+          length += (byte & 127) * multiplier
+          multiplier *= 128
+          if not byte & 128:
+            break
+        self.read(length)
+
+        if header >> 4 == 1:
+          self.request.sendall('\x20\x02\x00\x00')
+        elif header >> 4 == 14:
+          break
+    except (EOFError, socket.error):
+      pass
+
+
+def run_single(action_config, actions):
+  for _ in xrange(actions):
+    for message in action_config['message']:
+      publish.single(message['topic'], payload=message['payload'], hostname=action_config['server'],
+              port=action_config['port'], protocol=paho.MQTTv31)
+
+
+def run_reused(action_config, actions):
+  for _ in xrange(actions):
+    try:
+      send_mqtt.send_mqtt({}, action_config)
+    except SystemExit as e:
+      if e.code:
+        raise RuntimeError('send_mqtt failed with {}'.format(e.code))
+
+
+def main():
+  actions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+  broker = Broker(('127.0.0.1', 0), Handler)
+  thread = Thread(target=broker.serve_forever)
+  thread.daemon = True
+  thread.start()
+  action_config = {'server': '127.0.0.1', 'port': broker.server_address[1], 'enabled': 1, 'message': [
+    {'topic': 'relay/kitchen/1', 'payload': 'on'},
+    {'topic': 'relay/kitchen/2', 'payload': 'on'}]}
+
+  try:
+    for name, run in (('connection per message', run_single), ('reused connection', run_reused)):
+      start = time.time()
+      run(action_config, actions)
+      elapsed = time.time() - start
+      print '{:<24} {:>8.3f}s {:>8.2f} ms/action'.format(name, elapsed, elapsed * 1000 / actions)
+  finally:
+    send_mqtt.close_mqtt_client()
+    broker.shutdown()
+    broker.server_close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Measure get_action/get_last_metric call overhead
+
+Compares sessionmaker created per call on engine without pool
+configuration with thread local session registry and queue pool.
+
+Usage: python benchmarks/bench_session_overhead.py [calls]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from meact import database
+
+
+def create_session_per_call(db):
+  Session = sessionmaker()
+  Session.configure(bind=db)
+  return Session()
+
+
+def measure(db, calls):
+  output = {}
+
+  start = time.time()
+  for i in xrange(calls):
+    database.get_action(db, board_ids=str(i % 10), sensor_type='voltage',
+            sensor_action_id='action-id', last_available=1)
+  output['get_action'] = (time.time() - start) / calls
+
+  start = time.time()
+  for i in xrange(calls):
+    database.get_last_metric(db, board_ids=str(i % 10), sensor_type='voltage')
+  output['get_last_metric'] = (time.time() - start) / calls
+
+  return output
+
+
+def main():
+  calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+  tmp_dir = tempfile.mkdtemp()
+  db_string = 'sqlite:///' + os.path.join(tmp_dir, 'meact.db')
+  create_session = database.create_session
+  try:
+    db = database.connect(db_string)
+    database.create_db(db)
+    for i in xrange(1000):
+      database.insert_action(db, str(i % 10), 'voltage', 'action-id')
+    database.insert_metrics(db, [{'board_id': str(i), 'sensor_type': 'voltage', 'sensor_data': '3.3'} for i in xrange(10)])
+
+    database.create_session = create_session_per_call
+    before = measure(database.connect(db_string), calls)
+
+    database.create_session = create_session
+    after = measure(database.connect(db_string, pool={'class': 'queue', 'size': 1}), calls)
+  finally:
+    database.create_session = create_session
+    shutil.rmtree(tmp_dir)
+
+  for name in sorted(before):
+    print '{:<16} before {:>8.1f}us after {:>8.1f}us'.format(name, before[name] * 10**6, after[name] * 10**6)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Compare lock errors of one writer and readers with SQLite profiles
+
+Usage: python benchmarks/bench_sqlite_concurrency.py [seconds] [readers]
+"""
+from threading import Thread
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from meact import database
+
+PROFILES = (
+  ('default', None),
+  ('wal', {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -2000,
+    'mmap_size': 1048576,
+    'temp_store': 'memory'
+  }),
+)
+
+
+def hammer(db_string, profile, duration, readers):
+  """Run single writer and readers against one file
+
+  Returns number of lock errors and operations for writer and readers.
+  """
+  write_db = database.connect(db_string, pool={'class': 'queue', 'size': 1}, sqlite=profile)
+  read_profile = dict(profile, query_only=1) if profile else None
+  read_db = database.connect(db_string, pool={'class': 'queue', 'size': readers}, sqlite=read_profile)
+
+  errors = {'writer': 0, 'readers': 0}
+  operations = {'writer': 0, 'readers': 0}
+  stop_at = time.time() + duration
+
+  def writer():
+    i = 0
+    while time.time() < stop_at:
+      i += 1
+      batch = [{'board_id': str(board_id), 'sensor_type': 'voltage', 'sensor_data': str(i)} for board_id in range(10)]
+      try:
+        database.insert_metrics(write_db, batch)
+        operations['writer'] += 1
+      except OperationalError:
+        errors['writer'] += 1
+
+  def reader():
+    while time.time() < stop_at:
+      try:
+        database.get_last_metric(read_db, sensor_type='voltage')
+        database.get_metric(read_db, board_ids='1', sensor_type='voltage', last_available=10)
+        operations['readers'] += 1
+      except OperationalError:
+        errors['readers'] += 1
+
+  threads = [Thread(target=writer)] + [Thread(target=reader) for i in range(readers)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  return errors, operations
+
+
+def main():
+  duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+  readers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+  for name, profile in PROFILES:
+    tmpdir = tempfile.mkdtemp()
+    try:
+      db_string = 'sqlite:///' + tmpdir + '/meact.db'
+      database.create_db(database.connect(db_string))
+      errors, operations = hammer(db_string, profile, duration, readers)
+    finally:
+      shutil.rmtree(tmpdir)
+
+    print '{:<10} lock errors writer {:>5} readers {:>5}, operations writer {:>6} readers {:>6}'.format(
+            name, errors['writer'], errors['readers'], operations['writer'], operations['readers'])
+
+
+if __name__ == "__main__":
+  main()
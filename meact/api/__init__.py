@@ -9,7 +9,7 @@ import netaddr
 
 from meact import mqtt
 from meact import utils
-from meact import database
+from meact import backends
 
 
 app = bottle.Bottle()
@@ -66,12 +66,12 @@ def post_status():
     app.config['mqtt'].publish_status(data)
 
 def handle_board_endpoint(board_id = None, sensor_type = None, start = None, end = None):
-  boards = database.get_board(app.config['db'], board_ids=board_id)
+  boards = app.config['db'].get_board(board_ids=board_id)
 
   board_ids = [board.board_id for board in boards]
   board_desc = dict((board.board_id, board.board_desc) for board in boards)
 
-  last_metrics = database.get_last_metric(app.config['db'], board_ids=board_ids, start=start, end=end, sensor_type=sensor_type)
+  last_metrics = app.config['db'].get_last_metric(board_ids=board_ids, start=start, end=end, sensor_type=sensor_type)
 
   output = dict()
 
@@ -113,11 +113,11 @@ def post_board(board_id = None):
 
 
 def handle_graph_endpoint(board_id = None, graph_type = None, start = None, end = None, last_available = None):
-  boards = database.get_board(app.config['db'])
+  boards = app.config['db'].get_board()
 
   board_desc = dict((board.board_id, board.board_desc) for board in boards)
 
-  last_metrics = database.get_last_metric(app.config['db'], board_ids=board_id, sensor_type=graph_type)
+  last_metrics = app.config['db'].get_last_metric(board_ids=board_id, sensor_type=graph_type)
 
   output = list()
 
@@ -128,12 +128,14 @@ def handle_graph_endpoint(board_id = None, graph_type = None, start = None, end
         'data': []
     })
 
-    metrics = database.get_metric(app.config['db'], board_ids=last_metric.board_id, sensor_type=graph_type, start=start, end=end)
+    metrics = app.config['db'].get_metric(board_ids=last_metric.board_id, sensor_type=graph_type, start=start, end=end)
     if not metrics and last_available:
-      metrics = database.get_metric(app.config['db'], board_ids=last_metric.board_id, sensor_type=graph_type, last_available=last_available)
+      metrics = app.config['db'].get_metric(board_ids=last_metric.board_id, sensor_type=graph_type, last_available=last_available)
 
     for metric in metrics:
-      data = (metric.last_update, float(metric.sensor_data))
+      if metric.sensor_value is None:
+        continue
+      data = (metric.last_update, metric.sensor_value)
       output[-1]['data'].append(data)
 
   return output
@@ -161,12 +163,33 @@ def post_graph(graph_type = None):
 
 
 class Api(mqtt.Mqtt):
-  def __init__(self, mqtt_config):
+  def __init__(self, mqtt_config, db=None, stats_interval=60):
     super(Api, self).__init__()
     self.name = 'api'
     self.mqtt_config = mqtt_config
+    self.db = db
+    self.stats_interval = stats_interval
+    self._stats_published = time.time()
     self.start_mqtt()
 
+  def _on_message(self, client, userdata, msg):
+    if not isinstance(self.db, backends.LastMetricCache) or not self.topic_matches('dbsm/metric', msg.topic):
+      return
+
+    sensor_data = utils.prepare_sensor_data_mqtt(msg)
+    if sensor_data:
+      self.db.update(sensor_data)
+
+    self._publish_stats()
+
+  def _publish_stats(self):
+    if not self.stats_interval or time.time() - self._stats_published < self.stats_interval:
+      return
+
+    self._stats_published = time.time()
+    stats = self.db.snapshot()
+    self.publish_stats(dict(('last_metric_cache/' + name, value) for name, value in stats.iteritems()))
+
 
 def main():
   parser = utils.create_arg_parser('Meact API service')
@@ -183,12 +206,21 @@ def main():
   app.config['appconfig'] = conf
   logging_conf = conf.get('logging', {})
 
-  app.config['mqtt'] = Api(conf['mqtt'])
-  app.config['mqtt'].loop_start()
-
   utils.create_logger(logging_conf)
 
-  app.config['db'] = database.connect(conf['db_string'])
+  app.config['db'] = backends.connect(conf['db_string'],
+          pool=conf.get('db_pool'),
+          sqlite=conf.get('db_sqlite'),
+          partitioning=conf.get('db_partitioning'),
+          chunks=conf.get('db_chunks'))
+
+  # Boards and last metrics are served from memory when metric stream is available
+  if conf['mqtt'].get('topic', {}).get('subscribe', {}).get('dbsm/metric'):
+    app.config['db'] = backends.LastMetricCache(app.config['db'])
+    app.config['db'].seed()
+
+  app.config['mqtt'] = Api(conf['mqtt'], app.config['db'], conf.get('stats_interval', 60))
+  app.config['mqtt'].loop_start()
 
   app.run(host='0.0.0.0', port=8080, server='tornado')
 
@@ -0,0 +1,22 @@
+from meact.backends.base import Backend
+from meact.backends.cache import LastMetricCache
+from meact.backends.memory import MemoryBackend
+from meact.backends.sql import SqlBackend
+from meact.backends.window import MetricWindows
+
+# db_string scheme to backend, other schemes are SQLAlchemy URLs
+BACKENDS = {
+  'memory': MemoryBackend,
+}
+
+
+def connect(db_string, **params):
+  """Return backend selected by db_string scheme
+
+  params are passed to backend (see SqlBackend for SQLAlchemy
+  pool/sqlite/partitioning/chunks options).
+  """
+  scheme = db_string.split('://', 1)[0]
+  backend = BACKENDS.get(scheme, SqlBackend)
+
+  return backend(db_string, **params)
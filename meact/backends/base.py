@@ -0,0 +1,63 @@
+class Backend(object):
+  """Storage used by meact services
+
+  Metrics, actions and feeds are returned as objects with attributes
+  of meact.database models, ordered from oldest. Filters which are
+  None (or empty) are not applied.
+  """
+  def create_db(self):
+    raise NotImplementedError
+
+  def sync_board(self, boards_map):
+    raise NotImplementedError
+
+  def get_board(self, board_ids=None):
+    raise NotImplementedError
+
+  def insert_metric(self, sensor_data):
+    self.insert_metrics([sensor_data])
+
+  def insert_metrics(self, metrics):
+    """Insert metrics and update last metrics
+
+    sensor_data['last_update'] is used when present, otherwise
+    current time is used.
+    """
+    raise NotImplementedError
+
+  def get_metric(self, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None,
+          max_value=None):
+    raise NotImplementedError
+
+  def get_last_metric(self, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
+    raise NotImplementedError
+
+  def delete_metric(self, start=None, end=None):
+    """Remove metrics between start and end, returns number of metrics
+    """
+    raise NotImplementedError
+
+  def get_action(self, board_ids=None, sensor_type=None, sensor_action_id=None, start=None, end=None, last_available=None):
+    raise NotImplementedError
+
+  def insert_action(self, board_id, sensor_type, sensor_action_id):
+    self.insert_actions([{'board_id': board_id, 'sensor_type': sensor_type, 'sensor_action_id': sensor_action_id}])
+
+  def insert_actions(self, actions):
+    """Insert actions, action['last_update'] is used when present
+    """
+    raise NotImplementedError
+
+  def delete_action(self, start=None, end=None):
+    raise NotImplementedError
+
+  def get_feed(self, feed_name=None, result=None, start=None, end=None, last_available=None):
+    """Return feeds, result 0 returns successful feeds only
+    """
+    raise NotImplementedError
+
+  def insert_feed(self, feed_name, result):
+    raise NotImplementedError
+
+  def delete_feed(self, start=None, end=None):
+    raise NotImplementedError
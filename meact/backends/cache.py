@@ -0,0 +1,127 @@
+from threading import Lock
+import logging
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from meact import utils
+from meact.backends.memory import Record, in_range, in_values
+from meact.database import prepare_board_ids
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class LastMetricCache(object):
+  """Backend wrapper serving get_last_metric and get_board from memory
+
+  Last metrics are seeded from backend and kept up to date with
+  update() from dbsm/metric stream. While cache is cold (seed failed)
+  seeding is retried every retry_interval seconds and reads fall back
+  to backend. Boards are refreshed after boards_ttl seconds, other
+  calls are passed to backend.
+  """
+  def __init__(self, backend, boards_ttl=60, retry_interval=10):
+    self.backend = backend
+    self.boards_ttl = boards_ttl
+    self.retry_interval = retry_interval
+    self.stats = Stats()
+    self.seeded = False
+    self._lock = Lock()
+    self._metrics = {}
+    self._boards = None
+    self._boards_refreshed = 0
+    self._seed_attempt = 0
+    self._stream_update = None
+
+  def __getattr__(self, name):
+    return getattr(self.backend, name)
+
+  def seed(self):
+    self._seed_attempt = time.time()
+    try:
+      metrics = self.backend.get_last_metric()
+    except OperationalError as e:
+      LOG.error("Fail to seed last metrics '%s'", e)
+      return False
+
+    with self._lock:
+      for metric in metrics:
+        series = (metric.board_id, metric.sensor_type)
+        # Metrics received from stream during seeding are newer
+        if series not in self._metrics or self._metrics[series].last_update < metric.last_update:
+          self._metrics[series] = Record(
+            board_id=metric.board_id,
+            sensor_type=metric.sensor_type,
+            sensor_data=metric.sensor_data,
+            sensor_value=metric.sensor_value,
+            last_update=metric.last_update)
+      self.seeded = True
+
+    LOG.info('Seeded %d last metrics', len(metrics))
+    return True
+
+  def update(self, sensor_data):
+    now = int(time.time())
+    metric = Record(
+      board_id=sensor_data['board_id'],
+      sensor_type=sensor_data['sensor_type'],
+      sensor_data=sensor_data['sensor_data'],
+      sensor_value=utils.to_number(sensor_data['sensor_data']),
+      last_update=sensor_data.get('last_update', now))
+
+    with self._lock:
+      self._metrics[(metric.board_id, metric.sensor_type)] = metric
+      self._stream_update = now
+
+    self.stats.incr('update')
+
+  def get_last_metric(self, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
+    if not self.seeded and (time.time() - self._seed_attempt < self.retry_interval or not self.seed()):
+      self.stats.incr('fallback')
+      return self.backend.get_last_metric(board_ids, sensor_type, start, end, min_value, max_value)
+
+    board_ids = prepare_board_ids(board_ids)
+
+    with self._lock:
+      if board_ids and sensor_type:
+        metrics = [self._metrics[(board_id, sensor_type)] for board_id in board_ids
+                if (board_id, sensor_type) in self._metrics]
+      else:
+        metrics = [metric for (board_id, series_type), metric in self._metrics.iteritems()
+                if (not board_ids or board_id in board_ids) and (not sensor_type or series_type == sensor_type)]
+
+    self.stats.incr('hit')
+    return [metric for metric in metrics if in_range(metric, start, end) and in_values(metric, min_value, max_value)]
+
+  def get_board(self, board_ids=None):
+    if self._boards is None or time.time() - self._boards_refreshed > self.boards_ttl:
+      try:
+        self._boards = self.backend.get_board()
+        self._boards_refreshed = time.time()
+      except OperationalError as e:
+        if self._boards is None:
+          raise
+        LOG.error("Fail to refresh boards '%s'", e)
+
+    board_ids = prepare_board_ids(board_ids)
+    return [board for board in self._boards if not board_ids or board.board_id in board_ids]
+
+  def snapshot(self):
+    """Return stats with cache freshness
+
+    stream_age is time since last update from stream, max_age is
+    age of oldest cached metric (seconds).
+    """
+    now = time.time()
+    with self._lock:
+      entries = len(self._metrics)
+      oldest = min(metric.last_update for metric in self._metrics.itervalues()) if self._metrics else now
+      stream_update = self._stream_update
+
+    self.stats.gauge('seeded', int(self.seeded))
+    self.stats.gauge('entries', entries)
+    self.stats.gauge('max_age', int(now - oldest))
+    self.stats.gauge('stream_age', int(now - stream_update) if stream_update else -1)
+
+    return self.stats.snapshot()
@@ -0,0 +1,191 @@
+from threading import Lock
+import bisect
+import itertools
+import time
+
+from meact import utils
+from meact.backends.base import Backend
+from meact.database import prepare_board_ids
+
+
+class Record(object):
+  """Plain object with attributes of meact.database model
+  """
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+  def __repr__(self):
+    return '<Record({})>'.format(', '.join("{}='{}'".format(k, v) for k, v in sorted(self.__dict__.iteritems())))
+
+
+def in_range(record, start=None, end=None):
+  if start and record.last_update < start:
+    return False
+  if end and record.last_update > end:
+    return False
+  return True
+
+
+def in_values(record, min_value=None, max_value=None):
+  if min_value is not None and (record.sensor_value is None or record.sensor_value < min_value):
+    return False
+  if max_value is not None and (record.sensor_value is None or record.sensor_value > max_value):
+    return False
+  return True
+
+
+def _last(records, last_available=None):
+  if last_available:
+    return records[-last_available:]
+  return records
+
+
+class MemoryBackend(Backend):
+  """Process local backend, db_string is memory://
+
+  Data is lost when process exits, backend is meant for tests,
+  benchmarks and single process setups. Metrics are kept per
+  (board_id, sensor_type) series ordered by (last_update, id).
+  """
+  def __init__(self, db_string='memory://', **params):
+    self._lock = Lock()
+    self.create_db()
+
+  def create_db(self):
+    with self._lock:
+      self._ids = itertools.count(1)
+      self._boards = {}
+      self._series = {}
+      self._last_metrics = {}
+      self._actions = []
+      self._feeds = []
+
+  def sync_board(self, boards_map):
+    with self._lock:
+      self._boards = dict((board_id, Record(board_id=board_id, board_desc=board_desc))
+              for board_id, board_desc in boards_map.iteritems())
+
+  def get_board(self, board_ids=None):
+    board_ids = prepare_board_ids(board_ids)
+    with self._lock:
+      return [board for board_id, board in sorted(self._boards.iteritems()) if not board_ids or board_id in board_ids]
+
+  def insert_metrics(self, metrics):
+    now = int(time.time())
+
+    with self._lock:
+      for sensor_data in metrics:
+        metric = Record(
+          id=next(self._ids),
+          board_id=sensor_data['board_id'],
+          sensor_type=sensor_data['sensor_type'],
+          sensor_data=sensor_data['sensor_data'],
+          sensor_value=utils.to_number(sensor_data['sensor_data']),
+          last_update=sensor_data.get('last_update', now))
+
+        series = (metric.board_id, metric.sensor_type)
+        keys, records = self._series.setdefault(series, ([], []))
+        key = (metric.last_update, metric.id)
+        if not keys or keys[-1] < key:
+          keys.append(key)
+          records.append(metric)
+        else:
+          idx = bisect.bisect(keys, key)
+          keys.insert(idx, key)
+          records.insert(idx, metric)
+
+        self._last_metrics[series] = Record(
+          board_id=metric.board_id,
+          sensor_type=metric.sensor_type,
+          sensor_data=metric.sensor_data,
+          sensor_value=metric.sensor_value,
+          last_update=metric.last_update)
+
+  def get_metric(self, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None,
+          max_value=None):
+    board_ids = prepare_board_ids(board_ids)
+    output = []
+
+    with self._lock:
+      for (board_id, series_type), (keys, records) in self._series.iteritems():
+        if board_ids and board_id not in board_ids or sensor_type and series_type != sensor_type:
+          continue
+
+        first = bisect.bisect_left(keys, (start, 0)) if start else 0
+        last = bisect.bisect_right(keys, (end, float('inf'))) if end else len(keys)
+        output.extend(metric for metric in records[first:last] if in_values(metric, min_value, max_value))
+
+    output.sort(key=lambda metric: (metric.last_update, metric.id))
+    return _last(output, last_available)
+
+  def get_last_metric(self, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
+    board_ids = prepare_board_ids(board_ids)
+
+    with self._lock:
+      return [metric for (board_id, series_type), metric in sorted(self._last_metrics.iteritems())
+              if (not board_ids or board_id in board_ids) and (not sensor_type or series_type == sensor_type)
+              and in_range(metric, start, end) and in_values(metric, min_value, max_value)]
+
+  def delete_metric(self, start=None, end=None):
+    count = 0
+
+    with self._lock:
+      for series, (keys, records) in self._series.items():
+        first = bisect.bisect_left(keys, (start, 0)) if start else 0
+        last = bisect.bisect_right(keys, (end, float('inf'))) if end else len(keys)
+        count += last - first
+        del keys[first:last]
+        del records[first:last]
+        if not keys:
+          del self._series[series]
+
+    return count
+
+  def get_action(self, board_ids=None, sensor_type=None, sensor_action_id=None, start=None, end=None, last_available=None):
+    board_ids = prepare_board_ids(board_ids)
+
+    with self._lock:
+      return _last([action for action in self._actions
+              if (not board_ids or action.board_id in board_ids)
+              and (not sensor_type or action.sensor_type == sensor_type)
+              and (not sensor_action_id or action.sensor_action_id == sensor_action_id)
+              and in_range(action, start, end)], last_available)
+
+  def insert_actions(self, actions):
+    now = int(time.time())
+
+    with self._lock:
+      for action in actions:
+        self._actions.append(Record(
+          id=next(self._ids),
+          board_id=action['board_id'],
+          sensor_type=action['sensor_type'],
+          sensor_action_id=action['sensor_action_id'],
+          last_update=action.get('last_update', now)))
+
+  def delete_action(self, start=None, end=None):
+    with self._lock:
+      count = len(self._actions)
+      self._actions = [action for action in self._actions if not in_range(action, start, end)]
+      return count - len(self._actions)
+
+  def get_feed(self, feed_name=None, result=None, start=None, end=None, last_available=None):
+    with self._lock:
+      return _last([feed for feed in self._feeds
+              if (not feed_name or feed.feed_name == feed_name)
+              and (result is None or feed.result == result)
+              and in_range(feed, start, end)], last_available)
+
+  def insert_feed(self, feed_name, result):
+    with self._lock:
+      self._feeds.append(Record(
+        id=next(self._ids),
+        feed_name=feed_name,
+        result=result,
+        last_update=int(time.time())))
+
+  def delete_feed(self, start=None, end=None):
+    with self._lock:
+      count = len(self._feeds)
+      self._feeds = [feed for feed in self._feeds if not in_range(feed, start, end)]
+      return count - len(self._feeds)
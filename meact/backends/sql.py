@@ -0,0 +1,51 @@
+from meact import database
+from meact.backends.base import Backend
+
+
+class SqlBackend(Backend):
+  """SQLAlchemy backend, db_string is SQLAlchemy URL
+
+  Parameters are passed to meact.database.connect.
+  """
+  def __init__(self, db_string, pool=None, sqlite=None, partitioning=None, chunks=None):
+    self.db = database.connect(db_string, pool=pool, sqlite=sqlite, partitioning=partitioning, chunks=chunks)
+
+  def create_db(self):
+    database.create_db(self.db)
+
+  def sync_board(self, boards_map):
+    database.sync_board(self.db, boards_map)
+
+  def get_board(self, board_ids=None):
+    return database.get_board(self.db, board_ids)
+
+  def insert_metrics(self, metrics):
+    database.insert_metrics(self.db, metrics)
+
+  def get_metric(self, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None,
+          max_value=None):
+    return database.get_metric(self.db, board_ids, sensor_type, start, end, last_available, min_value, max_value)
+
+  def get_last_metric(self, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
+    return database.get_last_metric(self.db, board_ids, sensor_type, start, end, min_value, max_value)
+
+  def delete_metric(self, start=None, end=None):
+    return sum(count for table_name, count, drop in database.delete_metric(self.db, start, end, execute=True))
+
+  def get_action(self, board_ids=None, sensor_type=None, sensor_action_id=None, start=None, end=None, last_available=None):
+    return database.get_action(self.db, board_ids, sensor_type, sensor_action_id, start, end, last_available)
+
+  def insert_actions(self, actions):
+    database.insert_actions(self.db, actions)
+
+  def delete_action(self, start=None, end=None):
+    return database.delete_action(self.db, start, end, execute=True)
+
+  def get_feed(self, feed_name=None, result=None, start=None, end=None, last_available=None):
+    return database.get_feed(self.db, feed_name, result, start, end, last_available)
+
+  def insert_feed(self, feed_name, result):
+    database.insert_feed(self.db, feed_name, result)
+
+  def delete_feed(self, start=None, end=None):
+    return database.delete_feed(self.db, start, end, execute=True)
@@ -0,0 +1,204 @@
+from array import array
+from threading import Lock
+import logging
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from meact import utils
+from meact.backends.memory import Record, in_range, in_values
+from meact.database import prepare_board_ids
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class RingBuffer(object):
+  """Fixed size buffer of metrics from single series
+
+  covered_since is timestamp since which buffer holds every metric
+  of series, it moves forward when metrics are dropped.
+  """
+  __slots__ = ('timestamps', 'values', 'data', 'start', 'size', 'covered_since')
+
+  def __init__(self, capacity, covered_since):
+    self.timestamps = array('l', [0]) * capacity
+    self.values = array('d', [0.0]) * capacity
+    self.data = [None] * capacity
+    self.start = 0
+    self.size = 0
+    self.covered_since = covered_since
+
+  def append(self, last_update, sensor_value, sensor_data):
+    """Append metric, returns False when oldest metric was dropped
+    """
+    capacity = len(self.data)
+    dropped = self.size == capacity
+
+    if dropped:
+      self.covered_since = max(self.covered_since, self.timestamps[self.start] + 1)
+      self.start = (self.start + 1) % capacity
+      self.size -= 1
+
+    idx = (self.start + self.size) % capacity
+    self.timestamps[idx] = last_update
+    self.values[idx] = float('nan') if sensor_value is None else sensor_value
+    self.data[idx] = sensor_data
+    self.size += 1
+
+    return not dropped
+
+  def expire(self, before):
+    capacity = len(self.data)
+    while self.size and self.timestamps[self.start] < before:
+      self.data[self.start] = None
+      self.start = (self.start + 1) % capacity
+      self.size -= 1
+    self.covered_since = max(self.covered_since, before)
+
+  def __iter__(self):
+    capacity = len(self.data)
+    for i in xrange(self.size):
+      idx = (self.start + i) % capacity
+      value = self.values[idx]
+      yield self.timestamps[idx], None if value != value else value, self.data[idx]
+
+
+class MetricWindows(object):
+  """Backend wrapper serving get_metric from per series ring buffers
+
+  windows maps sensor_type to time window (seconds, 0 when only
+  metrics count matters). Buffers are seeded from backend for window
+  and fed with update() from dbsm/metric stream. get_metric is
+  served from memory when buffers hold every metric which can be
+  returned, otherwise (cold start, window longer than buffer, other
+  sensor_type) it goes to backend. Other calls are passed to backend.
+  """
+  def __init__(self, backend, windows=None, capacity=128):
+    self.backend = backend
+    self.capacity = capacity
+    self.stats = Stats()
+    self.windows = {}
+    self._lock = Lock()
+    self._buffers = {}
+    self._covered_since = {}
+    self.set_windows(windows or {})
+
+  def __getattr__(self, name):
+    return getattr(self.backend, name)
+
+  def set_windows(self, windows):
+    """Replace windows, buffers for new sensor types are seeded
+
+    Seed metrics are read from backend before lock is taken.
+    """
+    now = int(time.time())
+
+    seeds = {}
+    for sensor_type, window in windows.iteritems():
+      if sensor_type in self.windows or not window:
+        continue
+      try:
+        seeds[sensor_type] = self.backend.get_metric(sensor_type=sensor_type, start=now - window)
+      except OperationalError as e:
+        LOG.error("Fail to seed metrics for '%s' '%s'", sensor_type, e)
+
+    with self._lock:
+      for series in self._buffers.keys():
+        if series[1] not in windows:
+          del self._buffers[series]
+
+      for sensor_type, window in windows.iteritems():
+        if sensor_type in self.windows:
+          continue
+
+        self._covered_since[sensor_type] = now
+        if sensor_type in seeds:
+          self._covered_since[sensor_type] = now - window
+          for metric in seeds[sensor_type]:
+            self._append(metric.board_id, sensor_type, metric.sensor_data, metric.sensor_value, metric.last_update)
+
+      self.windows = dict(windows)
+      for sensor_type in self._covered_since.keys():
+        if sensor_type not in windows:
+          del self._covered_since[sensor_type]
+
+    LOG.info('Buffering metrics for %s', self.windows)
+
+  def update(self, sensor_data):
+    if sensor_data['sensor_type'] not in self.windows:
+      return
+
+    with self._lock:
+      self._append(sensor_data['board_id'], sensor_data['sensor_type'], sensor_data['sensor_data'],
+              utils.to_number(sensor_data['sensor_data']), sensor_data.get('last_update', int(time.time())))
+
+  def _append(self, board_id, sensor_type, sensor_data, sensor_value, last_update):
+    series = (board_id, sensor_type)
+    buf = self._buffers.get(series)
+    if buf is None:
+      buf = self._buffers[series] = RingBuffer(self.capacity, self._covered_since[sensor_type])
+
+    if not buf.append(last_update, sensor_value, sensor_data):
+      self.stats.incr('overflow')
+
+    window = self.windows.get(sensor_type)
+    if window:
+      buf.expire(int(time.time()) - window)
+
+  def get_metric(self, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None,
+          max_value=None):
+    metrics = self._get_buffered(board_ids, sensor_type, start, end, last_available, min_value, max_value)
+
+    if metrics is None:
+      self.stats.incr('miss')
+      return self.backend.get_metric(board_ids, sensor_type, start, end, last_available, min_value, max_value)
+
+    self.stats.incr('hit')
+    return metrics
+
+  def _get_buffered(self, board_ids, sensor_type, start, end, last_available, min_value, max_value):
+    if sensor_type not in self._covered_since or not start and not last_available:
+      return None
+
+    board_ids = prepare_board_ids(board_ids)
+    output = []
+
+    with self._lock:
+      covered_since = self._covered_since[sensor_type]
+      if board_ids:
+        series = [(board_id, sensor_type) for board_id in board_ids]
+      else:
+        series = [s for s in self._buffers if s[1] == sensor_type]
+
+      for board_id, series_type in series:
+        buf = self._buffers.get((board_id, series_type))
+        if buf is None:
+          continue
+
+        covered_since = max(covered_since, buf.covered_since)
+        for last_update, sensor_value, sensor_data in buf:
+          metric = Record(id=None, board_id=board_id, sensor_type=series_type, sensor_data=sensor_data,
+                  sensor_value=sensor_value, last_update=last_update)
+          if in_range(metric, start, end) and in_values(metric, min_value, max_value):
+            output.append(metric)
+
+    output.sort(key=lambda metric: metric.last_update)
+
+    if last_available:
+      output = output[-last_available:]
+      # Newest last_available metrics are known when none can be missing after oldest of them
+      if len(output) == last_available and output[0].last_update >= covered_since:
+        return output
+
+    if start and start >= covered_since:
+      return output
+
+    return None
+
+  def snapshot(self):
+    with self._lock:
+      self.stats.gauge('series', len(self._buffers))
+      self.stats.gauge('metrics', sum(buf.size for buf in self._buffers.itervalues()))
+
+    return self.stats.snapshot()
@@ -1,24 +1,55 @@
+from threading import Lock
+import calendar
 import logging
 import time
 
-from sqlalchemy import Column, Integer, Text, Index, ForeignKey, desc, DDL, event, create_engine, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Float, Integer, LargeBinary, Text, Index, ForeignKey, and_, desc, DDL, event, create_engine, func, inspect, or_, text
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
+
+from meact import utils
+from meact.utils import chunk
 
 
 Base = declarative_base()
+# Metric partitions are created on demand, they are not part of create_db
+PartitionBase = declarative_base()
 LOG = logging.getLogger(__name__)
-
-class Metric(Base):
-  __tablename__ = 'metrics'
-
+UPSERT_STATEMENTS = {}
+SESSIONS = {}
+SESSIONS_LOCK = Lock()
+PARTITIONING = {}
+PARTITIONS = {}
+PARTITION_TABLES = {}
+PARTITIONS_LOCK = Lock()
+PARTITIONS_TTL = 60
+PARTITION_PREFIX = 'metrics_'
+CHUNKING = {}
+POOL_CLASSES = {
+  'queue': QueuePool,
+  'static': StaticPool,
+  'singleton': SingletonThreadPool,
+  'null': NullPool
+}
+# Order matters, journal_mode can't be changed when query_only is set
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size',
+        'mmap_size', 'temp_store', 'query_only')
+
+class MetricMixin(object):
   id = Column(Integer, primary_key=True)
-  board_id = Column(Text, ForeignKey("boards.board_id"), nullable=False)
+  board_id = Column(Text, nullable=False)
   sensor_type = Column(Text, nullable=False)
   sensor_data = Column(Text, nullable=False)
+  sensor_value = Column(Float)
   last_update = Column(Integer, nullable=False)
 
-  __table_args__ = (Index('idx_metrics', 'board_id', 'sensor_type', 'sensor_data', 'last_update'), )
+  # Index entries end with rowid (id), so equality on board_id and
+  # sensor_type gives rows ordered by last_update, id without sorting
+  @declared_attr
+  def __table_args__(cls):
+    return (Index('idx_' + cls.__tablename__, 'board_id', 'sensor_type', 'last_update'),
+            Index('idx_' + cls.__tablename__ + '_last_update', 'last_update'))
 
   def __repr__(self):
     return "<Metric(board_id='%s', sensor_type='%s', sensor_data='%s', 'last_update'='%s')>" % (
@@ -28,14 +59,72 @@ class Metric(Base):
             self.last_update)
 
 
+class Metric(MetricMixin, Base):
+  __tablename__ = 'metrics'
+
+  board_id = Column(Text, ForeignKey("boards.board_id"), nullable=False)
+
+
 class LastMetric(Base):
   __tablename__ = 'last_metrics'
 
   board_id = Column(Text, ForeignKey("boards.board_id"), nullable=False, primary_key=True)
   sensor_type = Column(Text, nullable=False, primary_key=True)
   sensor_data = Column(Text, nullable=False)
+  sensor_value = Column(Float)
   last_update = Column(Integer, nullable=False)
 
+  __table_args__ = (Index('idx_last_metrics', 'sensor_type'), )
+
+  def __repr__(self):
+    return "<Metric(board_id='%s', sensor_type='%s', sensor_data='%s', 'last_update'='%s')>" % (
+            self.board_id,
+            self.sensor_type,
+            self.sensor_data,
+            self.last_update)
+
+
+class MetricChunk(Base):
+  """Numeric metrics of single board_id, sensor_type compressed into BLOB
+
+  Chunk holds metrics from one interval (see connect), first_update
+  and last_update are timestamps of oldest and newest metric in chunk.
+  """
+  __tablename__ = 'metric_chunks'
+
+  id = Column(Integer, primary_key=True)
+  board_id = Column(Text, ForeignKey("boards.board_id"), nullable=False)
+  sensor_type = Column(Text, nullable=False)
+  first_update = Column(Integer, nullable=False)
+  last_update = Column(Integer, nullable=False)
+  count = Column(Integer, nullable=False)
+  data = Column(LargeBinary, nullable=False)
+
+  __table_args__ = (Index('idx_metric_chunks', 'board_id', 'sensor_type', 'last_update'),
+          Index('idx_metric_chunks_last_update', 'last_update'))
+
+  def __repr__(self):
+    return "<MetricChunk(board_id='%s', sensor_type='%s', first_update='%s', last_update='%s', count='%s')>" % (
+            self.board_id,
+            self.sensor_type,
+            self.first_update,
+            self.last_update,
+            self.count)
+
+
+class MetricPoint(object):
+  """Metric restored from MetricChunk, it has no id
+  """
+  __slots__ = ('id', 'board_id', 'sensor_type', 'sensor_data', 'sensor_value', 'last_update')
+
+  def __init__(self, board_id, sensor_type, sensor_value, last_update):
+    self.id = None
+    self.board_id = board_id
+    self.sensor_type = sensor_type
+    self.sensor_data = format_value(sensor_value)
+    self.sensor_value = sensor_value
+    self.last_update = last_update
+
   def __repr__(self):
     return "<Metric(board_id='%s', sensor_type='%s', sensor_data='%s', 'last_update'='%s')>" % (
             self.board_id,
@@ -65,7 +154,8 @@ class Action(Base):
   sensor_action_id = Column(Text, nullable=False)
   last_update = Column(Integer, nullable=False)
 
-  __table_args__ = (Index('idx_actions', 'board_id', 'sensor_type', 'sensor_action_id', 'last_update'), )
+  __table_args__ = (Index('idx_actions', 'board_id', 'sensor_type', 'sensor_action_id'),
+          Index('idx_actions_last_update', 'last_update'))
 
   def __repr__(self):
     return "<Action(board_id='%s', sensor_type='%s', sensor_action_id='%s', last_update='%s')>" % (
@@ -83,7 +173,8 @@ class Feed(Base):
   result = Column(Integer, nullable=False)
   last_update = Column(Integer, nullable=False)
 
-  __table_args__ = (Index('idx_feeds', 'feed_name', 'result', 'last_update'), )
+  __table_args__ = (Index('idx_feeds', 'feed_name', 'result'),
+          Index('idx_feeds_last_update', 'last_update'))
 
   def __repr__(self):
     return "<Feed(feed_name='%s', result='%s', last_update='%s')>" % (
@@ -92,52 +183,321 @@ class Feed(Base):
             self.last_update)
 
 
-def connect(connect_string):
-  return create_engine(connect_string, connect_args={'check_same_thread': False})
+def connect(connect_string, pool=None, sqlite=None, partitioning=None, chunks=None):
+  """Create engine for connect_string
+
+  partitioning = "month" stores metrics in per month tables
+  (metrics_YYYYMM), legacy metrics table is still read.
+
+  chunks enables reading of compressed metrics (see compress_metric),
+  interval is time range (seconds) of single chunk:
+  chunks = {
+    "interval": 86400
+  }
+
+  pool = {
+    "class": "queue",
+    "size": 5,
+    "max_overflow": 5,
+    "timeout": 30,
+    "recycle": 3600
+  }
+
+  sqlite profile is applied on every new SQLite connection:
+  sqlite = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    "cache_size": -8000,
+    "mmap_size": 67108864,
+    "temp_store": "memory",
+    "query_only": 0
+  }
+  """
+  engine_params = {
+    'connect_args': {'check_same_thread': False}
+  }
+
+  if pool:
+    pool_class = pool.get('class', 'queue')
+    engine_params['poolclass'] = POOL_CLASSES[pool_class]
+    engine_params['pool_recycle'] = pool.get('recycle', -1)
+
+    if pool_class == 'queue':
+      engine_params['pool_size'] = pool.get('size', 5)
+      engine_params['max_overflow'] = pool.get('max_overflow', 5)
+      engine_params['pool_timeout'] = pool.get('timeout', 30)
+
+  engine = create_engine(connect_string, **engine_params)
+
+  if sqlite and engine.dialect.name == 'sqlite':
+    event.listen(engine, 'connect', sqlite_profile(sqlite))
+
+  if partitioning:
+    if partitioning != 'month':
+      raise KeyError('Unknown partitioning {}'.format(partitioning))
+    PARTITIONING[engine] = partitioning
+
+  if chunks:
+    CHUNKING[engine] = {'interval': chunks.get('interval', 86400)}
+
+  return engine
+
+
+def sqlite_profile(profile):
+  unknown = set(profile) - set(SQLITE_PRAGMAS)
+  if unknown:
+    raise KeyError('Unknown SQLite pragma {}'.format(', '.join(unknown)))
+
+  pragmas = [(pragma, profile[pragma]) for pragma in SQLITE_PRAGMAS if pragma in profile]
+
+  def on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas:
+      cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+  return on_connect
 
 
 def create_session(db):
-  Session = sessionmaker()
-  Session.configure(bind=db)
+  """Return thread local session for db
+
+  Session factory is created once per engine, session is reused by
+  next calls on the same thread until it is closed (commit, fetch_all
+  or close_session). Session has to be closed on every error path,
+  failed session would break next queries of the thread.
+  """
+  Session = SESSIONS.get(db)
+
+  if Session is None:
+    with SESSIONS_LOCK:
+      Session = SESSIONS.setdefault(db, scoped_session(sessionmaker(bind=db)))
+
   return Session()
 
 
+def close_session(session, rollback=False):
+  """Close session and remove it from thread local registry
+
+  Use rollback on error paths, rollback expires loaded objects.
+  """
+  try:
+    if rollback:
+      session.rollback()
+  finally:
+    SESSIONS[session.bind].remove()
+
+
+def fetch_all(query):
+  try:
+    return query.all()
+  finally:
+    close_session(query.session)
+
+
 def create_db(db):
+  for table_name in inspect(db).get_table_names():
+    if table_name.startswith(PARTITION_PREFIX):
+      db.execute('DROP TABLE {}'.format(table_name))
+
+  PARTITION_TABLES.pop(db, None)
   Base.metadata.drop_all(db)
   Base.metadata.create_all(db)
 
 
+def partition_name(timestamp):
+  return time.strftime('%Y%m', time.gmtime(timestamp))
+
+
+def partition_range(partition):
+  """Return first and last second of partition
+  """
+  year, month = int(partition[:4]), int(partition[4:])
+  start = calendar.timegm((year, month, 1, 0, 0, 0))
+  if month == 12:
+    year, month = year + 1, 1
+  else:
+    month += 1
+  return start, calendar.timegm((year, month, 1, 0, 0, 0)) - 1
+
+
+def metric_partition(partition):
+  """Return mapped class for metrics partition table
+  """
+  table = PARTITIONS.get(partition)
+
+  if table is None:
+    with PARTITIONS_LOCK:
+      if partition not in PARTITIONS:
+        PARTITIONS[partition] = type(str('Metric' + partition), (MetricMixin, PartitionBase),
+                {'__tablename__': PARTITION_PREFIX + partition})
+      table = PARTITIONS[partition]
+
+  return table
+
+
+def _metric_partitions(db, required=None):
+  """Return sorted partitions existing in db
+
+  Partitions are cached for PARTITIONS_TTL seconds, cache is refreshed
+  earlier when required partition is not known.
+  """
+  refreshed, partitions = PARTITION_TABLES.get(db, (0, set()))
+
+  if time.time() - refreshed > PARTITIONS_TTL or (required and required not in partitions):
+    partitions = set(table_name[len(PARTITION_PREFIX):] for table_name in inspect(db).get_table_names()
+            if table_name.startswith(PARTITION_PREFIX))
+    PARTITION_TABLES[db] = (time.time(), partitions)
+
+  return sorted(partitions)
+
+
+def metric_tables(db, start=None, end=None):
+  """Return metric tables which can hold metrics between start and end
+
+  Tables are ordered from oldest, legacy metrics table is always first.
+  """
+  if not PARTITIONING.get(db):
+    return [Metric]
+
+  now = partition_name(time.time())
+  start_partition = partition_name(start) if start else None
+  end_partition = min(partition_name(end), now) if end else now
+
+  tables = [Metric]
+  for partition in _metric_partitions(db, end_partition):
+    if start_partition and partition < start_partition:
+      continue
+    if partition > end_partition:
+      continue
+    tables.append(metric_partition(partition))
+
+  return tables
+
+
+def _metric_table_for(db, timestamp):
+  if not PARTITIONING.get(db):
+    return Metric
+
+  partition = partition_name(timestamp)
+  table = metric_partition(partition)
+
+  if partition not in _metric_partitions(db, partition):
+    LOG.info("Creating metrics partition '%s'", table.__tablename__)
+    table.__table__.create(db, checkfirst=True)
+    refreshed, partitions = PARTITION_TABLES[db]
+    PARTITION_TABLES[db] = (refreshed, partitions | set([partition]))
+
+  return table
+
+
 def sync_board(db, boards_map):
   s = create_session(db)
 
-  s.query(Board).delete()
-  for board in boards_map.iteritems():
-    b = Board(board_id=board[0], board_desc=board[1])
-    s.add(b)
+  try:
+    s.query(Board).delete()
+    for board in boards_map.iteritems():
+      b = Board(board_id=board[0], board_desc=board[1])
+      s.add(b)
+  except:
+    close_session(s, rollback=True)
+    raise
+
   commit(s)
 
 
 def insert_metric(db, sensor_data):
-  s = create_session(db)
+  insert_metrics(db, [sensor_data])
+
+
+def insert_metrics(db, metrics):
+  """Insert batch of metrics in single transaction
+
+  sensor_data['last_update'] is used when present (time when
+  metric was received), otherwise current time is used.
+  """
+  if not metrics:
+    return
 
   now = int(time.time())
 
-  s.add(Metric(board_id = sensor_data['board_id'],
-          sensor_type = sensor_data['sensor_type'],
-          sensor_data = sensor_data['sensor_data'],
-          last_update = now))
+  rows = {}
+  last_rows = {}
+  for sensor_data in metrics:
+    row = {
+      'board_id': sensor_data['board_id'],
+      'sensor_type': sensor_data['sensor_type'],
+      'sensor_data': sensor_data['sensor_data'],
+      'sensor_value': utils.to_number(sensor_data['sensor_data']),
+      'last_update': sensor_data.get('last_update', now)
+    }
+    rows.setdefault(_metric_table_for(db, row['last_update']), []).append(row)
+    last_rows[(row['board_id'], row['sensor_type'])] = row
+
+  s = create_session(db)
+
+  try:
+    for table, table_rows in rows.iteritems():
+      s.bulk_insert_mappings(table, table_rows)
+
+    upsert = _upsert_statement(s.bind.dialect, LastMetric.__table__)
+    if upsert is not None:
+      s.execute(upsert, last_rows.values())
+    else:
+      _sync_last_metrics(s, last_rows)
+  except:
+    close_session(s, rollback=True)
+    raise
+
+  # Batch which was not saved has to be reported to caller
+  commit(s, raise_errors=True)
+
+
+def _sync_last_metrics(s, last_rows):
+  existing = s.query(LastMetric.board_id, LastMetric.sensor_type).filter(
+          LastMetric.board_id.in_(set(key[0] for key in last_rows)),
+          LastMetric.sensor_type.in_(set(key[1] for key in last_rows)))
+  existing = set((board_id, sensor_type) for board_id, sensor_type in existing)
+
+  s.bulk_update_mappings(LastMetric, [row for key, row in last_rows.iteritems() if key in existing])
+  s.bulk_insert_mappings(LastMetric, [row for key, row in last_rows.iteritems() if key not in existing])
+
+
+def _upsert_statement(dialect, table):
+  """Single statement INSERT or UPDATE for table primary key
+
+  Returns None when dialect has no upsert support, caller should
+  fallback to read-modify-write.
+  """
+  key = (dialect.name, table.name)
+  if key not in UPSERT_STATEMENTS:
+    UPSERT_STATEMENTS[key] = _build_upsert_statement(dialect, table)
 
-  last_metric = s.query(LastMetric).filter(LastMetric.board_id == sensor_data['board_id'],
-          LastMetric.sensor_type == sensor_data['sensor_type'])
-  if last_metric.scalar():
-    last_metric.update({'sensor_data': sensor_data['sensor_data'],
-        'last_update': now})
+  return UPSERT_STATEMENTS[key]
+
+
+def _build_upsert_statement(dialect, table):
+  columns = [column.name for column in table.columns]
+  primary_key = [column.name for column in table.primary_key]
+  values = [column for column in columns if column not in primary_key]
+
+  statement = 'INSERT INTO {table} ({columns}) VALUES ({params})'.format(
+          table=table.name,
+          columns=', '.join(columns),
+          params=', '.join(':' + column for column in columns))
+
+  if dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 24, 0) or dialect.name == 'postgresql':
+    statement += ' ON CONFLICT ({primary_key}) DO UPDATE SET {values}'.format(
+            primary_key=', '.join(primary_key),
+            values=', '.join('{0} = excluded.{0}'.format(column) for column in values))
+  elif dialect.name == 'mysql':
+    statement += ' ON DUPLICATE KEY UPDATE {values}'.format(
+            values=', '.join('{0} = VALUES({0})'.format(column) for column in values))
   else:
-    s.add(LastMetric(board_id = sensor_data['board_id'],
-        sensor_type = sensor_data['sensor_type'],
-        sensor_data = sensor_data['sensor_data'],
-        last_update = now))
-  commit(s)
+    return None
+
+  return text(statement)
 
 
 def prepare_board_ids(board_ids=None):
@@ -157,10 +517,10 @@ def get_board(db, board_ids=None):
   if board_ids:
     boards = boards.filter(Board.board_id.in_(board_ids))
 
-  return boards.all()
+  return fetch_all(boards)
 
 
-def prepare_metric(db, table, board_ids=None, sensor_type=None, start=None, end=None):
+def prepare_metric(db, table, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
   board_ids = prepare_board_ids(board_ids)
 
   s = create_session(db)
@@ -179,51 +539,313 @@ def prepare_metric(db, table, board_ids=None, sensor_type=None, start=None, end=
   if end:
     query = query.filter(table.last_update <= end)
 
+  if min_value is not None:
+    query = query.filter(table.sensor_value >= min_value)
+
+  if max_value is not None:
+    query = query.filter(table.sensor_value <= max_value)
+
   return query
 
 
-def get_last_metric(db, board_ids=None, sensor_type=None, start=None, end=None):
-  last_metrics = prepare_metric(db, LastMetric, board_ids, sensor_type, start, end)
+def get_last_metric(db, board_ids=None, sensor_type=None, start=None, end=None, min_value=None, max_value=None):
+  last_metrics = prepare_metric(db, LastMetric, board_ids, sensor_type, start, end, min_value, max_value)
+
+  return fetch_all(last_metrics)
 
-  return last_metrics.all()
 
+def get_metric(db, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None, max_value=None,
+        table=None):
+  """Return metrics ordered from oldest
 
-def get_metric(db, board_ids=None, sensor_type=None, start=None, end=None, last_available=None):
-  metrics = prepare_metric(db, Metric, board_ids, sensor_type, start, end)
+  Without table all metric tables (partitions) overlapping start/end
+  are queried, together with compressed chunks when enabled.
+  """
+  chunks = not table and db in CHUNKING
+  tables = [table] if table else metric_tables(db, start, end)
+  output = []
 
+  # Partitions are searched from newest until last_available metrics are found
   if last_available:
-    metrics = metrics.order_by(desc(Metric.id)).limit(last_available).from_self()
+    for table in reversed(tables):
+      metrics = prepare_metric(db, table, board_ids, sensor_type, start, end, min_value, max_value)
+      metrics = metrics.order_by(desc(table.last_update), desc(table.id)).limit(last_available - len(output))
+      output.extend(fetch_all(metrics))
+      if len(output) >= last_available:
+        break
+    output.reverse()
+  else:
+    for table in tables:
+      metrics = prepare_metric(db, table, board_ids, sensor_type, start, end, min_value, max_value)
+      output.extend(fetch_all(metrics.order_by(table.last_update, table.id)))
+
+  if chunks:
+    points = _get_chunk_metric(db, board_ids, sensor_type, start, end, last_available, min_value, max_value)
+    output = sorted(points + output, key=lambda metric: metric.last_update)
+    if last_available:
+      output = output[-last_available:]
+
+  return output
+
 
-  return metrics.order_by(Metric.id).all()
+def _get_chunk_metric(db, board_ids=None, sensor_type=None, start=None, end=None, last_available=None, min_value=None,
+        max_value=None):
+  """Return metrics from compressed chunks ordered from oldest
 
+  With last_available chunks are read from newest until no other
+  chunk can hold one of last_available newest metrics.
+  """
+  board_ids = prepare_board_ids(board_ids)
 
-def get_metric_aggregated(db, sensor_type=None, start=None, end=None):
   s = create_session(db)
-  query = s.query(Metric.id,
-          Metric.board_id,
-          Metric.sensor_type,
-          func.sum(Metric.sensor_data).label('total'),
-          func.count(Metric.sensor_data).label('count'))
+  query = s.query(MetricChunk)
+
+  if board_ids:
+    query = query.filter(MetricChunk.board_id.in_(board_ids))
 
   if sensor_type:
-    query = query.filter(Metric.sensor_type == sensor_type)
+    query = query.filter(MetricChunk.sensor_type == sensor_type)
 
   if start:
-    query = query.filter(Metric.last_update >= start)
+    query = query.filter(MetricChunk.last_update >= start)
 
   if end:
-    query = query.filter(Metric.last_update <= end)
+    query = query.filter(MetricChunk.first_update <= end)
+
+  output = []
+  try:
+    for metric_chunk in query.order_by(desc(MetricChunk.last_update)).yield_per(10):
+      if last_available and len(output) >= last_available and metric_chunk.last_update < output[-last_available].last_update:
+        break
+
+      for last_update, sensor_value in chunk.decode(metric_chunk.data):
+        if start and last_update < start or end and last_update > end:
+          continue
+        if min_value is not None and sensor_value < min_value or max_value is not None and sensor_value > max_value:
+          continue
+        output.append(MetricPoint(metric_chunk.board_id, metric_chunk.sensor_type, sensor_value, last_update))
+
+      output.sort(key=lambda metric: metric.last_update)
+  finally:
+    close_session(s)
+
+  return output
 
-  metrics = query.group_by(Metric.sensor_type, Metric.board_id)
 
-  return metrics.all()
+def format_value(value):
+  """Return sensor_data for numeric sensor_value
+  """
+  if value.is_integer() and abs(value) < 1e15:
+    return str(int(value))
 
-def update_metric(db, metric_id=None, sensor_data=None):
+  return repr(value)
+
+
+def compress_metric(db, end, execute=False):
+  """Move numeric metrics older than end into compressed chunks
+
+  Only whole chunks (interval aligned) are compressed, metrics which
+  sensor_data can not be restored from sensor_value stay in metric
+  tables. Metrics of already existing chunk are merged into it.
+  Yields (table name, board_id, sensor_type, number of metrics, size
+  of chunks in bytes) for every compressed series.
+  """
+  interval = CHUNKING[db]['interval']
+  end -= end % interval
+
+  for table in metric_tables(db, end=end):
+    table_name = table.__tablename__
+
+    s = create_session(db)
+    series = fetch_all(s.query(table.board_id, table.sensor_type).filter(
+            table.last_update < end, table.sensor_value != None).distinct())
+
+    for board_id, sensor_type in series:
+      s = create_session(db)
+      try:
+        metrics = s.query(table.id, table.sensor_data, table.sensor_value, table.last_update).filter(
+                table.board_id == board_id,
+                table.sensor_type == sensor_type,
+                table.last_update < end,
+                table.sensor_value != None).order_by(table.last_update, table.id)
+
+        windows = {}
+        ids_to_delete = []
+        for metric in metrics:
+          if format_value(metric.sensor_value) == metric.sensor_data:
+            windows.setdefault(metric.last_update - metric.last_update % interval, []).append(
+                    (metric.last_update, metric.sensor_value))
+            ids_to_delete.append(metric.id)
+
+        size = 0
+        for chunk_start in sorted(windows):
+          points = windows[chunk_start]
+          metric_chunk = s.query(MetricChunk).filter(
+                  MetricChunk.board_id == board_id,
+                  MetricChunk.sensor_type == sensor_type,
+                  MetricChunk.last_update >= chunk_start,
+                  MetricChunk.first_update < chunk_start + interval).first()
+
+          if metric_chunk:
+            points = sorted(chunk.decode(metric_chunk.data) + points, key=lambda point: point[0])
+          else:
+            metric_chunk = MetricChunk(board_id=board_id, sensor_type=sensor_type)
+            s.add(metric_chunk)
+
+          metric_chunk.data = chunk.encode(points)
+          metric_chunk.count = len(points)
+          metric_chunk.first_update = points[0][0]
+          metric_chunk.last_update = points[-1][0]
+          size += len(metric_chunk.data)
+
+        if execute:
+          for i in range(0, len(ids_to_delete), 500):
+            s.query(table).filter(table.id.in_(ids_to_delete[i:i + 500])).delete(False)
+      except:
+        close_session(s, rollback=True)
+        raise
+
+      if execute:
+        commit(s)
+      else:
+        close_session(s)
+
+      yield table_name, board_id, sensor_type, len(ids_to_delete), size
+
+
+def get_metric_aggregated(db, sensor_type=None, start=None, end=None, table=Metric):
   s = create_session(db)
-  metric = s.query(Metric).filter(Metric.id == metric_id).first()
-  if metric and sensor_data:
-    metric.sensor_data = sensor_data
-    commit(s)
+  query = s.query(table.id,
+          table.board_id,
+          table.sensor_type,
+          func.sum(table.sensor_value).label('total'),
+          func.count(table.sensor_value).label('count'))
+
+  if sensor_type:
+    query = query.filter(table.sensor_type == sensor_type)
+
+  if start:
+    query = query.filter(table.last_update >= start)
+
+  if end:
+    query = query.filter(table.last_update <= end)
+
+  metrics = query.group_by(table.sensor_type, table.board_id)
+
+  return fetch_all(metrics)
+
+def update_metric(db, metric_id=None, sensor_data=None, table=Metric):
+  s = create_session(db)
+
+  try:
+    metric = s.query(table).filter(table.id == metric_id).first()
+    if metric and sensor_data:
+      metric.sensor_data = sensor_data
+      metric.sensor_value = utils.to_number(sensor_data)
+  except:
+    close_session(s, rollback=True)
+    raise
+
+  commit(s)
+
+
+def migrate_sensor_value(db, chunk_size=1000, execute=False):
+  """Add sensor_value column and backfill it from sensor_data
+
+  Rows are updated in chunks (one transaction per chunk), yields
+  (table name, number of rows with numeric sensor_data) per chunk.
+  """
+  for table in (Metric, LastMetric):
+    table_name = table.__tablename__
+    columns = [column['name'] for column in inspect(db).get_columns(table_name)]
+
+    if 'sensor_value' not in columns:
+      LOG.info("Adding sensor_value column to '%s'", table_name)
+      if not execute:
+        continue
+      db.execute('ALTER TABLE {} ADD COLUMN sensor_value FLOAT'.format(table_name))
+
+    primary_key = list(table.__table__.primary_key)
+    last_key = None
+
+    while True:
+      s = create_session(db)
+      query = s.query(*(primary_key + [table.sensor_data])).filter(table.sensor_value == None)
+
+      if last_key is not None:
+        query = query.filter(_after_key(primary_key, last_key))
+
+      try:
+        rows = query.order_by(*primary_key).limit(chunk_size).all()
+        values = []
+        for row in rows:
+          value = utils.to_number(row.sensor_data)
+          if value is not None:
+            mapping = dict((column.name, row[idx]) for idx, column in enumerate(primary_key))
+            mapping['sensor_value'] = value
+            values.append(mapping)
+
+        if rows and execute:
+          s.bulk_update_mappings(table, values)
+      except:
+        close_session(s, rollback=True)
+        raise
+
+      if not rows:
+        close_session(s)
+        break
+
+      if execute:
+        commit(s)
+      else:
+        close_session(s)
+
+      last_key = rows[-1][:len(primary_key)]
+      yield table_name, len(values)
+
+
+def migrate_indexes(db, execute=False):
+  """Replace indexes which differ from ones defined in models
+
+  Metric partitions are included. Yields (table name, index name, action)
+  where action is 'drop' or 'create'.
+  """
+  tables = [Metric.__table__, LastMetric.__table__, MetricChunk.__table__, Action.__table__, Feed.__table__]
+  tables.extend(table.__table__ for table in metric_tables(db)[1:])
+  inspector = inspect(db)
+  table_names = inspector.get_table_names()
+
+  for table in tables:
+    if table.name not in table_names:
+      continue
+
+    existing = dict((index['name'], index['column_names']) for index in inspector.get_indexes(table.name))
+    expected = dict((index.name, index) for index in table.indexes)
+
+    for name in sorted(existing):
+      if name not in expected or existing[name] != [column.name for column in expected[name].columns]:
+        LOG.info("Dropping index '%s' on '%s'", name, table.name)
+        if execute:
+          db.execute('DROP INDEX {}'.format(name))
+        yield table.name, name, 'drop'
+
+    for name in sorted(expected):
+      if existing.get(name) != [column.name for column in expected[name].columns]:
+        LOG.info("Creating index '%s' on '%s'", name, table.name)
+        if execute:
+          expected[name].create(db)
+        yield table.name, name, 'create'
+
+
+def _after_key(columns, key):
+  """Keyset pagination filter, (c1, c2) > (k1, k2)
+  """
+  clauses = []
+  for idx, column in enumerate(columns):
+    equal = [columns[i] == key[i] for i in range(idx)]
+    clauses.append(and_(*(equal + [column > key[idx]])))
+
+  return or_(*clauses)
 
 
 def get_action(db, board_ids=None, sensor_type=None, sensor_action_id=None, start=None, end=None, last_available=None):
@@ -248,22 +870,43 @@ def get_action(db, board_ids=None, sensor_type=None, sensor_action_id=None, star
     query = query.filter(Action.last_update <= end)
 
   if last_available:
-    query = query.order_by(desc(Action.id)).limit(last_available).from_self()
+    actions = fetch_all(query.order_by(desc(Action.id)).limit(last_available))
+    actions.reverse()
+    return actions
 
-  return query.order_by(Action.id).all()
+  return fetch_all(query.order_by(Action.id))
 
 
 def insert_action(db, board_id, sensor_type, sensor_action_id):
-  s = create_session(db)
+  insert_actions(db, [{'board_id': board_id, 'sensor_type': sensor_type, 'sensor_action_id': sensor_action_id}])
+
+
+def insert_actions(db, actions):
+  """Insert batch of actions in single transaction
+
+  action['last_update'] is used when present (time when action was
+  executed), otherwise current time is used.
+  """
+  if not actions:
+    return
 
   now = int(time.time())
 
-  s.add(Action(board_id = board_id,
-          sensor_type = sensor_type,
-          sensor_action_id = sensor_action_id,
-          last_update = now))
+  s = create_session(db)
 
-  commit(s)
+  try:
+    s.bulk_insert_mappings(Action, [{
+      'board_id': action['board_id'],
+      'sensor_type': action['sensor_type'],
+      'sensor_action_id': action['sensor_action_id'],
+      'last_update': action.get('last_update', now)
+    } for action in actions])
+  except:
+    close_session(s, rollback=True)
+    raise
+
+  # Batch which was not saved has to be reported to caller
+  commit(s, raise_errors=True)
 
 
 def get_feed(db, feed_name=None, result=None, start=None, end=None, last_available=None):
@@ -274,7 +917,8 @@ def get_feed(db, feed_name=None, result=None, start=None, end=None, last_availab
   if feed_name:
     query = query.filter(Feed.feed_name == feed_name)
 
-  if result:
+  # result 0 (success) is a filter too
+  if result is not None:
     query = query.filter(Feed.result == result)
 
   if start:
@@ -284,9 +928,11 @@ def get_feed(db, feed_name=None, result=None, start=None, end=None, last_availab
     query = query.filter(Feed.last_update <= end)
 
   if last_available:
-    query = query.order_by(desc(Feed.id)).limit(last_available).from_self()
+    feeds = fetch_all(query.order_by(desc(Feed.id)).limit(last_available))
+    feeds.reverse()
+    return feeds
 
-  return query.order_by(Feed.id).all()
+  return fetch_all(query.order_by(Feed.id))
 
 
 def insert_feed(db, feed_name, result):
@@ -301,21 +947,154 @@ def insert_feed(db, feed_name, result):
   commit(s)
 
 
+def delete_metric(db, start=None, end=None, execute=False):
+  """Remove metrics between start and end
+
+  Past partitions fully covered by start/end are dropped, other
+  tables are cleaned with range delete. Compressed chunks partially
+  covered by start/end are rewritten. Yields (table name, number
+  of metrics, dropped) for every table.
+  """
+  for table in metric_tables(db, start, end):
+    table_name = table.__tablename__
+    drop = False
+
+    if table is not Metric and end:
+      partition_start, partition_end = partition_range(table_name[len(PARTITION_PREFIX):])
+      drop = (not start or start <= partition_start) and end >= partition_end and partition_end < time.time()
+
+    s = create_session(db)
+    query = s.query(table)
+
+    if start and not drop:
+      query = query.filter(table.last_update >= start)
+
+    if end and not drop:
+      query = query.filter(table.last_update <= end)
+
+    try:
+      count = query.count()
+      if execute and not drop:
+        query.delete(False)
+    except:
+      close_session(s, rollback=True)
+      raise
+
+    if not execute:
+      close_session(s)
+    elif drop:
+      close_session(s)
+      table.__table__.drop(db)
+      PARTITION_TABLES.pop(db, None)
+    else:
+      commit(s)
+
+    yield table_name, count, drop
+
+  if db in CHUNKING:
+    yield MetricChunk.__tablename__, _delete_chunk_metric(db, start, end, execute), False
+
+
+def _delete_chunk_metric(db, start=None, end=None, execute=False):
+  s = create_session(db)
+  query = s.query(MetricChunk)
+
+  if start:
+    query = query.filter(MetricChunk.last_update >= start)
+
+  if end:
+    query = query.filter(MetricChunk.first_update <= end)
+
+  count = 0
+  try:
+    for metric_chunk in query.all():
+      if (not start or start <= metric_chunk.first_update) and (not end or metric_chunk.last_update <= end):
+        count += metric_chunk.count
+        s.delete(metric_chunk)
+        continue
+
+      points = [point for point in chunk.decode(metric_chunk.data)
+              if start and point[0] < start or end and point[0] > end]
+      count += metric_chunk.count - len(points)
+      metric_chunk.data = chunk.encode(points)
+      metric_chunk.count = len(points)
+      metric_chunk.first_update = points[0][0]
+      metric_chunk.last_update = points[-1][0]
+  except:
+    close_session(s, rollback=True)
+    raise
+
+  if execute:
+    commit(s)
+  else:
+    close_session(s)
+
+  return count
+
+
+def delete_action(db, start=None, end=None, execute=False):
+  """Remove actions between start and end, returns number of actions
+  """
+  return _delete_range(db, Action, start, end, execute)
+
+
+def delete_feed(db, start=None, end=None, execute=False):
+  """Remove feeds between start and end, returns number of feeds
+  """
+  return _delete_range(db, Feed, start, end, execute)
+
+
+def _delete_range(db, table, start=None, end=None, execute=False):
+  s = create_session(db)
+  query = s.query(table)
+
+  if start:
+    query = query.filter(table.last_update >= start)
+
+  if end:
+    query = query.filter(table.last_update <= end)
+
+  try:
+    count = query.count()
+    if execute:
+      query.delete(False)
+  except:
+    close_session(s, rollback=True)
+    raise
+
+  if execute:
+    commit(s)
+  else:
+    close_session(s)
+
+  return count
+
+
 def delete_row(db, table, record_ids=None):
   if record_ids:
     s = create_session(db)
-    query = s.query(table).filter(table.id.in_(record_ids)).delete('fetch')
+
+    try:
+      s.query(table).filter(table.id.in_(record_ids)).delete('fetch')
+    except:
+      close_session(s, rollback=True)
+      raise
+
     commit(s)
 
 
-def commit(session=None):
+def commit(session=None, raise_errors=False):
+  """Commit and close session, errors are logged (and raised with raise_errors)
+  """
   if session:
     try:
       session.commit()
-    except:
-      LOG.error('Fail to commit data')
+    except Exception as e:
+      LOG.error("Fail to commit data '%s'", e)
       session.rollback()
+      if raise_errors:
+        raise
     finally:
-      session.close()
+      close_session(session)
   else:
     LOG.warning('No session was provided for commit')
@@ -5,23 +5,32 @@ import logging
 import sys
 import time
 
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import SQLAlchemyError
 
-from meact import database
+from meact import backends
 from meact import mqtt
 from meact import utils
+from meact.utils.queues import EventQueue
+from meact.utils.stats import Stats
 
 
 class Dbsm(mqtt.Mqtt):
-  def __init__(self, db_string, mqtt_config):
+  def __init__(self, db_string, mqtt_config, batch_size=1, flush_interval=0, stats_interval=60, db_pool=None, db_sqlite=None, db_partitioning=None,
+          queue_size=0, queue_policy='block', queue_spill_file=None):
     super(Dbsm, self).__init__()
     self.name = 'dbsm'
     self.enabled = Event()
     self.enabled.set()
     self.status = {'dbsm': 1}
-    self.db = database.connect(db_string)
+    self.db = backends.connect(db_string, pool=db_pool, sqlite=db_sqlite,
+            partitioning=db_partitioning)
     self.mqtt_config = mqtt_config
-    self.metric_queue = Queue.Queue()
+    self.metric_queue = EventQueue(queue_size, queue_policy, queue_spill_file)
+    self.batch_size = max(batch_size, 1)
+    self.flush_interval = flush_interval
+    self.stats = Stats()
+    self.stats_interval = stats_interval
+    self._stats_published = time.time()
 
     self.start_mqtt()
 
@@ -29,7 +38,51 @@ class Dbsm(mqtt.Mqtt):
     sensor_data = utils.prepare_sensor_data_mqtt(msg)
 
     if sensor_data:
-      self.metric_queue.put(sensor_data)
+      sensor_data['last_update'] = int(time.time())
+      self.metric_queue.put(0, sensor_data)
+
+  def _get_batch(self):
+    try:
+      batch = [self.metric_queue.get(True, 5)[1]]
+    except (Queue.Empty) as e:
+      return []
+
+    flush_at = time.time() + self.flush_interval
+    while len(batch) < self.batch_size:
+      timeout = flush_at - time.time()
+      try:
+        if timeout > 0:
+          batch.append(self.metric_queue.get(True, timeout)[1])
+        else:
+          batch.append(self.metric_queue.get(False)[1])
+      except (Queue.Empty) as e:
+        break
+
+    return batch
+
+  def _save_batch(self, batch):
+    LOG.debug("Saving %d metrics '%s'", len(batch), batch)
+
+    start = time.time()
+    try:
+      self.db.insert_metrics(batch)
+    except SQLAlchemyError as e:
+      LOG.error("Fail to save data '%s'", e)
+      self.stats.incr('failed', len(batch))
+    else:
+      self.stats.incr('saved', len(batch))
+
+    self.stats.observe('batch_size', len(batch))
+    self.stats.observe('commit_latency', (time.time() - start) * 1000)
+
+  def _publish_stats(self):
+    if not self.stats_interval or time.time() - self._stats_published < self.stats_interval:
+      return
+
+    self._stats_published = time.time()
+    stats = self.stats.snapshot()
+    stats.update(('metric_queue/' + name, value) for name, value in self.metric_queue.snapshot().iteritems())
+    self.publish_stats(stats)
 
   def run(self):
     LOG.info('Starting')
@@ -37,17 +90,12 @@ class Dbsm(mqtt.Mqtt):
     self.publish_status()
     while True:
       self.enabled.wait()
-      try:
-        sensor_data = self.metric_queue.get(True, 5)
-      except (Queue.Empty) as e:
-        continue
+      batch = self._get_batch()
 
-      LOG.debug("Got new metric '%s'", sensor_data)
+      if batch:
+        self._save_batch(batch)
 
-      try:
-        database.insert_metric(self.db, sensor_data)
-      except OperationalError as e:
-        LOG.error("Fail to save data '%s'", e)
+      self._publish_stats()
 
 
 LOG = logging.getLogger(__name__)
@@ -64,7 +112,16 @@ def main():
 
   dbsm = Dbsm(
     db_string=conf['db_string'],
-    mqtt_config=conf['mqtt'])
+    db_pool=conf.get('db_pool'),
+    db_sqlite=conf.get('db_sqlite'),
+    db_partitioning=conf.get('db_partitioning'),
+    mqtt_config=conf['mqtt'],
+    batch_size=conf.get('batch_size', 1),
+    flush_interval=conf.get('flush_interval', 0),
+    stats_interval=conf.get('stats_interval', 60),
+    queue_size=conf.get('queue_size', 0),
+    queue_policy=conf.get('queue_policy', 'block'),
+    queue_spill_file=conf.get('queue_spill_file'))
 
   dbsm.run()
 
@@ -1,9 +1,6 @@
 #!/usr/bin/env python
-from multiprocessing import Process
 from threading import Event
 import Queue
-import hashlib
-import json
 import logging
 import random
 import signal
@@ -11,38 +8,40 @@ import time
 
 from sqlalchemy.exc import OperationalError
 
-from meact import database
+from meact import backends
 from meact import mqtt
 from meact import utils
 from meact.executor import actions
-
-class SensorActionAdapter(dict):
-  """Adapter for sensor action from SensorConfig
-  """
-  def __init__(self, *args, **kwargs):
-    super(SensorActionAdapter, self).__init__(*args, **kwargs)
-    self_as_str = json.dumps(self)
-    self['id'] = hashlib.md5(self_as_str).hexdigest()
-
-  def action_for_board(self, board_id):
-    if self['board_ids'] and board_id in self['board_ids']:
-      return True
-    elif not self['board_ids']:
-      return True
-    return False
+from meact.executor import plan
+from meact.executor.cooldown import CooldownTracker
+from meact.executor.dispatch import Dispatcher
+from meact.executor.outbox import Outbox
+from meact.executor.pool import WorkerPool
+from meact.utils.queues import EventQueue
 
 
 class Executor(mqtt.Mqtt):
-  def __init__(self, db_string, sensors_map_file, action_config, mqtt_config):
+  def __init__(self, db_string, sensors_map_file, action_config, mqtt_config, db_pool=None, db_sqlite=None, db_partitioning=None,
+          db_chunks=None, stats_interval=60, metric_buffer_size=128, action_workers=2,
+          action_threads=4, action_batch_size=100, action_flush_interval=5, queue_size=0, queue_policy='block',
+          queue_spill_file=None, outbox_file=None, action_backoff=5, action_max_backoff=300, action_max_age=0):
     super(Executor, self).__init__()
     self.name = 'executor'
     self.enabled = Event()
     self.enabled.set()
     self.status = {'executor': 1, 'armed': 1}
-    self.db = database.connect(db_string)
+    self.db = backends.connect(db_string, pool=db_pool, sqlite=db_sqlite,
+            partitioning=db_partitioning, chunks=db_chunks)
     self.action_config = action_config
     self.mqtt_config = mqtt_config
-    self.action_queue = Queue.PriorityQueue()
+    self.stats_interval = stats_interval
+    self._stats_published = time.time()
+
+    self.action_queue = EventQueue(queue_size, queue_policy, queue_spill_file)
+    self.last_metric_cache = None
+    self.metric_windows = None
+    # Set by SIGHUP, maps are refreshed from run()
+    self._refresh = False
 
     signal.signal(signal.SIGHUP, self._handle_signal)
     signal.signal(signal.SIGUSR1, self._handle_signal)
@@ -50,22 +49,55 @@ class Executor(mqtt.Mqtt):
     self.sensors_map_file = sensors_map_file
     self._validate_sensors_map(self.sensors_map_file)
 
+    # Last metrics and metrics used by check_metric are served from memory
+    # when metric stream is available, boards are kept in boards_map
+    if self.mqtt_config.get('topic', {}).get('subscribe', {}).get('dbsm/metric'):
+      self.db = self.last_metric_cache = backends.LastMetricCache(self.db, boards_ttl=0)
+      self.last_metric_cache.seed()
+      self.db = self.metric_windows = backends.MetricWindows(self.db, self._metric_windows(), metric_buffer_size)
+
     self._get_boards(self.db)
 
+    # Last action times are kept in memory, actions are saved in batches
+    self.cooldown = CooldownTracker(self.db, action_batch_size, action_flush_interval)
+    self.cooldown.load(self._action_window())
+
+    # Workers are forked before MQTT thread is started
+    self.action_pool = WorkerPool(action_workers)
+    # Triggered rules are journaled to outbox_file, failed actions are
+    # retried until action_max_age (or max_age in action_config)
+    self.dispatcher = Dispatcher(self._action_execute, self._action_done, action_threads,
+            dict((name, config['concurrency']) for name, config in self.action_config.iteritems()
+                    if config.get('concurrency')),
+            Outbox(outbox_file), self._find_rule, action_backoff, action_max_backoff, action_max_age)
+
     self.start_mqtt()
 
   def _handle_signal(self, signum, stack):
+    # Handler runs on main thread, it could interrupt it while lock
+    # (metric windows, cooldown) is held, refresh is done in run()
     if signum == signal.SIGHUP:
-      LOG.info('Refreshing boards and sensors map')
-      self._get_boards(self.db)
-      self._validate_sensors_map(self.sensors_map_file)
+      self._refresh = True
     elif signum == signal.SIGUSR1:
       LOG.info("Action config: %s", self.action_config)
       LOG.info("Sensors map: %s", self.sensors_map)
       LOG.info("Boards map: %s", self.boards_map)
 
+  def _refresh_maps(self):
+    LOG.info('Refreshing boards and sensors map')
+    self._refresh = False
+    self._get_boards(self.db)
+    self._validate_sensors_map(self.sensors_map_file)
+    if self.metric_windows:
+      self.metric_windows.set_windows(self._metric_windows())
+    self.cooldown.load(self._action_window())
 
   def _validate_sensors_map(self, sensors_map_file):
+    """Compile valid sensor configs into plans
+
+    Lambdas, templates and action configs are prepared here, so
+    _action_helper only executes plan.
+    """
     sensors_map = utils.load_config(sensors_map_file)
     self.sensors_map = dict()
 
@@ -73,13 +105,46 @@ class Executor(mqtt.Mqtt):
       sensor_config = sensors_map[sensor_type]
       validation_result, sensor_config = utils.validate_sensor_config(sensor_config)
 
-      if validation_result:
-        for idx, action in enumerate(sensor_config['actions']):
-          sensor_config['actions'][idx] = SensorActionAdapter(action)
-        self.sensors_map[sensor_type] = sensor_config
+      if not validation_result:
+        continue
+
+      try:
+        self.sensors_map[sensor_type] = plan.compile_sensor_config(sensor_type, sensor_config, self.action_config,
+                ACTIONS_MAPPING)
+      except ValueError as e:
+        LOG.error("Fail to compile sensor config for '%s' '%s'", sensor_type, e)
+
+  def _metric_windows(self):
+    """Return time window (seconds) of Metric check_metric per sensor_type
+    """
+    windows = {}
+    for sensor_plan in self.sensors_map.itervalues():
+      for rule in sensor_plan.rules:
+        for check_metric in rule.check_metric:
+          if not check_metric.sensor_type or check_metric.value_type != 'Metric':
+            continue
+          window = -(check_metric.start_offset or 0)
+          windows[check_metric.sensor_type] = max(windows.get(check_metric.sensor_type, 0), window, 0)
+
+    return windows
+
+  def _action_window(self):
+    """Return longest action_interval (seconds)
+    """
+    return max([0] + [rule.action_interval for sensor_plan in self.sensors_map.itervalues()
+            for rule in sensor_plan.rules])
+
+  def _find_rule(self, sensor_type, rule_id):
+    sensor_plan = self.sensors_map.get(sensor_type)
+    if not sensor_plan:
+      return None
+
+    for rule in sensor_plan.rules:
+      if rule.id == rule_id:
+        return rule
 
   def _get_boards(self, db):
-    boards = database.get_board(db)
+    boards = db.get_board()
     self.boards_map = dict((board.board_id, board.board_desc) for board in boards)
 
   def _on_mgmt_status(self, client, userdata, msg):
@@ -103,12 +168,16 @@ class Executor(mqtt.Mqtt):
   def _on_message(self, client, userdata, msg):
     sensor_data, sensor_config = self._prepare_data(msg)
 
+    if sensor_data and self.last_metric_cache and self.topic_matches('dbsm/metric', msg.topic):
+      self.last_metric_cache.update(sensor_data)
+      self.metric_windows.update(sensor_data)
+
     if not sensor_data or not sensor_config:
       return
 
-    priority = sensor_config['priority']
-
-    self.action_queue.put((priority, sensor_data, sensor_config))
+    # Stale events of coalesced sensor types are replaced with newest one
+    key = (sensor_data['board_id'], sensor_data['sensor_type']) if sensor_config.coalesce else None
+    self.action_queue.put(sensor_config.priority, sensor_data, key)
 
   def _prepare_data(self, mqtt_msg):
     sensor_data = utils.prepare_sensor_data_mqtt(mqtt_msg)
@@ -133,162 +202,121 @@ class Executor(mqtt.Mqtt):
 
     return sensor_configs
 
-  def _action_execute(self, sensor_data, actions, global_action_config, sensor_action_config):
-    result = 0
+  def _action_execute(self, sensor_data, action):
+    LOG.debug("Action execute '%s'", action.name)
+    return self.action_pool.execute(action.name, action.func, (sensor_data, action.config), action.timeout)
 
-    for action in actions:
-      LOG.debug("Action execute '%s'", action)
-
-      action_name = action['name']
-      action_func = ACTIONS_MAPPING.get(action_name)
-
-      action_config = global_action_config.get(action_name, {})
-      sensor_config = sensor_action_config.get(action_name, {})
-      action_config.update(sensor_config)
-
-      action_func_timeout = action_config.get('timeout') or action_func.get('timeout')
-
-      if not action_func:
-        LOG.warning('Unknown action %s', action_name)
-        continue
-
-      p = Process(target=action_func.get('func'), args=(sensor_data, action_config))
-      p.start()
-      p.join(action_func_timeout)
-      if p.is_alive():
-        p.terminate()
-        status = 255
-      else:
-        status = p.exitcode
-
-      if status:
-        LOG.error("Fail to execute action '%s', exitcode '%d'", action_name, status)
-        failback_actions = action.get('failback')
-        if failback_actions:
-          LOG.debug("Failback '%s'", failback_actions)
-          result += self._action_execute(sensor_data, failback_actions, global_action_config, sensor_action_config)
-      else:
-        result += 1
-
-    return result
+  def _action_done(self, sensor_data, rule, result):
+    if result:
+      self.cooldown.executed(sensor_data['board_id'], sensor_data['sensor_type'], rule.id)
 
   def _check_status(self, sensor_check_status):
-    check_status_result = True
     for check_status in sensor_check_status:
-      _, check_status_result = utils.treshold_helper(check_status['threshold'],
-              self.status.get(check_status['name']))
+      _, check_status_result = check_status.threshold(self.status.get(check_status.name))
       if not check_status_result:
-        break
+        return False
 
-    return check_status_result
+    return True
 
   def _check_metric(self, sensor_check_metric, sensor_data):
-    check_metric_result = True
     for check_metric in sensor_check_metric:
-      board_ids = check_metric.get('board_ids', [])
-      board_ids = map(lambda x: x.format(**sensor_data), board_ids)
+      board_ids = [board_id.render(sensor_data) for board_id in check_metric.board_ids]
 
       try:
-        metrics = self._get_value_count(check_metric['value_count'],
+        metrics = self._get_value_count({'type': check_metric.value_type, 'count': check_metric.count},
                 board_ids,
-	        check_metric.get('sensor_type'),
-	        check_metric.get('start_offset'),
-	        check_metric.get('end_offset'))
+                check_metric.sensor_type,
+                check_metric.start_offset,
+                check_metric.end_offset,
+                check_metric.min_value,
+                check_metric.max_value)
       except OperationalError as e:
         LOG.error("Fail to get metrics '%s'", e)
-        check_metric_result = False
-        break
+        return False
 
-      _, check_metric_result = utils.treshold_helper(check_metric['threshold'],
-              metrics)
+      _, check_metric_result = check_metric.threshold(metrics)
 
       if not check_metric_result:
-        break
+        return False
 
-    return check_metric_result
+    return True
 
   def _check_action_interval(self, sensor_data, sensor_action_id, action_interval):
     try:
-      last_actions = database.get_action(self.db, board_ids=sensor_data['board_id'],
-              sensor_type=sensor_data['sensor_type'],
-              sensor_action_id=sensor_action_id,
-              last_available=1)
+      last_action = self.cooldown.last_executed(sensor_data['board_id'], sensor_data['sensor_type'], sensor_action_id)
     except OperationalError as e:
-      last_actions = None
-      LOG.error("Fail to get action '%s'", e)
-
-    if not last_actions:
       last_action = 0
-    else:
-      last_action = last_actions[0].last_update
+      LOG.error("Fail to get action '%s'", e)
 
     return utils.time_offset(-last_action) > action_interval
 
-  def _get_value_count(self, value_count, board_ids=None, sensor_type=None, start_offset=None, end_offset=None):
+  def _get_value_count(self, value_count, board_ids=None, sensor_type=None, start_offset=None, end_offset=None,
+          min_value=None, max_value=None):
     db_params = {
-      'db': self.db,
       'board_ids': board_ids,
       'sensor_type': sensor_type,
       'start': utils.time_offset(start_offset),
-      'end': utils.time_offset(end_offset)
+      'end': utils.time_offset(end_offset),
+      'min_value': min_value,
+      'max_value': max_value
     }
 
     if value_count['type'] == 'Metric':
       db_params['last_available'] = value_count['count']
-      metrics = database.get_metric(**db_params)
+      metrics = self.db.get_metric(**db_params)
     elif value_count['type'] == 'LastMetric':
-      metrics = database.get_last_metric(**db_params)
+      metrics = self.db.get_last_metric(**db_params)
     else:
       metrics = []
 
     return metrics
 
-  def _action_helper(self, sensor_data, sensor_config, action_config=None):
+  def _action_helper(self, sensor_data, sensor_plan):
 
-    LOG.debug("Action helper '%s' '%s'", sensor_data, sensor_config['actions'])
-    for sensor_action in sensor_config['actions']:
-
-      #Check if config is for given board
-      if not sensor_action.action_for_board(sensor_data['board_id']):
-        continue
+    LOG.debug("Action helper '%s' '%s'", sensor_data, sensor_plan.sensor_type)
+    for rule in sensor_plan.rules_for(sensor_data['board_id']):
 
       #Check threshold function
-      sensor_data['sensor_data'], threshold_result = utils.treshold_helper(sensor_action['threshold'],
-              sensor_data['sensor_data'])
+      sensor_data['sensor_data'], threshold_result = rule.threshold(sensor_data['sensor_data'])
 
       if not threshold_result:
         continue
 
       #Format message
       try:
-        sensor_data['message'] = sensor_action['message_template'].format(**sensor_data)
+        sensor_data['message'] = rule.message.render(sensor_data)
       except (KeyError, ValueError) as e:
-        LOG.error("Fail to format message '%s' with data '%s'", sensor_action['message_template'], sensor_data)
+        LOG.error("Fail to format message '%s' with data '%s'", rule.message.source, sensor_data)
         continue
 
       #Check status threshold function
-      if not self._check_status(sensor_action['check_status']):
+      if not self._check_status(rule.check_status):
         continue
 
       #Check metrics threshold function
-      if not self._check_metric(sensor_action['check_metric'], sensor_data):
+      if not self._check_metric(rule.check_metric, sensor_data):
         continue
 
       #Check last action time
-      if not self._check_action_interval(sensor_data, sensor_action['id'],
-              sensor_action['action_interval']):
+      if not self._check_action_interval(sensor_data, rule.id, rule.action_interval):
         continue
 
       LOG.info("Action execute for data '%s'", sensor_data)
-      if self._action_execute(sensor_data,
-              sensor_action['action'],
-              action_config,
-              sensor_action['action_config']):
-        try:
-          database.insert_action(self.db, sensor_data['board_id'],
-                  sensor_data['sensor_type'], sensor_action['id'])
-        except OperationalError as e:
-          LOG.error("Fail to save action '%s'", e)
+      self.dispatcher.submit(sensor_data, rule)
+
+  def _publish_stats(self):
+    if not self.stats_interval or time.time() - self._stats_published < self.stats_interval:
+      return
+
+    self._stats_published = time.time()
+    stats = dict(('action_queue/' + name, value) for name, value in self.action_queue.snapshot().iteritems())
+    stats.update(('action_pool/' + name, value) for name, value in self.action_pool.snapshot().iteritems())
+    stats.update(('dispatcher/' + name, value) for name, value in self.dispatcher.snapshot().iteritems())
+    stats.update(('cooldown/' + name, value) for name, value in self.cooldown.snapshot().iteritems())
+    if self.last_metric_cache:
+      stats.update(('last_metric_cache/' + name, value) for name, value in self.last_metric_cache.snapshot().iteritems())
+      stats.update(('metric_windows/' + name, value) for name, value in self.metric_windows.snapshot().iteritems())
+    self.publish_stats(stats)
 
   def run(self):
     LOG.info('Starting')
@@ -296,14 +324,21 @@ class Executor(mqtt.Mqtt):
     self.publish_status()
     while True:
       self.enabled.wait()
+      if self._refresh:
+        self._refresh_maps()
+      self._publish_stats()
+      self.cooldown.flush()
       try:
-        priority, sensor_data, sensor_config = self.action_queue.get(True, 5)
+        priority, sensor_data = self.action_queue.get(True, 5)
       except (Queue.Empty) as e:
         continue
 
       LOG.debug("Got sensor_data '%s' with priority '%d'", sensor_data, priority)
 
-      self._action_helper(sensor_data, sensor_config, self.action_config)
+      # Plan is looked up when event is evaluated, sensors map could be reloaded
+      sensor_plan = self._prepare_sensor_config(sensor_data)
+      if sensor_plan:
+        self._action_helper(sensor_data, sensor_plan)
 
 
 LOG = logging.getLogger(__name__)
@@ -319,9 +354,27 @@ def main():
 
   logging_conf = conf.get('logging', {})
   utils.create_logger(logging_conf)
+  utils.configure_http(**conf.get('http', {}))
 
   executor = Executor(
     db_string=conf['db_string'],
+    db_pool=conf.get('db_pool'),
+    db_sqlite=conf.get('db_sqlite'),
+    db_partitioning=conf.get('db_partitioning'),
+    db_chunks=conf.get('db_chunks'),
+    stats_interval=conf.get('stats_interval', 60),
+    metric_buffer_size=conf.get('metric_buffer_size', 128),
+    action_workers=conf.get('action_workers', 2),
+    action_threads=conf.get('action_threads', 4),
+    action_batch_size=conf.get('action_batch_size', 100),
+    action_flush_interval=conf.get('action_flush_interval', 5),
+    queue_size=conf.get('queue_size', 0),
+    queue_policy=conf.get('queue_policy', 'block'),
+    queue_spill_file=conf.get('queue_spill_file'),
+    outbox_file=conf.get('outbox_file'),
+    action_backoff=conf.get('action_backoff', 5),
+    action_max_backoff=conf.get('action_max_backoff', 300),
+    action_max_age=conf.get('action_max_age', 0),
     sensors_map_file=sensors_map_file,
     action_config=conf['action_config'],
     mqtt_config=conf['mqtt'])
@@ -1,4 +1,5 @@
 import logging
+import os
 import smtplib
 import socket
 import sys
@@ -6,9 +7,77 @@ import sys
 LOG = logging.getLogger(__name__)
 TIMEOUT=5
 
+# (pid, connection details, SMTP) reused by next mails sent from worker
+SMTP_SESSION = None
+
+
+def smtp_session(smtp_details):
+  """Return connected (and authenticated) SMTP session
+
+  Session is kept open and reused while connection details are the
+  same, sessions are not shared with forked processes.
+  """
+  global SMTP_SESSION
+  key = (smtp_details['host'], smtp_details['port'], smtp_details['tls'], smtp_details['user'])
+
+  if SMTP_SESSION is not None and SMTP_SESSION[:2] == (os.getpid(), key):
+    return SMTP_SESSION[2]
+
+  close_smtp_session()
+
+  s = smtplib.SMTP(smtp_details['host'], smtp_details['port'], timeout=TIMEOUT)
+  if smtp_details['tls']:
+    s.starttls()
+  if smtp_details['user']:
+    s.login(smtp_details['user'], smtp_details['password'])
+
+  SMTP_SESSION = (os.getpid(), key, s)
+  return s
+
+
+def close_smtp_session():
+  global SMTP_SESSION
+
+  if SMTP_SESSION is not None and SMTP_SESSION[0] == os.getpid():
+    try:
+      SMTP_SESSION[2].quit()
+    except (smtplib.SMTPException, socket.error):
+      SMTP_SESSION[2].close()
+  SMTP_SESSION = None
+
+
+def _sendmail(smtp_details, recipient, message):
+  """Send message to recipient, returns exception when recipient was
+  refused (None when mail was sent)
+
+  Reused session could be closed by server, it is reconnected once,
+  raises SMTPException or socket.error when server is not available.
+  """
+  for reconnect in (False, True):
+    try:
+      smtp_session(smtp_details).sendmail(smtp_details['sender'], [recipient], message)
+    except smtplib.SMTPRecipientsRefused as e:
+      # Transaction was reset, session can be used for other recipients
+      return e
+    except (smtplib.SMTPServerDisconnected, socket.error):
+      close_smtp_session()
+      if reconnect:
+        raise
+    except smtplib.SMTPException:
+      close_smtp_session()
+      raise
+    else:
+      return None
+
+
 def send_mail(data, action_config):
   """Send mail via SMTP
 
+  Every recipient gets own mail, SMTP session is reused by next
+  mails and reconnected when server closed it. Refused recipients are
+  tried once more after others. Action fails only when no mail was
+  sent, so retried action does not mail recipients again.
+
   Meact configuration:
   action_config = {
     "sender": "root@example.com",
@@ -33,21 +102,32 @@ def send_mail(data, action_config):
     'host': action_config['host'],
     'port': action_config.get('port', 587),
     'tls': action_config.get('tls', 1),
-    'user': action_config['user'],
-    'password': action_config['password']
+    'user': action_config.get('user'),
+    'password': action_config.get('password')
   }
 
-  for rcpt in action_config['recipient']:
-    message = "From: {sender}\nTo: {recipient}\nSubject: {subject}\n\n{msg}\n\n".format(msg=data['message'], recipient=rcpt, **smtp_details)
-    try:
-      s = smtplib.SMTP(smtp_details['host'], smtp_details['port'])
-      if smtp_details['tls']:
-        s.starttls()
-      s.login(smtp_details['user'], smtp_details['password'])
-      s.sendmail(smtp_details['sender'], rcpt, message)
-      s.quit()
-    except (socket.gaierror, socket.timeout, smtplib.SMTPAuthenticationError, smtplib.SMTPDataError) as e:
-      LOG.warning("Got exception '%s' in send_mail", e)
-      sys.exit(2)
-    else:
-      sys.exit(0)
+  recipients = action_config['recipient']
+  refused = {}
+  sent = []
+
+  try:
+    for retry in (False, True):
+      for recipient in recipients:
+        if recipient in sent or retry and recipient not in refused:
+          continue
+        message = "From: {sender}\nTo: {recipient}\nSubject: {subject}\n\n{msg}\n\n".format(msg=data['message'],
+                recipient=recipient, **smtp_details)
+        refused[recipient] = _sendmail(smtp_details, recipient, message)
+        if not refused[recipient]:
+          del refused[recipient]
+          sent.append(recipient)
+  except (smtplib.SMTPException, socket.error) as e:
+    LOG.warning("Got exception '%s' in send_mail", e)
+
+  if len(sent) < len(recipients):
+    LOG.warning("Mail not sent to '%s' in send_mail, refused '%s'", [r for r in recipients if r not in sent], refused)
+
+  if not sent:
+    sys.exit(2)
+
+  sys.exit(0)
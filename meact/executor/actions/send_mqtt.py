@@ -1,13 +1,110 @@
 import logging
+import os
+import socket
 import sys
+import time
 
 import paho.mqtt.client as paho
-import paho.mqtt.publish as publish
 
 from meact import utils
 
 LOG = logging.getLogger(__name__)
 TIMEOUT=5
+KEEPALIVE=60
+
+# (pid, connection details, paho client) reused by next messages sent from worker
+MQTT_CLIENT = None
+
+
+def _loop_until(client, done):
+  """Process network events until done() or TIMEOUT, raises socket.error
+  when connection is lost
+  """
+  deadline = time.time() + TIMEOUT
+  while not done():
+    if time.time() > deadline:
+      raise socket.timeout('Timeout waiting for broker')
+    rc = client.loop(0.1)
+    if rc != paho.MQTT_ERR_SUCCESS:
+      raise socket.error(paho.error_string(rc))
+
+
+def mqtt_client(mqtt_details):
+  """Return client connected to broker
+
+  Connection is kept open and reused while connection details are the
+  same, connections are not shared with forked processes. Client has
+  no network thread, events are processed while publishing.
+  """
+  global MQTT_CLIENT
+  key = (mqtt_details['hostname'], mqtt_details['port'], mqtt_details['auth'])
+
+  if MQTT_CLIENT is not None and MQTT_CLIENT[:2] == (os.getpid(), key):
+    # Broker could close connection while client was idle
+    if MQTT_CLIENT[2].loop(0) == paho.MQTT_ERR_SUCCESS:
+      return MQTT_CLIENT[2]
+
+  close_mqtt_client()
+
+  connack = {}
+  client = paho.Client(userdata=connack, protocol=paho.MQTTv31)
+  client.on_connect = lambda client, userdata, flags, rc: userdata.update(rc=rc)
+  if mqtt_details['auth']:
+    client.username_pw_set(mqtt_details['auth']['username'], mqtt_details['auth'].get('password'))
+
+  client.connect(mqtt_details['hostname'], mqtt_details['port'], KEEPALIVE)
+  _loop_until(client, lambda: 'rc' in connack)
+  if connack['rc'] != 0:
+    raise socket.error(paho.connack_string(connack['rc']))
+
+  MQTT_CLIENT = (os.getpid(), key, client)
+  return client
+
+
+def close_mqtt_client():
+  global MQTT_CLIENT
+
+  if MQTT_CLIENT is not None and MQTT_CLIENT[0] == os.getpid():
+    try:
+      MQTT_CLIENT[2].disconnect()
+    except socket.error:
+      pass
+  MQTT_CLIENT = None
+
+
+def get_mqtt_details(config, qos=0):
+  """Return broker connection details from action config (server, port,
+  auth, qos)
+  """
+  return {
+    'qos': config.get('qos', qos),
+    'hostname': config.get('server', 'localhost'),
+    'port': config.get('port', 1883),
+    'auth': config.get('auth', None)
+  }
+
+
+def publish_messages(mqtt_details, messages):
+  """Publish (topic, payload, retain) messages over reused connection
+
+  Connection lost while publishing is reconnected once and not yet
+  published messages are sent again, raises socket.error when
+  messages could not be published.
+  """
+  for reconnect in (False, True):
+    published = []
+    try:
+      client = mqtt_client(mqtt_details)
+      for topic, payload, retain in messages:
+        published.append(client.publish(topic, payload=payload, retain=retain, qos=mqtt_details['qos']))
+      _loop_until(client, lambda: all(info.is_published() for info in published))
+    except socket.error:
+      close_mqtt_client()
+      if reconnect:
+        raise
+      messages = [m for i, m in enumerate(messages) if i >= len(published) or not published[i].is_published()]
+    else:
+      break
 
 
 def send_mqtt(data, action_config):
@@ -18,11 +115,14 @@ def send_mqtt(data, action_config):
 
   Ex. '{sensor_type}:enabled'
 
+  Messages are published over connection reused by next actions (see
+  publish_messages).
 
   Meact configuration:
   action_config = {
     "server": "localhost",
     "port": 1883,
+    "auth": {"username": "user", "password": "password"},
     "message": [{"topic": "topic_name", "payload": "message {board_id}", "retain": 0}],
     "enabled": 1
   }
@@ -32,13 +132,9 @@ def send_mqtt(data, action_config):
 
   LOG.info('Sending message over MQTT')
 
-  mqtt_details = {
-    'qos': action_config.get('qos', 0),
-    'hostname': action_config.get('server', 'localhost'),
-    'port': action_config.get('port', 1883),
-    'auth': action_config.get('auth', None)
-  }
+  mqtt_details = get_mqtt_details(action_config)
 
+  messages = []
   for m in action_config['message']:
     try:
       topic = m['topic'].format(**data)
@@ -47,14 +143,12 @@ def send_mqtt(data, action_config):
     except (KeyError, ValueError) as e:
       LOG.warning("Fail to format message with data '%s'", data)
       continue
+    messages.append((topic, payload, retain))
 
-    publish.single(topic,
-            payload=payload,
-            retain=retain,
-            qos=mqtt_details['qos'],
-            hostname=mqtt_details['hostname'],
-            port=mqtt_details['port'],
-            auth=mqtt_details['auth'],
-            protocol=paho.MQTTv31)
+  try:
+    publish_messages(mqtt_details, messages)
+  except socket.error as e:
+    LOG.warning("Got exception '%s' in send_mqtt", e)
+    sys.exit(2)
 
   sys.exit(0)
@@ -1,9 +1,13 @@
+import json
 import logging
+import socket
 import time
 import sys
 from gsmmodem.modem import GsmModem, SentSms
 from gsmmodem.exceptions import TimeoutException
 
+from meact.executor.actions import send_mqtt
+
 
 LOG = logging.getLogger(__name__)
 TIMEOUT=30
@@ -13,9 +17,16 @@ logging.getLogger("gsmmodem.modem.GsmModem").setLevel(logging.CRITICAL)
 def send_sms_at(data, action_config):
   """Send SMS via local modem with AT commands
 
+  When topic is set SMS is queued to meact-gsm service which keeps
+  modem connected, otherwise modem is opened by action (port and
+  speed). SMS is published over connection reused with send_mqtt,
+  broker is set in mqtt (server, port, auth as in send_mqtt).
+
   Meact configuration:
   action_config = {
     "recipient": ["your-number", "your-number2'],
+    "topic": "gsm/sms",
+    "mqtt": {"server": "localhost", "port": 1883, "auth": {"username": "user", "password": "password"}},
     "port": "/dev/ttyUSB1",
     "speed": 19200,
     "enabled": 1
@@ -24,6 +35,17 @@ def send_sms_at(data, action_config):
   if not action_config.get('enabled'):
     sys.exit(1)
 
+  if action_config.get('topic'):
+    LOG.info('Queueing SMS to gsm service')
+    payload = json.dumps({'recipient': action_config['recipient'], 'message': data['message']})
+    try:
+      send_mqtt.publish_messages(send_mqtt.get_mqtt_details(action_config.get('mqtt', {}), qos=1),
+              [(action_config['topic'], payload, False)])
+    except socket.error as e:
+      LOG.warning("Got exception '%s' in send_sms_at", e)
+      sys.exit(2)
+    sys.exit(0)
+
   LOG.info('Sending SMS via AT')
 
   modem = GsmModem(action_config['port'], action_config['speed'])
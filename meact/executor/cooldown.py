@@ -0,0 +1,113 @@
+from threading import Lock
+import logging
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class CooldownTracker(object):
+  """Last execution time per (board_id, sensor_type, sensor_action_id)
+
+  Times are loaded from actions stored in last window seconds, checks
+  are answered from memory. Executed actions are saved write-behind,
+  flush() saves them when batch_size actions are pending or oldest
+  pending action waits flush_interval seconds. While actions can not
+  be loaded, last execution time is read from backend.
+  """
+  def __init__(self, backend, batch_size=100, flush_interval=5, retry_interval=10):
+    self.backend = backend
+    self.batch_size = max(batch_size, 1)
+    self.flush_interval = flush_interval
+    self.retry_interval = retry_interval
+    self.stats = Stats()
+    self.loaded = False
+    self._lock = Lock()
+    self._last = {}
+    self._pending = []
+    self._window = 0
+    self._load_attempt = 0
+
+  def load(self, window):
+    """Load actions executed in last window seconds
+    """
+    self._window = window
+    self._load_attempt = time.time()
+    try:
+      actions = self.backend.get_action(start=int(time.time()) - window)
+    except SQLAlchemyError as e:
+      LOG.error("Fail to load actions '%s'", e)
+      return False
+
+    with self._lock:
+      for action in actions:
+        key = (action.board_id, action.sensor_type, action.sensor_action_id)
+        self._last[key] = max(self._last.get(key, 0), action.last_update)
+      self.loaded = True
+
+    LOG.info('Loaded %d actions', len(actions))
+    return True
+
+  def last_executed(self, board_id, sensor_type, sensor_action_id):
+    """Return time of last execution, 0 when action was not executed
+    """
+    key = (board_id, sensor_type, sensor_action_id)
+
+    if not self.loaded and (time.time() - self._load_attempt < self.retry_interval or not self.load(self._window)):
+      self.stats.incr('fallback')
+      with self._lock:
+        last = self._last.get(key, 0)
+      actions = self.backend.get_action(board_ids=board_id, sensor_type=sensor_type,
+              sensor_action_id=sensor_action_id, last_available=1)
+      return max([last] + [action.last_update for action in actions])
+
+    self.stats.incr('hit')
+    with self._lock:
+      return self._last.get(key, 0)
+
+  def executed(self, board_id, sensor_type, sensor_action_id):
+    now = int(time.time())
+
+    with self._lock:
+      self._last[(board_id, sensor_type, sensor_action_id)] = now
+      self._pending.append({
+        'board_id': board_id,
+        'sensor_type': sensor_type,
+        'sensor_action_id': sensor_action_id,
+        'last_update': now
+      })
+
+  def flush(self, force=False):
+    """Save pending actions, returns number of saved actions
+    """
+    with self._lock:
+      if not self._pending:
+        return 0
+      due = len(self._pending) >= self.batch_size or time.time() - self._pending[0]['last_update'] >= self.flush_interval
+      if not force and not due:
+        return 0
+      batch, self._pending = self._pending, []
+
+    try:
+      self.backend.insert_actions(batch)
+    except SQLAlchemyError as e:
+      LOG.error("Fail to save actions '%s'", e)
+      self.stats.incr('failed', len(batch))
+      with self._lock:
+        self._pending[:0] = batch
+      return 0
+
+    self.stats.incr('saved', len(batch))
+    self.stats.observe('batch_size', len(batch))
+    return len(batch)
+
+  def snapshot(self):
+    with self._lock:
+      self.stats.gauge('loaded', int(self.loaded))
+      self.stats.gauge('entries', len(self._last))
+      self.stats.gauge('pending', len(self._pending))
+
+    return self.stats.snapshot()
@@ -0,0 +1,97 @@
+from threading import Condition, Thread
+import json
+import logging
+import time
+
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class Digest(object):
+  """Merge messages of actions with digest window into one notification
+
+  Messages of the same action with the same config (channel and
+  recipient) are collected until no message was added for window
+  seconds or first message waits max_latency seconds. Collected
+  messages are sent with send(sensor_data, action), sensor_data of
+  first message has message replaced with all messages (one per line)
+  and digest_count set. saved/<action> counts sends saved by merging.
+  """
+  def __init__(self, send):
+    self.send = send
+    self.stats = Stats()
+    self._cond = Condition()
+    self._pending = {}
+    self._closed = False
+    self._thread = Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def add(self, sensor_data, action):
+    key = (action.name, json.dumps(action.config, sort_keys=True))
+    now = time.time()
+
+    with self._cond:
+      digest = self._pending.get(key)
+      if digest is None:
+        digest = self._pending[key] = {'action': action, 'sensor_data': dict(sensor_data), 'messages': [],
+                'first': now}
+      digest['messages'].append(sensor_data['message'])
+      digest['last'] = now
+      self._cond.notify()
+
+    self.stats.incr('messages/' + action.name)
+
+  def _due(self, digest):
+    window, max_latency = digest['action'].digest
+    return min(digest['last'] + window, digest['first'] + max_latency)
+
+  def flush(self, force=False):
+    """Send due digests (all with force), returns number of sent digests
+    """
+    now = time.time()
+    with self._cond:
+      due = [key for key, digest in self._pending.iteritems() if force or self._due(digest) <= now]
+      digests = [self._pending.pop(key) for key in due]
+
+    for digest in digests:
+      action = digest['action']
+      sensor_data = digest['sensor_data']
+      sensor_data['message'] = '\n'.join(digest['messages'])
+      sensor_data['digest_count'] = len(digest['messages'])
+
+      self.stats.incr('sent/' + action.name)
+      self.stats.incr('saved/' + action.name, len(digest['messages']) - 1)
+      self.stats.observe('latency/' + action.name, (now - digest['first']) * 1000)
+      try:
+        self.send(sensor_data, action)
+      except Exception:
+        LOG.exception("Fail to send digest of '%s'", action.name)
+
+    return len(digests)
+
+  def _run(self):
+    while True:
+      self.flush()
+      with self._cond:
+        if self._closed:
+          break
+        if self._pending:
+          self._cond.wait(max(min(self._due(digest) for digest in self._pending.itervalues()) - time.time(), 0))
+        else:
+          self._cond.wait()
+
+  def close(self):
+    """Send all collected digests and stop thread
+    """
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join()
+    self.flush(force=True)
+
+  def snapshot(self):
+    with self._cond:
+      self.stats.gauge('pending', sum(len(digest['messages']) for digest in self._pending.itervalues()))
+    return self.stats.snapshot()
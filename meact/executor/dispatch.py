@@ -0,0 +1,181 @@
+from threading import BoundedSemaphore, Lock, Thread
+import logging
+import time
+
+from meact.executor.digest import Digest
+from meact.executor.outbox import Outbox
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class Dispatcher(object):
+  """Run action chains of triggered rules in background threads
+
+  Actions of a rule are executed in order, failback chain of failed
+  action is executed in order right after it. limits maps action name
+  to max number of concurrently running actions with that name.
+  done(sensor_data, rule, result) is called when rule chain finished,
+  result is number of successful actions.
+
+  While rule is dispatched for (board_id, sensor_type) it is not
+  dispatched again, action_interval is checked against actions
+  recorded after chain finished.
+
+  Triggered rules are kept in outbox. Action which failed together
+  with its failbacks is retried after backoff seconds, doubled with
+  every attempt up to max_backoff, until it is older than its max_age
+  (max_age in action_config, default max_age). done is called after
+  every attempt. When outbox has journal, rules pending on restart are
+  loaded with resolve(sensor_type, rule_id) and dispatched again.
+
+  Action with digest window is added to digest and counted as
+  successful, merged messages are executed with its failbacks when
+  digest is sent.
+  """
+  def __init__(self, execute, done, threads=4, limits=None, outbox=None, resolve=None, backoff=5, max_backoff=300,
+          max_age=0):
+    self.execute = execute
+    self.done = done
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.max_age = max_age
+    self.stats = Stats()
+    self.outbox = outbox or Outbox()
+    self._lock = Lock()
+    self._pending = set()
+    self._limits = dict((name, BoundedSemaphore(limit)) for name, limit in (limits or {}).iteritems())
+    self._threads = []
+    self.digest = Digest(self._send_digest)
+
+    for entry in self.outbox.load(resolve):
+      self._pending.add(self._key(entry['sensor_data'], entry['rule']))
+
+    for _ in xrange(threads):
+      thread = Thread(target=self._run)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def _key(self, sensor_data, rule):
+    return (sensor_data['board_id'], sensor_data['sensor_type'], rule.id)
+
+  def submit(self, sensor_data, rule):
+    """Queue action chain of rule, returns False when it is already pending
+    or it can not be journaled
+    """
+    key = self._key(sensor_data, rule)
+    with self._lock:
+      if key in self._pending:
+        self.stats.incr('skipped')
+        return False
+      self._pending.add(key)
+
+    try:
+      self.outbox.put(dict(sensor_data), rule)
+    except (TypeError, ValueError, IOError) as e:
+      with self._lock:
+        self._pending.discard(key)
+      LOG.error("Fail to queue actions for data '%s' '%s'", sensor_data, e)
+      self.stats.incr('rejected')
+      return False
+
+    return True
+
+  def _run(self):
+    while True:
+      entry = self.outbox.get()
+      if entry is None:
+        break
+
+      self.stats.observe('queue_wait', (time.time() - entry['due']) * 1000)
+      try:
+        self._execute_entry(entry)
+      except Exception:
+        LOG.exception("Fail to dispatch actions for data '%s'", entry['sensor_data'])
+        self._finish(entry)
+
+  def _execute_entry(self, entry):
+    sensor_data, rule = entry['sensor_data'], entry['rule']
+    result = 0
+    failed = []
+
+    for index in entry['actions']:
+      action_result = self._execute_chain(sensor_data, rule.actions[index:index + 1])
+      if not action_result:
+        failed.append(index)
+      result += action_result
+
+    self.done(sensor_data, rule, result)
+
+    now = time.time()
+    retry = []
+    for index in failed:
+      action = rule.actions[index]
+      max_age = action.max_age if action.max_age is not None else self.max_age
+      if now - entry['created'] < max_age:
+        retry.append(index)
+      elif max_age:
+        LOG.error("Action '%s' expired after %d attempts", action.name, entry['attempt'] + 1)
+        self.stats.incr('expired/' + action.name)
+
+    if retry:
+      delay = min(self.backoff * 2 ** entry['attempt'], self.max_backoff)
+      self.outbox.retry(entry, retry, now + delay)
+    else:
+      self._finish(entry)
+
+  def _finish(self, entry):
+    self.outbox.done(entry)
+    with self._lock:
+      self._pending.discard(self._key(entry['sensor_data'], entry['rule']))
+
+  def _send_digest(self, sensor_data, action):
+    self._execute_chain(sensor_data, [action], digest=False)
+
+  def _execute_chain(self, sensor_data, actions, digest=True):
+    result = 0
+
+    for action in actions:
+      if digest and action.digest:
+        self.digest.add(sensor_data, action)
+        result += 1
+        continue
+
+      limit = self._limits.get(action.name)
+      if limit:
+        limit.acquire()
+      try:
+        status = self.execute(sensor_data, action)
+      finally:
+        if limit:
+          limit.release()
+
+      if status:
+        LOG.error("Fail to execute action '%s', exitcode '%d'", action.name, status)
+        self.stats.incr('failed/' + action.name)
+        if action.failback:
+          LOG.debug("Failback '%s'", [failback.name for failback in action.failback])
+          result += self._execute_chain(sensor_data, action.failback)
+      else:
+        self.stats.incr('succeeded/' + action.name)
+        result += 1
+
+    return result
+
+  def join(self):
+    """Stop threads after due jobs are finished, retries are left in outbox
+    """
+    self.outbox.close()
+    for thread in self._threads:
+      thread.join()
+    self.digest.close()
+
+  def snapshot(self):
+    with self._lock:
+      self.stats.gauge('pending', len(self._pending))
+    stats = self.stats.snapshot()
+    stats.update(('outbox/' + name, value) for name, value in self.outbox.snapshot().iteritems())
+    stats.update(('digest/' + name, value) for name, value in self.digest.snapshot().iteritems())
+
+    return stats
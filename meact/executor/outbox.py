@@ -0,0 +1,162 @@
+from threading import Condition
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+class Outbox(object):
+  """Durable schedule of triggered rules
+
+  Entry is dict with id, sensor_data, rule, actions (indexes of rule
+  actions left to execute), attempt, created and due time. Entries are
+  returned by get when they are due, entry has to be finished with
+  retry or done.
+
+  Changes are appended to journal_file (JSON lines) before they are
+  applied, pending entries are loaded from journal on start. Journal is
+  rewritten with pending entries only on start and after compact_size
+  entries were done. Without journal_file entries are kept in memory.
+  """
+  def __init__(self, journal_file=None, compact_size=1000):
+    self.journal_file = journal_file
+    self.compact_size = compact_size
+    self.stats = Stats()
+    self._cond = Condition()
+    self._heap = []
+    self._entries = {}
+    self._ids = itertools.count()
+    self._journal = None
+    self._done = 0
+    self._closed = False
+
+  def load(self, resolve):
+    """Load pending entries from journal, returns list of them
+
+    resolve(sensor_type, rule_id) returns rule or None when rule is not
+    configured anymore, entries of such rules are dropped.
+    """
+    if not self.journal_file:
+      return []
+
+    records = {}
+    if os.path.exists(self.journal_file):
+      with open(self.journal_file) as journal:
+        for line in journal:
+          if not line.endswith('\n'):
+            LOG.error('Outbox journal is truncated')
+            break
+          record = json.loads(line)
+          if record[0] == 'put':
+            records[record[1]] = record
+          elif record[0] == 'retry' and record[1] in records:
+            records[record[1]][4:5] = [record[2]]
+            records[record[1]][6:8] = record[3:5]
+          elif record[0] == 'done':
+            records.pop(record[1], None)
+
+    loaded = []
+    with self._cond:
+      for _, entry_id, sensor_data, rule_id, actions, created, attempt, due in sorted(records.itervalues()):
+        rule = resolve(sensor_data['sensor_type'], rule_id)
+        if rule is None:
+          LOG.warning("Dropping outbox entry of unknown rule '%s'", rule_id)
+          continue
+        entry = {'id': entry_id, 'sensor_data': sensor_data, 'rule': rule, 'actions': actions,
+                'attempt': attempt, 'created': created, 'due': due}
+        self._entries[entry_id] = entry
+        heapq.heappush(self._heap, (due, entry_id))
+        loaded.append(entry)
+
+      self._ids = itertools.count(max(records) + 1 if records else 0)
+      self._compact()
+
+    LOG.info('Loaded %d outbox entries', len(loaded))
+    return loaded
+
+  def _record(self, entry):
+    return ['put', entry['id'], entry['sensor_data'], entry['rule'].id, entry['actions'], entry['created'],
+            entry['attempt'], entry['due']]
+
+  def _write(self, record):
+    # Journal is flushed to OS, written entries survive process crash
+    if self._journal:
+      self._journal.write(json.dumps(record) + '\n')
+      self._journal.flush()
+
+  def _compact(self):
+    tmp_file = self.journal_file + '.tmp'
+    with open(tmp_file, 'w') as journal:
+      for entry_id in sorted(self._entries):
+        journal.write(json.dumps(self._record(self._entries[entry_id])) + '\n')
+    os.rename(tmp_file, self.journal_file)
+
+    if self._journal:
+      self._journal.close()
+    self._journal = open(self.journal_file, 'a')
+    self._done = 0
+
+  def put(self, sensor_data, rule, actions=None):
+    now = time.time()
+    with self._cond:
+      entry = {'id': next(self._ids), 'sensor_data': sensor_data, 'rule': rule,
+              'actions': actions if actions is not None else range(len(rule.actions)),
+              'attempt': 0, 'created': now, 'due': now}
+      self._write(self._record(entry))
+      self._entries[entry['id']] = entry
+      heapq.heappush(self._heap, (now, entry['id']))
+      self._cond.notify()
+    return entry
+
+  def get(self, timeout=None):
+    """Return next due entry, None after close or timeout
+    """
+    end = time.time() + timeout if timeout is not None else None
+    with self._cond:
+      while True:
+        now = time.time()
+        if self._heap and self._heap[0][0] <= now:
+          _, entry_id = heapq.heappop(self._heap)
+          return self._entries[entry_id]
+        if self._closed or end is not None and now >= end:
+          return None
+
+        wait = [t - now for t in (self._heap[0][0] if self._heap else None, end) if t is not None]
+        self._cond.wait(min(wait) if wait else None)
+
+  def retry(self, entry, actions, due):
+    with self._cond:
+      entry['actions'] = actions
+      entry['attempt'] += 1
+      entry['due'] = due
+      self._write(['retry', entry['id'], actions, entry['attempt'], due])
+      heapq.heappush(self._heap, (due, entry['id']))
+      self._cond.notify()
+    self.stats.incr('retried')
+
+  def done(self, entry):
+    with self._cond:
+      self._write(['done', entry['id']])
+      del self._entries[entry['id']]
+      self._done += 1
+      if self._journal and self._done >= self.compact_size:
+        self._compact()
+
+  def close(self):
+    """Stop waiting for entries which are not due, they are left in journal
+    """
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def snapshot(self):
+    with self._cond:
+      self.stats.gauge('entries', len(self._entries))
+      self.stats.gauge('due', sum(1 for due, _ in self._heap if due <= time.time()))
+    return self.stats.snapshot()
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import string
+
+from meact import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class Plan(object):
+  """Immutable object, attributes are set only in constructor
+  """
+  __slots__ = ()
+
+  def __init__(self, **kwargs):
+    for name in self.__slots__:
+      object.__setattr__(self, name, kwargs.get(name))
+
+  def __setattr__(self, name, value):
+    raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+  def __repr__(self):
+    return '<{}({})>'.format(type(self).__name__,
+            ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__))
+
+
+class Threshold(Plan):
+  """Compiled threshold, call returns (transform result, threshold result)
+  """
+  __slots__ = ('source', 'func', 'transform_source', 'transform')
+
+  @classmethod
+  def compile(cls, threshold):
+    transform = threshold.get('transform')
+    return cls(source=threshold['lambda'],
+            func=utils.compile_lambda(threshold['lambda']),
+            transform_source=transform,
+            transform=utils.compile_lambda(transform) if transform else None)
+
+  def __call__(self, arg1=None):
+    if self.transform:
+      arg1 = self.transform(arg1)
+    return arg1, self.func(arg1)
+
+
+class Template(Plan):
+  """Parsed str.format template
+
+  Templates using only plain {name} fields are rendered from parsed
+  parts, other are rendered with str.format.
+  """
+  __slots__ = ('source', 'parts', 'simple')
+
+  @classmethod
+  def compile(cls, source):
+    parts = []
+    simple = True
+    for literal, field, format_spec, conversion in string.Formatter().parse(source):
+      if field is not None:
+        plain = field and not field[0].isdigit() and all(c.isalnum() or c == '_' for c in field)
+        if not plain or conversion or '{' in format_spec:
+          simple = False
+      parts.append((literal, field, format_spec))
+
+    return cls(source=source, parts=tuple(parts), simple=simple)
+
+  def render(self, data):
+    if not self.simple:
+      return self.source.format(**data)
+
+    output = []
+    for literal, field, format_spec in self.parts:
+      output.append(literal)
+      if field is not None:
+        output.append(format(data[field], format_spec))
+    return ''.join(output)
+
+
+class CheckStatus(Plan):
+  __slots__ = ('name', 'threshold')
+
+
+class CheckMetric(Plan):
+  __slots__ = ('sensor_type', 'board_ids', 'threshold', 'value_type', 'count', 'start_offset', 'end_offset',
+          'min_value', 'max_value')
+
+
+class Action(Plan):
+  """Action with config merged from global and sensor action_config
+
+  digest is (window, max_latency) when messages are merged.
+  """
+  __slots__ = ('name', 'func', 'timeout', 'max_age', 'digest', 'config', 'failback')
+
+
+class Rule(Plan):
+  __slots__ = ('id', 'board_ids', 'threshold', 'message', 'check_status', 'check_metric', 'action_interval',
+          'actions')
+
+  def for_board(self, board_id):
+    return not self.board_ids or board_id in self.board_ids
+
+
+class SensorPlan(Plan):
+  """Rules of sensor type with index of rules per board_id
+
+  index maps board_id listed in any rule to rules for that board,
+  wildcard holds rules without board_ids. Rules keep sensors map order.
+  When coalesce is set only newest pending event per board is queued.
+  """
+  __slots__ = ('sensor_type', 'priority', 'coalesce', 'rules', 'index', 'wildcard')
+
+  def rules_for(self, board_id):
+    return self.index.get(board_id, self.wildcard)
+
+
+def compile_actions(actions, global_action_config, sensor_action_config, actions_mapping):
+  output = []
+  for action in actions:
+    action_name = action['name']
+    action_func = actions_mapping.get(action_name)
+
+    if not action_func:
+      LOG.warning('Unknown action %s', action_name)
+      continue
+
+    action_config = dict(global_action_config.get(action_name, {}))
+    action_config.update(sensor_action_config.get(action_name, {}))
+
+    output.append(Action(name=action_name,
+            func=action_func['func'],
+            timeout=action_config.get('timeout') or action_func['timeout'],
+            max_age=action_config.get('max_age'),
+            digest=(action_config['digest_window'], action_config.get('digest_max_latency',
+                    action_config['digest_window'])) if action_config.get('digest_window') else None,
+            config=action_config,
+            failback=compile_actions(action.get('failback', []), global_action_config, sensor_action_config,
+                    actions_mapping)))
+
+  return tuple(output)
+
+
+def compile_sensor_config(sensor_type, sensor_config, global_action_config, actions_mapping):
+  """Return SensorPlan for validated sensor config
+
+  Raises ValueError when lambda can not be compiled.
+  """
+  rules = []
+  for action in sensor_config['actions']:
+    check_metric = []
+    for check in action['check_metric']:
+      check_metric.append(CheckMetric(
+        sensor_type=check.get('sensor_type'),
+        board_ids=tuple(Template.compile(board_id) for board_id in check.get('board_ids', [])),
+        threshold=Threshold.compile(check['threshold']),
+        value_type=check['value_count']['type'],
+        count=check['value_count'].get('count'),
+        start_offset=check.get('start_offset'),
+        end_offset=check.get('end_offset'),
+        min_value=check.get('min_value'),
+        max_value=check.get('max_value')))
+
+    rules.append(Rule(
+      # Same id as before plans were introduced, it is stored in actions table
+      id=hashlib.md5(json.dumps(action)).hexdigest(),
+      board_ids=frozenset(action['board_ids']),
+      threshold=Threshold.compile(action['threshold']),
+      message=Template.compile(action['message_template']),
+      check_status=tuple(CheckStatus(name=check['name'], threshold=Threshold.compile(check['threshold']))
+              for check in action['check_status']),
+      check_metric=tuple(check_metric),
+      action_interval=action['action_interval'],
+      actions=compile_actions(action['action'], global_action_config, action['action_config'], actions_mapping)))
+
+  return SensorPlan(sensor_type=sensor_type, priority=sensor_config['priority'],
+          coalesce=sensor_config.get('coalesce', False), rules=tuple(rules),
+          index=dict((board_id, tuple(rule for rule in rules if rule.for_board(board_id)))
+                  for board_id in set().union(*[rule.board_ids for rule in rules])),
+          wildcard=tuple(rule for rule in rules if not rule.board_ids))
@@ -0,0 +1,164 @@
+from multiprocessing import Pipe, Process
+from threading import Lock
+import Queue
+import logging
+import signal
+import time
+
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+
+def exit_status(code):
+  """Map sys.exit argument to process exit code
+  """
+  if code is None:
+    return 0
+  if isinstance(code, (int, long)):
+    return code
+  return 1
+
+
+def _worker_loop(conn):
+  # Parent signal handlers (sensors map reload) are not for workers
+  signal.signal(signal.SIGHUP, signal.SIG_IGN)
+  signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+  while True:
+    try:
+      task = conn.recv()
+    except (EOFError, KeyboardInterrupt):
+      break
+
+    if task is None:
+      break
+
+    func, args = task
+    try:
+      func(*args)
+      status = 0
+    except SystemExit as e:
+      status = exit_status(e.code)
+    except Exception:
+      LOG.exception("Exception in action '%s'", func.__name__)
+      status = 1
+
+    conn.send(status)
+
+
+class Worker(object):
+  """Pre-forked process executing actions one by one
+  """
+  def __init__(self):
+    self.conn, child_conn = Pipe()
+    self.process = Process(target=_worker_loop, args=(child_conn, ))
+    self.process.daemon = True
+    self.process.start()
+    child_conn.close()
+
+  def execute(self, func, args, timeout=None):
+    """Return exit code of func, None when timeout expired
+    """
+    try:
+      self.conn.send((func, args))
+      if self.conn.poll(timeout):
+        return self.conn.recv()
+    except (EOFError, IOError):
+      # Worker died (os._exit, signal), report its exit code
+      self.process.join(1)
+      return 1 if self.process.exitcode is None else self.process.exitcode
+
+    return None
+
+  def alive(self):
+    return self.process.is_alive()
+
+  def stop(self, timeout=1):
+    try:
+      self.conn.send(None)
+    except IOError:
+      pass
+    self.process.join(timeout)
+    self.kill()
+
+  def kill(self):
+    if self.process.is_alive():
+      self.process.terminate()
+      self.process.join()
+    self.conn.close()
+
+
+class WorkerPool(object):
+  """Pool of action workers replacing Process per action
+
+  Action runs in idle worker, caller waits until worker is available.
+  Action which does not finish within timeout is killed together with
+  its worker, new worker replaces it. Exit codes have the same meaning
+  as with Process per action: 0 is success, 255 is timeout.
+  """
+  def __init__(self, size=2):
+    self.size = size
+    self.stats = Stats()
+    self._lock = Lock()
+    self._workers = []
+    self._idle = Queue.Queue()
+
+    for _ in xrange(size):
+      self._spawn()
+
+  def _spawn(self):
+    worker = Worker()
+    with self._lock:
+      self._workers.append(worker)
+    self._idle.put(worker)
+
+  def _replace(self, worker):
+    worker.kill()
+    with self._lock:
+      self._workers.remove(worker)
+    self.stats.incr('replaced')
+    self._spawn()
+
+  def execute(self, name, func, args, timeout=None):
+    """Execute func(*args) in worker, returns exit code
+    """
+    queued = time.time()
+    worker = self._idle.get()
+    while not worker.alive():
+      self._replace(worker)
+      worker = self._idle.get()
+    started = time.time()
+    self.stats.observe('queue_wait/' + name, (started - queued) * 1000)
+
+    status = worker.execute(func, args, timeout)
+
+    self.stats.observe('execute/' + name, (time.time() - started) * 1000)
+
+    if status is None:
+      LOG.error("Action '%s' timeout after %ss, replacing worker", name, timeout)
+      self.stats.incr('timeout/' + name)
+      self._replace(worker)
+      return 255
+
+    if not worker.alive():
+      self._replace(worker)
+    else:
+      self._idle.put(worker)
+
+    return status
+
+  def close(self):
+    with self._lock:
+      workers = list(self._workers)
+      self._workers = []
+
+    for worker in workers:
+      worker.stop()
+
+  def snapshot(self):
+    with self._lock:
+      self.stats.gauge('workers', len(self._workers))
+    self.stats.gauge('idle', self._idle.qsize())
+
+    return self.stats.snapshot()
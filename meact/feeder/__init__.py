@@ -1,29 +1,45 @@
 #!/usr/bin/env python
 from multiprocessing import Process, Manager
 from threading import Event
+import heapq
 import json
 import logging
+import random
 import time
 
 from sqlalchemy.exc import OperationalError
 
-from meact import database
+from meact import backends
 from meact import mqtt
 from meact import utils
 from meact.feeder import feeds
 
 
 class Feeder(mqtt.Mqtt):
-  def __init__(self, db_string, mqtt_config, feeds_map_file):
+  """Run feeds when they are due
+
+  Feed is due feed_interval seconds after last successful run and
+  fail_interval seconds after last failed run. Last runs are loaded
+  from database on start, feeds are scheduled in memory and feeder
+  sleeps until next feed is due. Random delay up to jitter seconds
+  (jitter in feed config, default jitter) is added to due time.
+  """
+  def __init__(self, db_string, mqtt_config, feeds_map_file, db_pool=None, db_sqlite=None, jitter=0):
     super(Feeder, self).__init__()
     self.name = 'feeder'
     self.enabled = Event()
     self.enabled.set()
     self.status = {'feeder': 1}
     self.mqtt_config = mqtt_config
-    self.db = database.connect(db_string)
+    self.jitter = jitter
+    self.db = backends.connect(db_string, pool=db_pool, sqlite=db_sqlite)
+    self._schedule = []
+    self._disabled = set()
+    self._last_feed = {}
+    self._wakeup = Event()
     self.start_mqtt()
     self._validate_feeds(feeds_map_file)
+    self._seed_schedule()
 
   def _validate_feeds(self, feeds_map_file):
     feeds_map = utils.load_config(feeds_map_file)
@@ -66,9 +82,9 @@ class Feeder(mqtt.Mqtt):
     else:
       return feed_result.get('sensor_data', None)
 
-  def _check_feed_interval(self, feed_name, result, interval):
+  def _get_last_feed(self, feed_name, result):
     try:
-      last_feeds = database.get_feed(self.db, feed_name=feed_name,
+      last_feeds = self.db.get_feed(feed_name=feed_name,
               result=result,
               last_available=1)
     except OperationalError as e:
@@ -76,50 +92,78 @@ class Feeder(mqtt.Mqtt):
       LOG.error("Fail to get feeds '%s'", e)
 
     if not last_feeds:
-      last_feed = 0
-    else:
-      last_feed = last_feeds[0].last_update
+      return 0
+    return last_feeds[0].last_update
 
-    return utils.time_offset(-last_feed) > interval
+  def _seed_schedule(self):
+    for feed_name in self.feeds_map:
+      self._last_feed[feed_name] = [self._get_last_feed(feed_name, 0), self._get_last_feed(feed_name, 1)]
+      self._schedule_feed(feed_name)
 
-  def run(self):
-    LOG.info('Starting')
-    self.loop_start()
-    self.publish_status()
-    while True:
-      self.enabled.wait()
-      for feed_name in self.feeds_map:
-        feed_config = self.feeds_map[feed_name]
-        feed_enabled = int(self.status.get(self.name + '/' + feed_name, 1))
+  def _schedule_feed(self, feed_name):
+    feed_config = self.feeds_map[feed_name]
+    last_success, last_fail = self._last_feed[feed_name]
+    due = max(last_success + feed_config['feed_interval'], last_fail + feed_config['fail_interval'], time.time())
+    jitter = feed_config.get('jitter', self.jitter)
 
-        if not feed_enabled:
-          continue
+    heapq.heappush(self._schedule, (due + random.uniform(0, jitter), feed_name))
 
-        if not self._check_feed_interval(feed_name, 0, feed_config['feed_interval']):
-          continue
+  def _feed_enabled(self, feed_name):
+    return int(self.status.get(self.name + '/' + feed_name, 1))
 
-        if not self._check_feed_interval(feed_name, 1, feed_config['fail_interval']):
-          continue
+  def _on_mgmt_status(self, client, userdata, msg):
+    super(Feeder, self)._on_mgmt_status(client, userdata, msg)
+    # Disabled feed could be enabled
+    self._wakeup.set()
 
-        feed_result = self._feed_helper(feed_name, feed_config)
+  def _run_feed(self, feed_name):
+    feed_config = self.feeds_map[feed_name]
+    feed_result = self._feed_helper(feed_name, feed_config)
+    self._last_feed[feed_name][0 if feed_result else 1] = int(time.time())
 
-        try:
-          if not feed_result:
-            database.insert_feed(self.db, feed_name, 1)
-            continue
-          else:
-            database.insert_feed(self.db, feed_name, 0)
-        except OperationalError as e:
-          LOG.error("Fail to save feed '%s'", e)
+    try:
+      self.db.insert_feed(feed_name, 0 if feed_result else 1)
+    except OperationalError as e:
+      LOG.error("Fail to save feed '%s'", e)
+
+    if not feed_result:
+      return
 
-        LOG.debug("Got feed provider response '%s'", feed_result)
+    LOG.debug("Got feed provider response '%s'", feed_result)
 
-        for sensor_data in feed_result:
-          sensor_data = utils.prepare_sensor_data(sensor_data)
-          if sensor_data:
-            self.publish_metric(feed_config['mqtt_topic'], sensor_data)
+    for sensor_data in feed_result:
+      sensor_data = utils.prepare_sensor_data(sensor_data)
+      if sensor_data:
+        self.publish_metric(feed_config['mqtt_topic'], sensor_data)
 
-      time.sleep(10)
+  def _run_due(self):
+    """Run due feeds, returns seconds to next due feed (None without feeds)
+    """
+    for feed_name in [feed_name for feed_name in self._disabled if self._feed_enabled(feed_name)]:
+      self._disabled.discard(feed_name)
+      self._schedule_feed(feed_name)
+
+    while self._schedule and self._schedule[0][0] <= time.time():
+      _, feed_name = heapq.heappop(self._schedule)
+      if not self._feed_enabled(feed_name):
+        self._disabled.add(feed_name)
+        continue
+
+      self._run_feed(feed_name)
+      self._schedule_feed(feed_name)
+
+    if self._schedule:
+      return max(self._schedule[0][0] - time.time(), 0)
+    return None
+
+  def run(self):
+    LOG.info('Starting')
+    self.loop_start()
+    self.publish_status()
+    while True:
+      self.enabled.wait()
+      self._wakeup.clear()
+      self._wakeup.wait(self._run_due())
 
 
 LOG = logging.getLogger(__name__)
@@ -135,10 +179,14 @@ def main():
 
   logging_conf = conf.get('logging', {})
   utils.create_logger(logging_conf)
+  utils.configure_http(**conf.get('http', {}))
 
   feeder = Feeder(db_string=conf['db_string'],
+          db_pool=conf.get('db_pool'),
+          db_sqlite=conf.get('db_sqlite'),
           mqtt_config=conf['mqtt'],
-          feeds_map_file=feeds_map_file)
+          feeds_map_file=feeds_map_file,
+          jitter=conf.get('jitter', 0))
   feeder.run()
 
 
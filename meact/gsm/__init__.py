@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+from threading import Event
+import Queue
+import json
+import logging
+import time
+
+from meact import mqtt
+from meact import utils
+from meact.utils.queues import EventQueue
+from meact.utils.stats import Stats
+
+
+class ModemError(Exception):
+  pass
+
+
+class Gsm(mqtt.Mqtt):
+  """Service owning GSM modem
+
+  Modem connection is kept open, SMS requests received on gsm/sms
+  topic ({"recipient": [..], "message": "..", "priority": 0}) are sent
+  one by one. Failed SMS is retried after reconnect up to retries
+  times. Queue depth, modem connection and signal strength are
+  published on mgmt/stats/gsm.
+  """
+  def __init__(self, modem, mqtt_config, queue_size=0, queue_policy='drop_oldest', retries=2, retry_interval=10,
+          coverage_timeout=30, stats_interval=60):
+    super(Gsm, self).__init__()
+    self.name = 'gsm'
+    self.enabled = Event()
+    self.enabled.set()
+    self.status = {'gsm': 1}
+    self.modem = modem
+    self.mqtt_config = mqtt_config
+    self.sms_queue = EventQueue(queue_size, queue_policy)
+    self.retries = retries
+    self.retry_interval = retry_interval
+    self.coverage_timeout = coverage_timeout
+    self.connected = False
+    self.signal = -1
+    self.stats = Stats()
+    self.stats_interval = stats_interval
+    self._stats_published = time.time()
+    self._connect_attempt = 0
+
+    self.start_mqtt()
+
+  def _on_message(self, client, userdata, msg):
+    try:
+      sms = json.loads(msg.payload)
+      recipients = sms['recipient']
+      message = sms['message']
+      priority = int(sms.get('priority', 0))
+    except (ValueError, TypeError, KeyError) as e:
+      LOG.warning("Invalid SMS request '%s'", msg.payload)
+      self.stats.incr('invalid')
+      return
+
+    if not isinstance(recipients, list):
+      recipients = [recipients]
+
+    for recipient in recipients:
+      self.sms_queue.put(priority, {'recipient': recipient, 'message': message, 'attempt': 0})
+
+  def _throttled(self):
+    """Return seconds left until next reconnect is allowed
+    """
+    if self.connected:
+      return 0
+    return max(self._connect_attempt + self.retry_interval - time.time(), 0)
+
+  def _connect(self):
+    if self.connected:
+      return True
+
+    if self._throttled():
+      return False
+
+    self._connect_attempt = time.time()
+    try:
+      self.signal = self.modem.connect(self.coverage_timeout)
+    except ModemError as e:
+      LOG.error("Fail to connect to modem '%s'", e)
+      self.stats.incr('connect_failed')
+      self.modem.close()
+      return False
+
+    LOG.info('Modem connected, signal %s', self.signal)
+    self.connected = True
+    return True
+
+  def _disconnect(self):
+    self.connected = False
+    self.modem.close()
+
+  def _send(self, timeout=5):
+    """Send next queued SMS, returns False when queue was empty
+    """
+    try:
+      priority, sms = self.sms_queue.get(True, timeout)
+    except Queue.Empty:
+      return False
+
+    wait = self._throttled()
+    if wait:
+      # Nothing was tried, SMS keeps its attempts
+      self.sms_queue.put(priority, sms)
+      time.sleep(min(wait, timeout))
+      return True
+
+    if self._connect():
+      start = time.time()
+      try:
+        self.modem.send_sms(sms['recipient'], sms['message'])
+      except ModemError as e:
+        LOG.error("Fail to send SMS to '%s' '%s'", sms['recipient'], e)
+        self._disconnect()
+      else:
+        self.stats.incr('sent')
+        self.stats.observe('send_latency', (time.time() - start) * 1000)
+        return True
+
+    sms['attempt'] += 1
+    if sms['attempt'] > self.retries:
+      LOG.error("Dropping SMS to '%s' after %d attempts", sms['recipient'], sms['attempt'])
+      self.stats.incr('failed')
+    else:
+      self.sms_queue.put(priority, sms)
+      # Wait for reconnect
+      time.sleep(min(self.retry_interval, timeout))
+
+    return True
+
+  def _update_signal(self):
+    if not self.connected:
+      self.signal = -1
+      return
+
+    try:
+      self.signal = self.modem.signal_strength()
+    except ModemError as e:
+      LOG.error("Fail to get signal strength '%s'", e)
+      self._disconnect()
+
+  def _publish_stats(self):
+    if not self.stats_interval or time.time() - self._stats_published < self.stats_interval:
+      return
+
+    self._stats_published = time.time()
+    self._update_signal()
+    self.stats.gauge('connected', int(self.connected))
+    self.stats.gauge('signal', self.signal)
+    stats = self.stats.snapshot()
+    stats.update(('sms_queue/' + name, value) for name, value in self.sms_queue.snapshot().iteritems())
+    self.publish_stats(stats)
+
+  def run(self):
+    LOG.info('Starting')
+    self.loop_start()
+    self.publish_status()
+    self._connect()
+    while True:
+      self.enabled.wait()
+      self._send()
+      self._publish_stats()
+
+
+LOG = logging.getLogger(__name__)
+
+def main():
+  from meact.gsm.modem import Modem
+
+  parser = utils.create_arg_parser('Meact GSM service')
+  args = parser.parse_args()
+
+  conf = utils.load_config(args.dir + '/global.yaml')
+  conf = conf.get('gsm', {})
+
+  logging_conf = conf.get('logging', {})
+  utils.create_logger(logging_conf)
+
+  gsm = Gsm(
+    modem=Modem(conf['port'], conf['speed'], conf.get('pin')),
+    mqtt_config=conf['mqtt'],
+    queue_size=conf.get('queue_size', 0),
+    queue_policy=conf.get('queue_policy', 'drop_oldest'),
+    retries=conf.get('retries', 2),
+    retry_interval=conf.get('retry_interval', 10),
+    coverage_timeout=conf.get('coverage_timeout', 30),
+    stats_interval=conf.get('stats_interval', 60))
+
+  gsm.run()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,41 @@
+import logging
+
+from gsmmodem.exceptions import GsmModemException
+from gsmmodem.modem import GsmModem
+from serial import SerialException
+
+from meact.gsm import ModemError
+
+logging.getLogger("gsmmodem.modem.GsmModem").setLevel(logging.CRITICAL)
+
+
+class Modem(object):
+  """GsmModem adapter used by Gsm service
+
+  python-gsmmodem and serial exceptions are raised as ModemError.
+  """
+  def __init__(self, port, speed, pin=None):
+    self.pin = pin
+    self.modem = GsmModem(port, speed)
+
+  def _call(self, method, *args, **kwargs):
+    try:
+      return method(*args, **kwargs)
+    except (GsmModemException, SerialException, OSError) as e:
+      raise ModemError(e)
+
+  def connect(self, coverage_timeout):
+    self._call(self.modem.connect, self.pin)
+    return self._call(self.modem.waitForNetworkCoverage, coverage_timeout)
+
+  def send_sms(self, recipient, message):
+    self._call(self.modem.sendSms, recipient, message)
+
+  def signal_strength(self):
+    return self._call(lambda: self.modem.signalStrength)
+
+  def close(self):
+    try:
+      self.modem.close()
+    except Exception:
+      pass
@@ -35,6 +35,9 @@ def aggregate_metric(args):
   def compute_value(aggregate_detail, total_sum, count):
     value_type = aggregate_detail['type']
 
+    if not count:
+      return None
+
     if value_type == 'int':
       value = int(total_sum)/int(count)
     elif value_type == 'float':
@@ -45,9 +48,9 @@ def aggregate_metric(args):
 
     return value
 
-  def aggregate(aggregate_details, db, start, end, sensor_type, execute):
+  def aggregate(aggregate_details, db, table, start, end, sensor_type, execute):
     ids_to_delete = []
-    a_metrics = database.get_metric_aggregated(db, start=start, end=end, sensor_type=sensor_type)
+    a_metrics = database.get_metric_aggregated(db, start=start, end=end, sensor_type=sensor_type, table=table)
 
     for a_metric in a_metrics:
       metric = {
@@ -60,7 +63,8 @@ def aggregate_metric(args):
 
       for aggregate_detail in aggregate_details:
         if metric['sensor_type'] in aggregate_detail['sensor_type']:
-          m_to_delete = database.get_metric(db, board_ids=metric['board_id'], sensor_type=metric['sensor_type'], start=start, end=end)
+          m_to_delete = database.get_metric(db, board_ids=metric['board_id'], sensor_type=metric['sensor_type'], start=start, end=end,
+                  table=table)
           ids_to_delete += [m.id for m in m_to_delete if m.id != metric['id']]
 
           new_value = compute_value(aggregate_detail, metric['total_sum'], metric['count'])
@@ -72,12 +76,12 @@ def aggregate_metric(args):
                 new_value)
 
           if execute and new_value:
-            database.update_metric(db, metric['id'], new_value)
+            database.update_metric(db, metric['id'], new_value, table=table)
 
 
-    LOG.info("Delete %d metrics", len(ids_to_delete))
+    LOG.info("Delete %d metrics from '%s'", len(ids_to_delete), table.__tablename__)
     if execute:
-      database.delete_row(db, database.Metric, ids_to_delete)
+      database.delete_row(db, table, ids_to_delete)
 
   # Map policy name to seconds
   policy_map = {
@@ -91,8 +95,8 @@ def aggregate_metric(args):
 
   LOG.info('Aggregating metric')
 
-  db_string = get_global_config(args.dir).get('db_string')
-  db = database.connect(db_string)
+  conf = get_global_config(args.dir)
+  db = database.connect(conf.get('db_string'), partitioning=conf.get('db_partitioning'))
 
   aggregate_details = get_global_config(args.dir).get('aggregate')
 
@@ -100,24 +104,34 @@ def aggregate_metric(args):
   policy_end = int(args.start) + policy_map[args.policy]
 
   while (policy_end <= int(args.end)):
-    aggregate(aggregate_details, db, policy_start, policy_end, args.sensor_type, args.execute)
+    # Metrics are aggregated separately in every partition
+    for table in database.metric_tables(db, policy_start, policy_end):
+      aggregate(aggregate_details, db, table, policy_start, policy_end, args.sensor_type, args.execute)
     policy_start += policy_map[args.policy]
     policy_end += policy_map[args.policy]
 
 
+def clean_metric(args):
+  LOG.info('Cleaning metrics table')
+
+  conf = get_global_config(args.dir)
+  db = database.connect(conf.get('db_string'), partitioning=conf.get('db_partitioning'), chunks=conf.get('db_chunks'))
+
+  for table_name, count, drop in database.delete_metric(db, start=int(args.start), end=int(args.end), execute=args.execute):
+    if drop:
+      LOG.info("Drop partition '%s' with %d metrics", table_name, count)
+    else:
+      LOG.info("Got %d metrics between %s and %s in '%s'", count, args.start, args.end, table_name)
+
+
 def clean_action(args):
   LOG.info('Cleaning action table')
 
   db_string = get_global_config(args.dir).get('db_string')
   db = database.connect(db_string)
 
-  actions = database.get_action(db, start=args.start, end=args.end)
-  LOG.info('Got %d actions between %s and %s', len(actions), args.start, args.end)
-
-  ids_to_delete = [action.id for action in actions]
-
-  if args.execute:
-    database.delete_row(db, database.Action, ids_to_delete)
+  count = database.delete_action(db, start=int(args.start), end=int(args.end), execute=args.execute)
+  LOG.info('Got %d actions between %s and %s', count, args.start, args.end)
 
 
 def clean_feed(args):
@@ -126,13 +140,52 @@ def clean_feed(args):
   db_string = get_global_config(args.dir).get('db_string')
   db = database.connect(db_string)
 
-  feeds = database.get_feed(db, start=args.start, end=args.end)
-  LOG.info('Got %d feeds between %s and %s', len(feeds), args.start, args.end)
+  count = database.delete_feed(db, start=int(args.start), end=int(args.end), execute=args.execute)
+  LOG.info('Got %d feeds between %s and %s', count, args.start, args.end)
+
+
+def migrate_metric_value(args):
+  LOG.info('Migrating metrics to numeric sensor_value')
+
+  db_string = get_global_config(args.dir).get('db_string')
+  db = database.connect(db_string)
 
-  ids_to_delete = [feed.id for feed in feeds]
+  total = {}
+  for table_name, count in database.migrate_sensor_value(db, int(args.chunk_size), args.execute):
+    total[table_name] = total.get(table_name, 0) + count
+    LOG.debug("Backfilled %d rows in '%s'", count, table_name)
+
+  for table_name in total:
+    LOG.info("Got %d numeric values in '%s'", total[table_name], table_name)
+
+
+def compress_metric(args):
+  LOG.info('Compressing metrics')
+
+  conf = get_global_config(args.dir)
+  db = database.connect(conf.get('db_string'), partitioning=conf.get('db_partitioning'), chunks=conf.get('db_chunks'))
 
   if args.execute:
-    database.delete_row(db, database.Feed, ids_to_delete)
+    database.MetricChunk.__table__.create(db, checkfirst=True)
+
+  total_count, total_size = 0, 0
+  for table_name, board_id, sensor_type, count, size in database.compress_metric(db, int(args.end), args.execute):
+    LOG.debug("Compressed %d metrics for '%s' on '%s' from '%s' into %d bytes", count, sensor_type, board_id,
+            table_name, size)
+    total_count += count
+    total_size += size
+
+  LOG.info('Got %d metrics before %s compressed into %d bytes', total_count, args.end, total_size)
+
+
+def migrate_index(args):
+  LOG.info('Migrating indexes')
+
+  conf = get_global_config(args.dir)
+  db = database.connect(conf.get('db_string'), partitioning=conf.get('db_partitioning'))
+
+  for table_name, index_name, action in database.migrate_indexes(db, args.execute):
+    LOG.info("Index '%s' on '%s' needs %s", index_name, table_name, action)
 
 
 def main():
@@ -153,6 +206,12 @@ def main():
   p_aggregate_metric.add_argument('--execute', required=False, help='Execute data aggregation, without this DB will not be changed', action="store_true")
   p_aggregate_metric.set_defaults(func=aggregate_metric)
 
+  p_clean_metric = subparsers.add_parser('clean-metric', help='Clean (remove) old metrics, drop partitions when possible')
+  p_clean_metric.add_argument('--start', required=True, help='Start time for cleaning (seconds since epoch)')
+  p_clean_metric.add_argument('--end', required=True, help='End time for cleaning (seconds since epoch)')
+  p_clean_metric.add_argument('--execute', required=False, help='Execute data cleaning, without this DB will not be changed', action="store_true")
+  p_clean_metric.set_defaults(func=clean_metric)
+
   p_clean_action = subparsers.add_parser('clean-action', help='Clean (remove) old records from action table')
   p_clean_action.add_argument('--start', required=True, help='Start time for cleaning (seconds since epoch)')
   p_clean_action.add_argument('--end', required=True, help='End time for cleaning (seconds since epoch)')
@@ -165,6 +224,20 @@ def main():
   p_clean_feed.add_argument('--execute', required=False, help='Execute data cleaning, without this DB will not be changed', action="store_true")
   p_clean_feed.set_defaults(func=clean_feed)
 
+  p_migrate_metric_value = subparsers.add_parser('migrate-metric-value', help='Add and backfill numeric sensor_value for metrics')
+  p_migrate_metric_value.add_argument('--chunk-size', required=False, default=1000, help='Number of rows updated in single transaction')
+  p_migrate_metric_value.add_argument('--execute', required=False, help='Execute migration, without this DB will not be changed', action="store_true")
+  p_migrate_metric_value.set_defaults(func=migrate_metric_value)
+
+  p_compress_metric = subparsers.add_parser('compress-metric', help='Compress numeric metrics into chunks, requires db_chunks')
+  p_compress_metric.add_argument('--end', required=True, help='Compress metrics older than end (seconds since epoch)')
+  p_compress_metric.add_argument('--execute', required=False, help='Execute compression, without this DB will not be changed', action="store_true")
+  p_compress_metric.set_defaults(func=compress_metric)
+
+  p_migrate_index = subparsers.add_parser('migrate-index', help='Drop and create indexes to match current schema')
+  p_migrate_index.add_argument('--execute', required=False, help='Execute migration, without this DB will not be changed', action="store_true")
+  p_migrate_index.set_defaults(func=migrate_index)
+
   args = parser.parse_args()
 
   utils.create_logger()
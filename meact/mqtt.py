@@ -97,6 +97,12 @@ class Mqtt(object):
     else:
       LOG.warning("Fail to subscribe to topic '%s', unknown type", topic)
 
+  def topic_matches(self, name, topic):
+    """Check if topic matches subscription name from mqtt config
+    """
+    subscription = self.mqtt_config.get('topic', {}).get('subscribe', {}).get(name)
+    return bool(subscription) and paho.topic_matches_sub(subscription, topic)
+
   def publish_status(self, status=None):
     topic = self.mqtt_config.get('topic', {})
     if hasattr(self, 'status') and 'mgmt/status' in topic:
@@ -110,6 +116,16 @@ class Mqtt(object):
     else:
       LOG.warning('Status topic unknown, not publishing')
 
+  def publish_stats(self, stats):
+    """Publish stats on mgmt/stats/<name>/<stat>
+
+    Stats are not retained and are kept out of mgmt/status tree, so
+    they are not handled as status (or executor metrics).
+    """
+    topic = self.mqtt_config.get('topic', {}).get('mgmt/stats', 'mgmt/stats')
+    for name, value in stats.iteritems():
+      self.publish(topic + '/' + self.name + '/' + name, value)
+
   def publish_metric(self, topic, payload):
     mqtt_topic = topic + '/' + payload['sensor_type'] + '/' + payload['board_id']
     self.publish(mqtt_topic, payload['sensor_data'])
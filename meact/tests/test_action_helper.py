@@ -4,8 +4,8 @@ import sys
 
 import pytest
 
-from meact import executor
 from meact import utils
+from meact.executor import plan
 
 
 default_sensor_config = {
@@ -148,10 +148,24 @@ check_metric_test_data = (
     ],
     True
   ),
+  (
+    [
+      {'value_count': {'type': 'Metric', 'count': 10}, 'threshold': {'lambda': 'lambda x: int(x)==1'},
+       'sensor_type': 'voltage', 'min_value': 3, 'max_value': 3.15}
+    ],
+    True
+  ),
   (
     [],
     True
   ),
+  (
+    [
+      {'value_count': {'type': 'Metric', 'count': 10}, 'threshold': {'lambda': 'lambda x: int(x)==1'},
+       'sensor_type': 'voltage', 'max_value': 'test'}
+    ],
+    False
+  ),
   (
     [
       {'threshold': {'lambda': 'lambda x: int(x)==1'},
@@ -325,9 +339,9 @@ def test_config_for_board(board_ids, expected):
   sensor_config = copy.deepcopy(default_sensor_config)
   sensor_config['actions'][0]['board_ids'] = board_ids
 
-  ada = executor.SensorActionAdapter(sensor_config['actions'][0])
+  rule = plan.compile_sensor_config('voltage', sensor_config, {}, {}).rules[0]
 
-  assert ada.action_for_board(board_id) == expected
+  assert rule.for_board(board_id) == expected
 
 board_ids_test_data = (
   (
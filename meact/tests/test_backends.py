@@ -0,0 +1,282 @@
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from meact import backends
+
+
+@pytest.fixture(params=['sqlite://', 'memory://'])
+def backend(request):
+  backend = backends.connect(request.param)
+  backend.create_db()
+  return backend
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  now = [1454284800]
+  monkeypatch.setattr(time, 'time', lambda: now[0])
+  return now
+
+
+def metric(board_id, sensor_type, sensor_data, last_update):
+  return {
+    'board_id': board_id,
+    'sensor_type': sensor_type,
+    'sensor_data': sensor_data,
+    'last_update': last_update
+  }
+
+
+@pytest.fixture
+def metrics(backend):
+  backend.insert_metrics([
+    metric('1', 'voltage', '3.3', 100),
+    metric('1', 'voltage', '3.2', 110),
+    metric('2', 'voltage', '3.1', 105),
+    metric('1', 'geolocation', 'exit', 120),
+    metric('2', 'voltage', '2.9', 130),
+  ])
+  return backend
+
+
+@pytest.mark.parametrize('db_string, backend_class', [
+  ('memory://', backends.MemoryBackend),
+  ('sqlite://', backends.SqlBackend),
+  ('sqlite:////tmp/meact.db', backends.SqlBackend),
+])
+def test_connect(db_string, backend_class):
+  assert isinstance(backends.connect(db_string), backend_class)
+
+
+def test_board(backend):
+  backend.sync_board({'1': 'one', '2': 'two'})
+  backend.sync_board({'1': 'first', '3': 'three'})
+
+  assert sorted((b.board_id, b.board_desc) for b in backend.get_board()) == [('1', 'first'), ('3', 'three')]
+  assert [b.board_desc for b in backend.get_board(board_ids='3')] == ['three']
+
+
+@pytest.mark.parametrize('params, expected', [
+  ({}, ['3.3', '3.1', '3.2', 'exit', '2.9']),
+  ({'board_ids': '1'}, ['3.3', '3.2', 'exit']),
+  ({'board_ids': ['1', '2'], 'sensor_type': 'voltage'}, ['3.3', '3.1', '3.2', '2.9']),
+  ({'start': 105, 'end': 120}, ['3.1', '3.2', 'exit']),
+  ({'sensor_type': 'voltage', 'last_available': 2}, ['3.2', '2.9']),
+  ({'board_ids': '2', 'last_available': 5}, ['3.1', '2.9']),
+  ({'min_value': 3.0, 'max_value': 3.2}, ['3.1', '3.2']),
+  ({'sensor_type': 'rssi'}, []),
+])
+def test_get_metric(metrics, params, expected):
+  assert [m.sensor_data for m in metrics.get_metric(**params)] == expected
+
+
+@pytest.mark.parametrize('params, expected', [
+  ({}, [('1', 'geolocation', 'exit'), ('1', 'voltage', '3.2'), ('2', 'voltage', '2.9')]),
+  ({'board_ids': '2'}, [('2', 'voltage', '2.9')]),
+  ({'sensor_type': 'voltage', 'start': 120}, [('2', 'voltage', '2.9')]),
+  ({'min_value': 3}, [('1', 'voltage', '3.2')]),
+])
+def test_get_last_metric(metrics, params, expected):
+  assert sorted((m.board_id, m.sensor_type, m.sensor_data) for m in metrics.get_last_metric(**params)) == expected
+
+
+def test_insert_metric(backend, clock):
+  backend.insert_metric({'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.3'})
+  backend.insert_metric({'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.0', 'last_update': 100})
+
+  assert [(m.sensor_value, m.last_update) for m in backend.get_metric()] == [(3.0, 100), (3.3, clock[0])]
+  # Last metric is the last inserted, not the newest
+  assert [m.sensor_data for m in backend.get_last_metric()] == ['3.0']
+
+
+def test_delete_metric(metrics):
+  assert metrics.delete_metric(start=105, end=120) == 3
+  assert [m.sensor_data for m in metrics.get_metric()] == ['3.3', '2.9']
+  assert metrics.delete_metric() == 2
+  assert metrics.get_metric() == []
+
+
+def test_action(backend, clock):
+  for sensor_action_id in ('a', 'b', 'a'):
+    backend.insert_action('1', 'voltage', sensor_action_id)
+    clock[0] += 10
+  backend.insert_action('2', 'rssi', 'a')
+
+  start = clock[0] - 30
+  assert [(a.sensor_action_id, a.last_update - start) for a in backend.get_action(board_ids='1')] == [
+    ('a', 0), ('b', 10), ('a', 20)]
+  assert [a.last_update - start for a in backend.get_action(sensor_action_id='a', last_available=2)] == [20, 30]
+  assert [a.board_id for a in backend.get_action(board_ids=['1', '2'], sensor_type='rssi')] == ['2']
+  assert len(backend.get_action(start=start + 10, end=start + 20)) == 2
+
+  assert backend.delete_action(end=start + 10) == 2
+  assert [a.last_update - start for a in backend.get_action()] == [20, 30]
+
+  backend.insert_actions([
+    {'board_id': '1', 'sensor_type': 'voltage', 'sensor_action_id': 'c', 'last_update': start},
+    {'board_id': '2', 'sensor_type': 'voltage', 'sensor_action_id': 'c'},
+  ])
+  assert [(a.board_id, a.last_update - start) for a in backend.get_action(sensor_action_id='c')] == [
+    ('1', 0), ('2', 30)]
+
+
+def test_feed(backend, clock):
+  for result in (0, 1, 0):
+    backend.insert_feed('feed', result)
+    clock[0] += 10
+  backend.insert_feed('other', 1)
+
+  start = clock[0] - 30
+  assert [f.result for f in backend.get_feed(feed_name='feed')] == [0, 1, 0]
+  assert [f.last_update - start for f in backend.get_feed(feed_name='feed', result=1)] == [10]
+  # Successful feeds are filtered too
+  assert [f.last_update - start for f in backend.get_feed(feed_name='feed', result=0)] == [0, 20]
+  assert [f.feed_name for f in backend.get_feed(result=1, last_available=1)] == ['other']
+  assert len(backend.get_feed(start=start + 10)) == 3
+
+  assert backend.delete_feed(start=start + 10, end=start + 20) == 2
+  assert [f.last_update - start for f in backend.get_feed()] == [0, 30]
+
+
+class FailingBackend(backends.MemoryBackend):
+  failing = True
+
+  def get_last_metric(self, *args, **kwargs):
+    if self.failing:
+      raise OperationalError('SELECT', {}, 'database is locked')
+    return super(FailingBackend, self).get_last_metric(*args, **kwargs)
+
+
+def test_last_metric_cache(metrics, clock):
+  cache = backends.LastMetricCache(metrics)
+  cache.update({'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.0', 'last_update': 200})
+  assert cache.seed()
+  cache.update({'board_id': '3', 'sensor_type': 'rssi', 'sensor_data': '-80'})
+
+  # Metric from stream is newer than seeded one
+  assert sorted((m.board_id, m.sensor_type, m.sensor_data) for m in cache.get_last_metric()) == [
+    ('1', 'geolocation', 'exit'), ('1', 'voltage', '3.0'), ('2', 'voltage', '2.9'), ('3', 'rssi', '-80')]
+  assert [m.sensor_value for m in cache.get_last_metric(board_ids=['1', '3'], sensor_type='rssi')] == [-80]
+  assert [m.board_id for m in cache.get_last_metric(sensor_type='voltage', min_value=3, start=150)] == ['1']
+
+  # Other calls go to backend
+  assert len(cache.get_metric(sensor_type='voltage')) == 4
+
+  stats = cache.snapshot()
+  assert (stats['hit'], stats['update'], stats['entries'], stats['stream_age']) == (3, 2, 4, 0)
+  assert stats['max_age'] == clock[0] - 120
+
+
+def test_last_metric_cache_cold(clock):
+  backend = FailingBackend()
+  backend.insert_metric({'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.3'})
+  cache = backends.LastMetricCache(backend, retry_interval=10)
+
+  assert not cache.seed()
+  with pytest.raises(OperationalError):
+    cache.get_last_metric()
+
+  backend.failing = False
+  assert [m.sensor_data for m in cache.get_last_metric()] == ['3.3']
+  assert not cache.seeded
+
+  clock[0] += 10
+  assert [m.sensor_data for m in cache.get_last_metric()] == ['3.3']
+  assert cache.seeded
+  assert cache.snapshot()['fallback'] == 2
+
+
+def test_last_metric_cache_boards(backend, clock):
+  backend.sync_board({'1': 'one'})
+  cache = backends.LastMetricCache(backend, boards_ttl=60)
+  assert [b.board_desc for b in cache.get_board()] == ['one']
+
+  backend.sync_board({'1': 'first', '2': 'two'})
+  assert [b.board_desc for b in cache.get_board()] == ['one']
+
+  clock[0] += 61
+  assert [b.board_desc for b in cache.get_board(board_ids='2')] == ['two']
+
+
+def test_ring_buffer():
+  buf = backends.window.RingBuffer(3, 100)
+  assert all(buf.append(ts, float(ts), str(ts)) for ts in (100, 110, 120))
+  assert not buf.append(130, None, 'exit')
+
+  assert list(buf) == [(110, 110.0, '110'), (120, 120.0, '120'), (130, None, 'exit')]
+  assert buf.covered_since == 101
+
+  buf.expire(125)
+  assert list(buf) == [(130, None, 'exit')]
+  assert buf.covered_since == 125
+
+
+@pytest.fixture
+def windows(clock):
+  backend = backends.MemoryBackend()
+  now = clock[0]
+  backend.insert_metrics([metric('1', 'ping_gw', str(i), now - 4000 + i * 600) for i in range(6)])
+  backend.insert_metrics([metric('2', 'ping_gw', '-1', now - 100), metric('1', 'rssi', '-80', now - 100)])
+  return backends.MetricWindows(backend, {'ping_gw': 3600, 'voltage': 0}, capacity=8)
+
+
+@pytest.mark.parametrize('params, hit', [
+  ({'sensor_type': 'ping_gw', 'start': -3600}, True),
+  ({'board_ids': '1', 'sensor_type': 'ping_gw', 'start': -3600, 'last_available': 2}, True),
+  ({'board_ids': '1', 'sensor_type': 'ping_gw', 'start': -1200, 'end': -600, 'min_value': 4}, True),
+  ({'board_ids': ['1', '2'], 'sensor_type': 'ping_gw', 'last_available': 3}, True),
+  # Metrics older than window
+  ({'board_ids': '1', 'sensor_type': 'ping_gw', 'start': -4000}, False),
+  ({'board_ids': '1', 'sensor_type': 'ping_gw', 'last_available': 6}, False),
+  # Cold buffer without window
+  ({'sensor_type': 'voltage', 'start': -3600}, False),
+  ({'sensor_type': 'rssi', 'start': -3600}, False),
+])
+def test_metric_windows(windows, clock, params, hit):
+  for offset in ('start', 'end'):
+    if offset in params:
+      params[offset] += clock[0]
+
+  expected = [(m.board_id, m.sensor_data, m.last_update) for m in windows.backend.get_metric(**params)]
+  assert [(m.board_id, m.sensor_data, m.last_update) for m in windows.get_metric(**params)] == expected
+  assert windows.snapshot()['hit' if hit else 'miss'] == 1
+
+
+def test_metric_windows_stream(windows, clock):
+  windows.update({'board_id': '3', 'sensor_type': 'voltage', 'sensor_data': '3.3'})
+  windows.update({'board_id': '3', 'sensor_type': 'rssi', 'sensor_data': '-80'})
+
+  assert [m.sensor_value for m in windows.get_metric(sensor_type='voltage', last_available=1)] == [3.3]
+  assert windows.get_metric(sensor_type='voltage', last_available=2) == []
+
+  for i in range(8):
+    windows.update({'board_id': '3', 'sensor_type': 'ping_gw', 'sensor_data': str(i), 'last_update': clock[0] + i})
+  assert [m.sensor_data for m in windows.get_metric(board_ids='3', sensor_type='ping_gw', last_available=8)] == [
+    str(i) for i in range(8)]
+
+  # Buffer overflow, metrics before newest 8 are unknown
+  windows.update({'board_id': '3', 'sensor_type': 'ping_gw', 'sensor_data': '8', 'last_update': clock[0] + 8})
+  assert windows.get_metric(board_ids='3', sensor_type='ping_gw', start=clock[0] - 3600) == []
+
+  stats = windows.snapshot()
+  assert (stats['hit'], stats['miss'], stats['overflow'], stats['series']) == (2, 2, 1, 4)
+
+  windows.set_windows({'rssi': 3600})
+  assert windows.snapshot()['series'] == 1
+  assert [m.sensor_data for m in windows.get_metric(sensor_type='rssi', start=clock[0] - 3600)] == ['-80']
+
+
+def test_metric_windows_seed_unlocked(windows, clock):
+  locked = []
+  get_metric = windows.backend.get_metric
+
+  def seed(*args, **kwargs):
+    locked.append(windows._lock.locked())
+    return get_metric(*args, **kwargs)
+  windows.backend.get_metric = seed
+
+  windows.set_windows({'ping_gw': 3600, 'rssi': 3600})
+  assert locked == [False]
+  assert [m.sensor_data for m in windows.get_metric(sensor_type='rssi', start=clock[0] - 3600)] == ['-80']
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from meact.utils import chunk
+
+
+def random_points(count, seed):
+  r = random.Random(seed)
+  timestamp, value = 1454284800, 3.3
+  points = []
+
+  for i in range(count):
+    timestamp += r.choice([60, 60, 59, 61, 0, 300, 86400])
+    value = r.choice([value, round(value + r.uniform(-0.1, 0.1), 2), float(r.randint(-90, -40)), 1e300, 0.1])
+    points.append((timestamp, value))
+
+  return points
+
+
+@pytest.mark.parametrize('points', [
+  [],
+  [(1454284800, 3.3)],
+  [(1454284800, 3.3), (1454284860, 3.3), (1454284920, 3.3)],
+  [(1454284800, -80.0), (1454284800, -81.0), (1454284700, -79.0)],
+  [(1454284800, 0.0), (1454284860, -0.5), (1454284861, 1e-300), (1454384861, -1e300)],
+  random_points(100, 1),
+  random_points(1000, 2),
+])
+def test_encode_decode(points):
+  assert chunk.decode(chunk.encode(points)) == points
+
+
+def test_encode_regular_series():
+  points = [(1454284800 + i * 60, 21.0) for i in range(1000)]
+
+  # 16 bytes header, first delta in 9 bits, then 2 bits per metric
+  assert len(chunk.encode(points)) == 16 + (9 + 1 + 998 * 2 + 7) / 8
@@ -0,0 +1,124 @@
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from meact import backends
+from meact.executor.cooldown import CooldownTracker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  now = [1454284800]
+  monkeypatch.setattr(time, 'time', lambda: now[0])
+  return now
+
+
+class FailingBackend(backends.MemoryBackend):
+  failing = True
+
+  def get_action(self, *args, **kwargs):
+    if self.failing and 'start' in kwargs:
+      raise OperationalError('SELECT', {}, 'database is locked')
+    return super(FailingBackend, self).get_action(*args, **kwargs)
+
+  def insert_actions(self, actions):
+    if self.failing:
+      raise OperationalError('INSERT', {}, 'database is locked')
+    super(FailingBackend, self).insert_actions(actions)
+
+
+def action(board_id, sensor_action_id, last_update):
+  return {'board_id': board_id, 'sensor_type': 'voltage', 'sensor_action_id': sensor_action_id,
+          'last_update': last_update}
+
+
+def test_load(clock):
+  backend = backends.MemoryBackend()
+  now = clock[0]
+  backend.insert_actions([action('1', 'a', now - 7200), action('1', 'a', now - 100), action('1', 'a', now - 200),
+                          action('2', 'a', now - 7200), action('1', 'b', now - 10)])
+
+  cooldown = CooldownTracker(backend)
+  assert cooldown.load(3600)
+
+  assert cooldown.last_executed('1', 'voltage', 'a') == now - 100
+  assert cooldown.last_executed('1', 'voltage', 'b') == now - 10
+  # Older than longest action_interval
+  assert cooldown.last_executed('2', 'voltage', 'a') == 0
+
+  stats = cooldown.snapshot()
+  assert (stats['hit'], stats['entries'], stats['loaded']) == (3, 2, 1)
+
+
+def test_write_behind(clock):
+  backend = backends.MemoryBackend()
+  cooldown = CooldownTracker(backend, batch_size=3, flush_interval=5)
+  cooldown.load(3600)
+
+  cooldown.executed('1', 'voltage', 'a')
+  cooldown.executed('2', 'voltage', 'a')
+  assert cooldown.last_executed('1', 'voltage', 'a') == clock[0]
+  assert cooldown.flush() == 0
+  assert backend.get_action() == []
+
+  clock[0] += 5
+  assert cooldown.flush() == 2
+  assert [(a.board_id, a.last_update) for a in backend.get_action()] == [('1', clock[0] - 5), ('2', clock[0] - 5)]
+
+  for board_id in ('1', '2', '3'):
+    cooldown.executed(board_id, 'voltage', 'b')
+  assert cooldown.flush() == 3
+
+  cooldown.executed('1', 'voltage', 'c')
+  assert cooldown.flush(force=True) == 1
+  assert len(backend.get_action()) == 6
+  assert cooldown.snapshot()['saved'] == 6
+
+
+def test_backend_failure(clock):
+  backend = FailingBackend()
+  backend.failing = False
+  backend.insert_actions([action('1', 'a', clock[0] - 100)])
+  backend.failing = True
+
+  cooldown = CooldownTracker(backend, batch_size=1, retry_interval=10)
+  assert not cooldown.load(3600)
+  # Read from backend until actions are loaded
+  assert cooldown.last_executed('1', 'voltage', 'a') == clock[0] - 100
+
+  cooldown.executed('1', 'voltage', 'a')
+  assert cooldown.flush() == 0
+  assert cooldown.last_executed('1', 'voltage', 'a') == clock[0]
+  assert cooldown.snapshot()['pending'] == 1
+
+  backend.failing = False
+  clock[0] += 10
+  assert cooldown.last_executed('1', 'voltage', 'b') == 0
+  assert cooldown.loaded
+  assert cooldown.flush() == 1
+
+  stats = cooldown.snapshot()
+  assert (stats['fallback'], stats['failed'], stats['saved'], stats['pending']) == (2, 1, 1, 0)
+
+
+def test_sql_backend_locked(tmpdir, clock):
+  db_file = str(tmpdir.join('meact.db'))
+  backend = backends.SqlBackend('sqlite:///' + db_file, sqlite={'busy_timeout': 0})
+  backend.create_db()
+
+  cooldown = CooldownTracker(backend, batch_size=1)
+  assert cooldown.load(3600)
+  cooldown.executed('1', 'voltage', 'a')
+
+  lock = sqlite3.connect(db_file)
+  lock.execute('BEGIN EXCLUSIVE')
+  assert cooldown.flush() == 0
+  assert cooldown.snapshot()['pending'] == 1
+  lock.rollback()
+  lock.close()
+
+  # Session of failed batch does not break next flush
+  assert cooldown.flush() == 1
+  assert [(a.board_id, a.last_update) for a in backend.get_action()] == [('1', clock[0])]
@@ -0,0 +1,282 @@
+import sqlite3
+
+import pytest
+
+from meact import database
+
+
+@pytest.fixture
+def db():
+  db = database.connect('sqlite://')
+  database.create_db(db)
+  return db
+
+
+def metric(board_id, sensor_type, sensor_data, last_update):
+  return {
+    'board_id': board_id,
+    'sensor_type': sensor_type,
+    'sensor_data': sensor_data,
+    'last_update': last_update
+  }
+
+
+def test_insert_metrics(db):
+  database.insert_metrics(db, [
+    metric('1', 'voltage', '3.3', 100),
+    metric('1', 'voltage', '3.2', 101),
+    metric('2', 'voltage', '3.1', 102),
+  ])
+
+  metrics = database.get_metric(db, sensor_type='voltage')
+  assert [m.sensor_data for m in metrics] == ['3.3', '3.2', '3.1']
+
+  last_metrics = database.get_last_metric(db, sensor_type='voltage')
+  assert sorted((m.board_id, m.sensor_data, m.last_update) for m in last_metrics) == [
+    ('1', '3.2', 101),
+    ('2', '3.1', 102),
+  ]
+
+
+def test_insert_metrics_update_last_metric(db):
+  database.insert_metrics(db, [metric('1', 'voltage', '3.3', 100)])
+  database.insert_metrics(db, [
+    metric('1', 'voltage', '3.0', 110),
+    metric('1', 'rssi', '-80', 110),
+  ])
+
+  last_metrics = database.get_last_metric(db, board_ids='1')
+  assert sorted((m.sensor_type, m.sensor_data) for m in last_metrics) == [
+    ('rssi', '-80'),
+    ('voltage', '3.0'),
+  ]
+  assert len(database.get_metric(db, board_ids='1')) == 3
+
+
+def test_insert_metric(db):
+  database.insert_metric(db, {'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.3'})
+
+  last_metrics = database.get_last_metric(db)
+  assert len(last_metrics) == 1
+  assert last_metrics[0].last_update > 0
+
+
+def test_insert_metrics_without_upsert(db, monkeypatch):
+  monkeypatch.setattr(database, '_upsert_statement', lambda dialect, table: None)
+
+  database.insert_metrics(db, [metric('1', 'voltage', '3.3', 100)])
+  database.insert_metrics(db, [
+    metric('1', 'voltage', '3.0', 110),
+    metric('2', 'voltage', '3.1', 110),
+  ])
+
+  last_metrics = database.get_last_metric(db, sensor_type='voltage')
+  assert sorted((m.board_id, m.sensor_data) for m in last_metrics) == [
+    ('1', '3.0'),
+    ('2', '3.1'),
+  ]
+
+
+def test_create_session_is_reused(db):
+  s = database.create_session(db)
+
+  assert database.create_session(db) is s
+  assert database.create_session(database.connect('sqlite://')) is not s
+
+
+def test_failed_session_is_removed(tmpdir):
+  from sqlalchemy.exc import OperationalError
+
+  db_file = str(tmpdir.join('meact.db'))
+  db = database.connect('sqlite:///' + db_file, sqlite={'busy_timeout': 0})
+  database.create_db(db)
+  database.sync_board(db, {'1': 'kitchen'})
+
+  lock = sqlite3.connect(db_file)
+  lock.execute('BEGIN EXCLUSIVE')
+  for helper in (lambda: database.sync_board(db, {'2': 'garage'}),
+                 lambda: database.delete_action(db, end=1, execute=True),
+                 lambda: database.delete_row(db, database.Action, [1])):
+    s = database.create_session(db)
+    with pytest.raises(OperationalError):
+      helper()
+    assert database.create_session(db) is not s
+  lock.rollback()
+  lock.close()
+
+  # Next queries of the thread get new session
+  assert [(b.board_id, b.board_desc) for b in database.get_board(db)] == [('1', 'kitchen')]
+  database.sync_board(db, {'2': 'garage'})
+  assert [b.board_id for b in database.get_board(db)] == ['2']
+
+
+@pytest.mark.parametrize('pool', [
+  {'class': 'queue', 'size': 2, 'max_overflow': 1},
+  {'class': 'static'},
+  {'class': 'null'},
+])
+def test_connect_pool(tmpdir, pool):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')), pool=pool)
+  database.create_db(db)
+  database.insert_action(db, '1', 'voltage', 'action-id')
+
+  assert len(database.get_action(db, board_ids='1', last_available=1)) == 1
+
+
+def test_sensor_value(db):
+  database.insert_metrics(db, [
+    metric('1', 'voltage', '3.3', 100),
+    metric('1', 'voltage', '2.9', 101),
+    metric('1', 'geolocation', 'exit', 102),
+  ])
+
+  metrics = database.get_metric(db, board_ids='1')
+  assert [m.sensor_value for m in metrics] == [3.3, 2.9, None]
+
+  metrics = database.get_metric(db, board_ids='1', sensor_type='voltage', max_value=3.15)
+  assert [m.sensor_data for m in metrics] == ['2.9']
+
+  aggregated = database.get_metric_aggregated(db, sensor_type='voltage')
+  assert [(round(a.total, 2), a.count) for a in aggregated] == [(6.2, 2)]
+
+
+def test_migrate_sensor_value(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')))
+  db.execute('CREATE TABLE metrics (id INTEGER PRIMARY KEY, board_id TEXT, sensor_type TEXT, sensor_data TEXT, last_update INTEGER)')
+  db.execute('CREATE TABLE last_metrics (board_id TEXT, sensor_type TEXT, sensor_data TEXT, last_update INTEGER, PRIMARY KEY (board_id, sensor_type))')
+  for i in range(25):
+    db.execute("INSERT INTO metrics (board_id, sensor_type, sensor_data, last_update) VALUES ('1', 't', ?, ?)",
+            'exit' if i % 5 == 0 else str(i), i)
+  for board_id in ('1', '2', '3'):
+    for sensor_type, sensor_data in (('t', '10'), ('geolocation', 'exit')):
+      db.execute("INSERT INTO last_metrics VALUES (?, ?, ?, 1)", board_id, sensor_type, sensor_data)
+
+  assert list(database.migrate_sensor_value(db, chunk_size=10)) == []
+
+  migrated = {}
+  for table_name, count in database.migrate_sensor_value(db, chunk_size=2, execute=True):
+    migrated[table_name] = migrated.get(table_name, 0) + count
+
+  assert migrated == {'metrics': 20, 'last_metrics': 3}
+  assert db.execute('SELECT count(*) FROM metrics WHERE sensor_value IS NULL').scalar() == 5
+  assert db.execute('SELECT sum(sensor_value) FROM last_metrics').scalar() == 30
+
+
+@pytest.fixture
+def partitioned_db(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')), partitioning='month')
+  database.create_db(db)
+  return db
+
+
+# 2016-01-31 23:59:00, 2016-02-01 00:01:00, 2016-03-15 12:00:00
+JAN, FEB, MAR = 1454284740, 1454284860, 1458043200
+
+
+def test_partition_insert(partitioned_db):
+  database.insert_metrics(partitioned_db, [
+    metric('1', 'voltage', '3.3', JAN),
+    metric('1', 'voltage', '3.2', FEB),
+    metric('1', 'voltage', '3.1', MAR),
+  ])
+
+  assert [t.__tablename__ for t in database.metric_tables(partitioned_db)] == [
+    'metrics', 'metrics_201601', 'metrics_201602', 'metrics_201603']
+  assert [t.__tablename__ for t in database.metric_tables(partitioned_db, start=FEB, end=FEB + 60)] == [
+    'metrics', 'metrics_201602']
+
+  assert [m.sensor_data for m in database.get_metric(partitioned_db, board_ids='1')] == ['3.3', '3.2', '3.1']
+  assert [m.sensor_data for m in database.get_metric(partitioned_db, start=FEB, end=MAR - 1)] == ['3.2']
+  assert [m.sensor_data for m in database.get_metric(partitioned_db, last_available=2)] == ['3.2', '3.1']
+  assert [m.sensor_data for m in database.get_last_metric(partitioned_db)] == ['3.1']
+
+
+def test_partition_delete(partitioned_db):
+  database.insert_metrics(partitioned_db, [
+    metric('1', 'voltage', '3.3', JAN),
+    metric('1', 'voltage', '3.2', FEB),
+    metric('1', 'voltage', '3.1', FEB + 60),
+  ])
+
+  result = list(database.delete_metric(partitioned_db, end=FEB, execute=True))
+  assert result == [('metrics', 0, False), ('metrics_201601', 1, True), ('metrics_201602', 1, False)]
+
+  assert [t.__tablename__ for t in database.metric_tables(partitioned_db)] == ['metrics', 'metrics_201602']
+  assert [m.sensor_data for m in database.get_metric(partitioned_db)] == ['3.1']
+
+
+def test_migrate_indexes(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')))
+  database.create_db(db)
+  db.execute('DROP INDEX idx_metrics')
+  db.execute('CREATE INDEX idx_metrics ON metrics (board_id, sensor_type, sensor_data, last_update)')
+  db.execute('DROP INDEX idx_feeds_last_update')
+
+  assert list(database.migrate_indexes(db)) == [
+    ('metrics', 'idx_metrics', 'drop'),
+    ('metrics', 'idx_metrics', 'create'),
+    ('feeds', 'idx_feeds_last_update', 'create'),
+  ]
+  assert len(list(database.migrate_indexes(db, execute=True))) == 3
+  assert list(database.migrate_indexes(db)) == []
+
+
+@pytest.fixture
+def chunked_db(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')), chunks={'interval': 3600})
+  database.create_db(db)
+  return db
+
+
+def test_compress_metric(chunked_db):
+  # 2016-02-01 00:00:00
+  start = 1454284800
+  database.insert_metrics(chunked_db, [metric('1', 'voltage', '%g' % (3 + i / 100.0), start + i * 600) for i in range(18)])
+  database.insert_metrics(chunked_db, [
+    metric('1', 'voltage', '3.30', start + 60),
+    metric('1', 'geolocation', 'exit', start + 120),
+  ])
+  expected = [(m.sensor_data, m.last_update) for m in database.get_metric(chunked_db, board_ids='1', sensor_type='voltage')]
+
+  result = list(database.compress_metric(chunked_db, start + 7500))
+  assert [r[:4] for r in result] == [('metrics', '1', 'voltage', 12)]
+  assert list(database.compress_metric(chunked_db, start + 7500, execute=True)) == result
+
+  # '3.30' can not be restored from sensor_value and stays in metrics
+  assert len(database.get_metric(chunked_db, table=database.Metric)) == 8
+  assert [(m.sensor_data, m.last_update) for m in database.get_metric(chunked_db, board_ids='1', sensor_type='voltage')] == expected
+  assert [m.sensor_data for m in database.get_metric(chunked_db, sensor_type='voltage', last_available=3)] == ['3.15', '3.16', '3.17']
+  assert [m.sensor_data for m in database.get_metric(chunked_db, start=start + 3000, end=start + 3600)] == ['3.05', '3.06']
+  assert [m.sensor_data for m in database.get_metric(chunked_db, board_ids='1', max_value=3.01)] == ['3', '3.01']
+
+  # New metrics are merged into existing chunk
+  database.insert_metrics(chunked_db, [metric('1', 'voltage', '2.5', start + 30)])
+  assert [r[3] for r in database.compress_metric(chunked_db, start + 7500, execute=True)] == [1]
+  assert [m.sensor_data for m in database.get_metric(chunked_db, board_ids='1', sensor_type='voltage', end=start + 60)] == [
+    '3', '2.5', '3.30']
+
+
+def test_delete_chunk_metric(chunked_db):
+  start = 1454284800
+  database.insert_metrics(chunked_db, [metric('1', 'voltage', str(i), start + i * 600) for i in range(12)])
+  list(database.compress_metric(chunked_db, start + 7200, execute=True))
+
+  assert list(database.delete_metric(chunked_db, end=start + 4200, execute=True)) == [
+    ('metrics', 0, False), ('metric_chunks', 8, False)]
+  assert [m.sensor_data for m in database.get_metric(chunked_db)] == ['8', '9', '10', '11']
+
+
+def test_insert_metrics_commit_error(db, monkeypatch):
+  from sqlalchemy.exc import OperationalError
+  from sqlalchemy.orm import Session
+
+  def commit(self):
+    raise OperationalError('COMMIT', {}, Exception('database is locked'))
+  monkeypatch.setattr(Session, 'commit', commit)
+
+  # Failed batch is reported, not swallowed
+  with pytest.raises(OperationalError):
+    database.insert_metrics(db, [metric('1', 'voltage', '3.1', 1454284800)])
+
+  monkeypatch.undo()
+  assert database.get_metric(db) == []
@@ -0,0 +1,39 @@
+import pytest
+
+from meact import database
+
+
+SQLITE_PROFILE = {
+  'journal_mode': 'wal',
+  'synchronous': 'normal',
+  'busy_timeout': 5000,
+  'cache_size': -2000,
+  'mmap_size': 1048576,
+  'temp_store': 'memory'
+}
+
+
+def test_sqlite_profile(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')), pool={'class': 'queue', 'size': 2},
+          sqlite=dict(SQLITE_PROFILE, query_only=1))
+
+  # Pragmas are applied on every pooled connection
+  connections = [db.connect() for _ in range(2)]
+  for connection in connections:
+    assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+    assert connection.execute('PRAGMA busy_timeout').scalar() == 5000
+    assert connection.execute('PRAGMA synchronous').scalar() == 1
+    assert connection.execute('PRAGMA query_only').scalar() == 1
+  for connection in connections:
+    connection.close()
+
+
+def test_sqlite_default(tmpdir):
+  db = database.connect('sqlite:///' + str(tmpdir.join('meact.db')))
+
+  assert db.execute('PRAGMA journal_mode').scalar() == 'delete'
+
+
+def test_sqlite_profile_unknown_pragma():
+  with pytest.raises(KeyError):
+    database.connect('sqlite://', sqlite={'writable_schema': 1})
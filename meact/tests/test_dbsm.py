@@ -0,0 +1,30 @@
+from sqlalchemy.exc import IntegrityError
+
+from meact import backends
+from meact import dbsm
+from meact.utils.stats import Stats
+
+
+class FailingBackend(backends.MemoryBackend):
+
+  def insert_metrics(self, metrics):
+    raise IntegrityError('INSERT', {}, Exception('constraint failed'))
+
+
+def service(db):
+  service = dbsm.Dbsm.__new__(dbsm.Dbsm)
+  service.db = db
+  service.stats = Stats()
+  return service
+
+
+def test_save_batch():
+  batch = [{'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '3.1', 'last_update': 1454284800}]
+
+  saved = service(backends.MemoryBackend('memory://'))
+  saved._save_batch(batch)
+  failed = service(FailingBackend('memory://'))
+  failed._save_batch(batch)
+
+  assert (saved.stats.snapshot()['saved'], 'failed' in saved.stats.snapshot()) == (1, False)
+  assert (failed.stats.snapshot()['failed'], 'saved' in failed.stats.snapshot()) == (1, False)
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from meact.executor import plan
+from meact.executor.digest import Digest
+from meact.executor.dispatch import Dispatcher
+
+
+def action(name, recipient='user', window=0.1, max_latency=1, *failback):
+  return plan.Action(name=name, config={'recipient': recipient}, digest=(window, max_latency), failback=failback)
+
+
+def sensor_data(message, board_id='1'):
+  return {'board_id': board_id, 'sensor_type': 'voltage', 'message': message}
+
+
+@pytest.fixture
+def digest(request):
+  sent = []
+  digest = Digest(lambda sensor_data, action: sent.append((action.name, action.config['recipient'],
+          sensor_data['message'], sensor_data['digest_count'])))
+  digest.sent = sent
+  request.addfinalizer(digest.close)
+  return digest
+
+
+def test_merge(digest):
+  for board_id in ('1', '2', '3'):
+    digest.add(sensor_data('Voltage on ' + board_id, board_id), action('pushover'))
+  digest.add(sensor_data('Voltage on 4'), action('pushover', 'admin'))
+  digest.add(sensor_data('Voltage on 5'), action('sms'))
+
+  # One notification per action and recipient, sent after window
+  assert digest.sent == []
+  time.sleep(0.2)
+  assert sorted(digest.sent) == [
+    ('pushover', 'admin', 'Voltage on 4', 1),
+    ('pushover', 'user', 'Voltage on 1\nVoltage on 2\nVoltage on 3', 3),
+    ('sms', 'user', 'Voltage on 5', 1)]
+
+  stats = digest.snapshot()
+  assert (stats['messages/pushover'], stats['sent/pushover'], stats['saved/pushover'], stats['pending']) == (
+    4, 2, 2, 0)
+
+
+def test_max_latency(digest):
+  # Messages keep window open, max_latency bounds wait of first message
+  start = time.time()
+  while not digest.sent:
+    digest.add(sensor_data('power'), action('sms', window=0.1, max_latency=0.3))
+    time.sleep(0.02)
+
+  assert 0.25 < time.time() - start < 0.5
+  assert digest.sent[0][3] > 5
+
+
+def test_dispatcher():
+  executed = []
+
+  def execute(sensor_data, action):
+    executed.append((action.name, sensor_data['message']))
+    return 2 if action.name == 'fail_sms' else 0
+
+  dispatcher = Dispatcher(execute, lambda sensor_data, rule, result: None, threads=2)
+  for board_id in ('1', '2'):
+    rule = plan.Rule(id='a', actions=(action('fail_sms', 'user', 30, 30, plan.Action(name='log')), plan.Action(name='log')))
+    dispatcher.submit(sensor_data('Voltage on ' + board_id, board_id), rule)
+  time.sleep(0.1)
+  assert sorted(executed) == [('log', 'Voltage on 1'), ('log', 'Voltage on 2')]
+
+  # Digest is sent on join, failback gets merged message
+  dispatcher.join()
+  assert sorted(executed[2:]) == [('fail_sms', 'Voltage on 1\nVoltage on 2'), ('log', 'Voltage on 1\nVoltage on 2')]
+  assert dispatcher.snapshot()['digest/saved/fail_sms'] == 1
@@ -0,0 +1,172 @@
+from threading import Event, Lock
+import time
+
+from meact.executor import plan
+from meact.executor.dispatch import Dispatcher
+from meact.executor.outbox import Outbox
+
+
+def action(name, *failback):
+  return plan.Action(name=name, failback=failback)
+
+
+def rule(rule_id, *actions):
+  return plan.Rule(id=rule_id, actions=actions)
+
+
+def sensor_data(board_id='1'):
+  return {'board_id': board_id, 'sensor_type': 'voltage', 'message': 'test'}
+
+
+class Actions(object):
+  """Records executed actions, action named fail_* fails
+  """
+  def __init__(self, delay=0):
+    self.delay = delay
+    self.executed = []
+    self.done = []
+    self.running = {}
+    self.max_running = {}
+    self._lock = Lock()
+
+  def execute(self, sensor_data, action):
+    with self._lock:
+      self.executed.append((sensor_data['board_id'], action.name))
+      self.running[action.name] = self.running.get(action.name, 0) + 1
+      self.max_running[action.name] = max(self.max_running.get(action.name, 0), self.running[action.name])
+    time.sleep(self.delay)
+    with self._lock:
+      self.running[action.name] -= 1
+    return 2 if action.name.startswith('fail') else 0
+
+  def on_done(self, sensor_data, rule, result):
+    self.done.append((sensor_data['board_id'], rule.id, result))
+
+
+def test_failback_order():
+  actions = Actions()
+  dispatcher = Dispatcher(actions.execute, actions.on_done, threads=1)
+
+  dispatcher.submit(sensor_data(), rule('a',
+    action('fail_sms', action('fail_sms_retry', action('mail')), action('log')),
+    action('pushover')))
+  dispatcher.submit(sensor_data(), rule('b', action('fail_sms')))
+  dispatcher.join()
+
+  assert [name for _, name in actions.executed] == [
+    'fail_sms', 'fail_sms_retry', 'mail', 'log', 'pushover', 'fail_sms']
+  assert actions.done == [('1', 'a', 3), ('1', 'b', 0)]
+
+  stats = dispatcher.snapshot()
+  assert (stats['failed/fail_sms'], stats['succeeded/log'], stats['pending']) == (2, 1, 0)
+
+
+def test_concurrent():
+  actions = Actions(delay=0.2)
+  dispatcher = Dispatcher(actions.execute, actions.on_done, threads=4, limits={'sms': 1})
+
+  start = time.time()
+  for board_id in ('1', '2', '3'):
+    assert dispatcher.submit(sensor_data(board_id), rule('a', action('sms'), action('log')))
+    assert dispatcher.submit(sensor_data(board_id), rule('b', action('log')))
+  # Submit does not wait for actions
+  assert time.time() - start < 0.1
+  dispatcher.join()
+
+  assert actions.max_running['sms'] == 1
+  assert actions.max_running['log'] > 1
+  assert sorted(actions.done) == [(board_id, rule_id, result)
+          for board_id in ('1', '2', '3') for rule_id, result in (('a', 2), ('b', 1))]
+
+
+def test_pending():
+  started = Event()
+  release = Event()
+  actions = Actions()
+
+  def execute(sensor_data, action):
+    started.set()
+    release.wait()
+    return actions.execute(sensor_data, action)
+
+  dispatcher = Dispatcher(execute, actions.on_done, threads=2)
+  assert dispatcher.submit(sensor_data(), rule('a', action('sms')))
+  started.wait()
+
+  # The same rule for the same board is not dispatched until done
+  assert not dispatcher.submit(sensor_data(), rule('a', action('sms')))
+  assert dispatcher.submit(sensor_data('2'), rule('a', action('sms')))
+  assert actions.done == []
+
+  release.set()
+  dispatcher.join()
+
+  assert sorted(actions.done) == [('1', 'a', 1), ('2', 'a', 1)]
+  assert dispatcher.snapshot()['skipped'] == 1
+
+
+def test_retry():
+  attempts = {'flaky': 2}
+  actions = Actions()
+
+  def execute(sensor_data, action):
+    # flaky fails twice, fail_* always fails
+    if action.name in attempts and attempts[action.name]:
+      attempts[action.name] -= 1
+      actions.execute(sensor_data, action)
+      return 2
+    return actions.execute(sensor_data, action)
+
+  dispatcher = Dispatcher(execute, actions.on_done, threads=1, backoff=0.1, max_age=1)
+  dispatcher.submit(sensor_data(), rule('a', action('flaky'), action('log'), plan.Action(name='fail_sms', max_age=0.2)))
+
+  # Only failed actions are retried, attempts after 0.1 and 0.3 seconds
+  deadline = time.time() + 2
+  while dispatcher.snapshot()['pending'] and time.time() < deadline:
+    time.sleep(0.01)
+  dispatcher.join()
+
+  assert [name for _, name in actions.executed] == ['flaky', 'log', 'fail_sms', 'flaky', 'fail_sms', 'flaky',
+          'fail_sms']
+  assert actions.done == [('1', 'a', 1), ('1', 'a', 0), ('1', 'a', 1)]
+  stats = dispatcher.snapshot()
+  assert (stats['expired/fail_sms'], stats['outbox/retried'], stats['outbox/entries']) == (1, 2, 0)
+
+
+def test_restart(tmpdir):
+  journal = str(tmpdir.join('outbox'))
+  rules = {'a': rule('a', action('fail_sms'))}
+  actions = Actions()
+
+  dispatcher = Dispatcher(actions.execute, actions.on_done, threads=1, outbox=Outbox(journal),
+          resolve=lambda sensor_type, rule_id: rules.get(rule_id), backoff=60, max_age=600)
+  dispatcher.submit(sensor_data(), rules['a'])
+  while not actions.done:
+    time.sleep(0.01)
+  dispatcher.join()
+
+  # Rule waiting for retry is loaded, it is not dispatched again
+  rules['a'] = rule('a', action('sms'))
+  dispatcher = Dispatcher(actions.execute, actions.on_done, threads=1, outbox=Outbox(journal),
+          resolve=lambda sensor_type, rule_id: rules.get(rule_id))
+  assert not dispatcher.submit(sensor_data(), rules['a'])
+  assert dispatcher.snapshot()['outbox/entries'] == 1
+  dispatcher.join()
+
+
+def test_not_serializable(tmpdir):
+  actions = Actions()
+  dispatcher = Dispatcher(actions.execute, actions.on_done, threads=1, outbox=Outbox(str(tmpdir.join('outbox'))),
+          resolve=lambda sensor_type, rule_id: None)
+
+  data = sensor_data()
+  data['sensor_data'] = object()
+  assert not dispatcher.submit(data, rule('a', action('sms')))
+
+  # Rule is not left pending, it is dispatched with valid data
+  assert dispatcher.submit(sensor_data(), rule('a', action('sms')))
+  dispatcher.join()
+
+  assert actions.executed == [('1', 'sms')]
+  stats = dispatcher.snapshot()
+  assert (stats['rejected'], stats['pending'], stats['outbox/entries']) == (1, 0, 0)
@@ -0,0 +1,131 @@
+import time
+
+import pytest
+import yaml
+
+from meact import backends
+
+# Feed providers are loaded with feeder
+pytest.importorskip('jq')
+from meact import feeder
+
+
+FEEDS = {
+  'weather': {'name': 'http_json', 'expression': '.', 'mqtt_topic': 'dbsm/metric', 'feed_interval': 60,
+          'fail_interval': 30, 'params': {}},
+  'fencing': {'name': 'http_json', 'expression': '.', 'mqtt_topic': 'dbsm/metric', 'feed_interval': 600,
+          'fail_interval': 30, 'params': {}},
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  now = [1454284800]
+  monkeypatch.setattr(time, 'time', lambda: now[0])
+  return now
+
+
+class CountingBackend(backends.MemoryBackend):
+  reads = 0
+
+  def get_feed(self, *args, **kwargs):
+    self.reads += 1
+    return super(CountingBackend, self).get_feed(*args, **kwargs)
+
+
+@pytest.fixture
+def service(clock, monkeypatch, tmpdir):
+  db = CountingBackend('memory://')
+  monkeypatch.setattr(backends, 'connect', lambda *args, **kwargs: db)
+  monkeypatch.setattr(feeder.Feeder, 'start_mqtt', lambda self: None)
+
+  def create(feeds=FEEDS, results=None, **kwargs):
+    feeds_map_file = tmpdir.join('feeds.yaml')
+    feeds_map_file.write(yaml.dump(feeds))
+    service = feeder.Feeder('memory://', {}, str(feeds_map_file), **kwargs)
+    service.executed = []
+    service.published = []
+    results = results or {}
+
+    def feed_helper(feed_name, feed_config):
+      service.executed.append(feed_name)
+      return results.get(feed_name, [{'board_id': feed_name, 'sensor_type': 'feed', 'sensor_data': '1'}])
+    service._feed_helper = feed_helper
+    service.publish_metric = lambda topic, sensor_data: service.published.append(sensor_data['board_id'])
+    return service
+
+  return create
+
+
+def test_schedule(service, clock):
+  backend = backends.connect('memory://')
+  backend.insert_feed('fencing', 0)
+  clock[0] += 100
+  service = service()
+  reads = backend.reads
+
+  # fencing was run 100 seconds ago
+  assert service._run_due() == 60
+  assert (service.executed, service.published) == (['weather'], ['weather'])
+
+  clock[0] += 60
+  assert service._run_due() == 60
+  clock[0] += 440
+  assert service._run_due() == 60
+  assert service.executed == ['weather', 'weather', 'weather', 'fencing']
+
+  # Database is read only on start
+  assert (reads, backend.reads) == (4, 4)
+  assert [feed.result for feed in backend.get_feed(feed_name='weather')] == [0, 0, 0]
+
+
+def test_seed_last_success(service, clock):
+  backend = backends.connect('memory://')
+  backend.insert_feed('weather', 0)
+  clock[0] += 20
+  backend.insert_feed('weather', 1)
+  clock[0] += 20
+  service = service()
+
+  # feed_interval is counted from last successful run, not last failed
+  assert [name for _, name in service._schedule] == ['fencing', 'weather']
+  assert dict((name, due - clock[0]) for due, name in service._schedule)['weather'] == 20
+
+
+def test_fail_interval(service, clock):
+  service = service(results={'weather': None})
+
+  assert service._run_due() == 30
+  clock[0] += 30
+  service._run_due()
+
+  assert service.executed == ['fencing', 'weather', 'weather']
+  assert service.published == ['fencing']
+
+
+def test_disabled(service, clock):
+  service = service()
+  service.status['feeder/weather'] = '0'
+
+  assert service._run_due() == 600
+  assert service.executed == ['fencing']
+
+  service.status['feeder/weather'] = '1'
+  service._run_due()
+  assert service.executed == ['fencing', 'weather']
+
+
+def test_jitter(service, clock):
+  feeds = dict((name, dict(FEEDS['weather'])) for name in ('a', 'b', 'c', 'd'))
+  feeds['d']['jitter'] = 0
+  service = service(feeds, jitter=30)
+
+  # Feeds due on start are spread too
+  due = dict((name, due - clock[0]) for due, name in service._schedule)
+  assert all(0 <= due[name] <= 30 for name in 'abc')
+  assert len(set(due[name] for name in 'abc')) == 3
+
+  service._run_due()
+  assert service.executed == ['d']
+  due = dict((name, due - clock[0]) for due, name in service._schedule)
+  assert due['d'] == 60
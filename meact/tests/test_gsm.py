@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from meact import gsm
+
+
+class FakeModem(object):
+  """Modem failing connect/send_sms as many times as set in fail_*
+  """
+  def __init__(self, fail_connect=0, fail_send=0):
+    self.fail_connect = fail_connect
+    self.fail_send = fail_send
+    self.connects = 0
+    self.sent = []
+
+  def connect(self, coverage_timeout):
+    self.connects += 1
+    if self.fail_connect:
+      self.fail_connect -= 1
+      raise gsm.ModemError('No network coverage')
+    return 15
+
+  def send_sms(self, recipient, message):
+    if self.fail_send:
+      self.fail_send -= 1
+      raise gsm.ModemError('Timeout')
+    self.sent.append((recipient, message))
+
+  def signal_strength(self):
+    return 12
+
+  def close(self):
+    pass
+
+
+class Message(object):
+  def __init__(self, payload):
+    self.topic = 'gsm/sms'
+    self.payload = payload
+
+
+@pytest.fixture
+def service(monkeypatch):
+  monkeypatch.setattr(gsm.Gsm, 'start_mqtt', lambda self: None)
+
+  def create(modem, **kwargs):
+    service = gsm.Gsm(modem, {}, retry_interval=0, stats_interval=0, **kwargs)
+    service.published = []
+    service.publish_stats = service.published.append
+    return service
+
+  return create
+
+
+def send_all(service):
+  while service._send(timeout=0):
+    pass
+
+
+def request(service, recipient, message, priority=0):
+  service._on_message(None, None, Message(json.dumps({'recipient': recipient, 'message': message,
+          'priority': priority})))
+
+
+def test_send(service):
+  modem = FakeModem()
+  service = service(modem)
+
+  request(service, ['+48100', '+48200'], 'power')
+  request(service, '+48300', 'alarm', priority=-1)
+  service._on_message(None, None, Message('not json'))
+  service._on_message(None, None, Message('{"message": "no recipient"}'))
+  send_all(service)
+
+  # Modem is connected once, higher priority is sent first
+  assert modem.connects == 1
+  assert modem.sent == [('+48300', 'alarm'), ('+48100', 'power'), ('+48200', 'power')]
+
+  service.stats_interval = 0.0001
+  service._stats_published = 0
+  service._publish_stats()
+  stats = service.published[0]
+  assert (stats['sent'], stats['invalid'], stats['connected'], stats['signal'], stats['sms_queue/depth']) == (
+    3, 2, 1, 12, 0)
+
+
+def test_reconnect(service):
+  modem = FakeModem(fail_connect=1, fail_send=1)
+  service = service(modem)
+
+  request(service, ['+48100', '+48200'], 'power')
+  send_all(service)
+
+  assert modem.connects == 3
+  assert sorted(modem.sent) == [('+48100', 'power'), ('+48200', 'power')]
+  assert (service.stats.snapshot()['connect_failed'], service.connected) == (1, True)
+
+
+def test_retries(service):
+  modem = FakeModem(fail_send=5)
+  service = service(modem, retries=2)
+
+  request(service, ['+48100', '+48200'], 'power')
+  send_all(service)
+
+  # Failed SMS is queued again, the first failed 3 times, the second
+  # was sent in third attempt
+  assert modem.sent == [('+48200', 'power')]
+  assert service.stats.snapshot()['failed'] == 1
+
+
+def test_throttled_reconnect(service, monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr(gsm.time, 'time', lambda: now[0])
+  monkeypatch.setattr(gsm.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+  modem = FakeModem(fail_connect=1)
+  service = service(modem, retries=1)
+  service.retry_interval = 10
+
+  request(service, '+48100', 'power')
+  # Waiting for reconnect does not use attempts
+  for _ in range(5):
+    assert service.sms_queue.qsize() == 1
+    assert service._send(timeout=1)
+  assert (modem.connects, modem.sent, service.stats.snapshot().get('failed')) == (1, [], None)
+
+  for _ in range(6):
+    assert service._send(timeout=1)
+    if modem.sent:
+      break
+  assert modem.sent == [('+48100', 'power')]
+  assert (modem.connects, service.sms_queue.qsize()) == (2, 0)
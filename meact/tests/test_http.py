@@ -0,0 +1,88 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+import os
+
+import pytest
+
+from meact import utils
+
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # Response is written in small parts, avoid delayed ACK stalls
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.connections += 1
+
+  def do_GET(self):
+    self.server.requests += 1
+    status = 200
+    # /fail/<n> fails n times
+    if self.path.startswith('/fail/') and self.server.failures < int(self.path.split('/')[-1]):
+      self.server.failures += 1
+      status = 503
+
+    body = '{"status": 1}'
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def http_server(request):
+  server = Server(('127.0.0.1', 0), Handler)
+  server.connections = server.requests = server.failures = 0
+  Thread(target=server.serve_forever).start()
+
+  config = dict(utils.HTTP_CONFIG)
+  utils.configure_http()
+
+  def stop():
+    server.shutdown()
+    server.server_close()
+    utils.configure_http(**config)
+  request.addfinalizer(stop)
+
+  server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+  return server
+
+
+def test_keep_alive(http_server):
+  for _ in range(20):
+    assert utils.http_request(http_server.url + '/notify').json() == {'status': 1}
+
+  assert (http_server.requests, http_server.connections) == (20, 1)
+
+
+def test_session_per_process(http_server, monkeypatch):
+  session = utils.http_session()
+  assert utils.http_session() is session
+
+  # Forked process gets its own session
+  monkeypatch.setattr(os, 'getpid', lambda: -1)
+  assert utils.http_session() is not session
+
+
+@pytest.mark.parametrize('config, path, expected', [
+  ({}, '/fail/1', None),
+  ({'retries': 2, 'status_retries': [503]}, '/fail/2', {'status': 1}),
+  ({'retries': 2, 'status_retries': [503]}, '/fail/3', None),
+])
+def test_retries(http_server, config, path, expected):
+  utils.configure_http(**config)
+  req = utils.http_request(http_server.url + path)
+
+  assert (req.json() if req is not None else None) == expected
+
@@ -0,0 +1,24 @@
+from meact import mqtt
+
+
+def service(mqtt_config):
+  service = mqtt.Mqtt()
+  service.name = 'dbsm'
+  service.status = {'dbsm': 1}
+  service.mqtt_config = mqtt_config
+  service.published = []
+  service.publish = lambda topic, payload, retain=False: service.published.append((topic, payload, retain))
+  return service
+
+
+def test_publish_stats():
+  s = service({'topic': {'mgmt/status': 'mgmt/status', 'mgmt/stats': 'stats'}})
+  s.publish_stats({'saved': 10, 'metric_queue/depth': 2})
+
+  # Stats are not retained and do not change status
+  assert sorted(s.published) == [('stats/dbsm/metric_queue/depth', 2, False), ('stats/dbsm/saved', 10, False)]
+  assert s.status == {'dbsm': 1}
+
+  s = service({'topic': {'mgmt/status': 'mgmt/status'}})
+  s.publish_stats({'saved': 10})
+  assert s.published == [('mgmt/stats/dbsm/saved', 10, False)]
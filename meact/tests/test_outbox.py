@@ -0,0 +1,107 @@
+import json
+import time
+
+import pytest
+
+from meact.executor import plan
+from meact.executor.outbox import Outbox
+
+
+RULES = dict((rule_id, plan.Rule(id=rule_id, actions=(plan.Action(name='sms'), plan.Action(name='mail'))))
+        for rule_id in ('a', 'b'))
+
+
+def resolve(sensor_type, rule_id):
+  return RULES.get(rule_id)
+
+
+def sensor_data(board_id='1'):
+  return {'board_id': board_id, 'sensor_type': 'voltage', 'message': 'test'}
+
+
+@pytest.fixture
+def journal(tmpdir):
+  return str(tmpdir.join('outbox'))
+
+
+def test_due_order():
+  outbox = Outbox()
+  assert outbox.load(resolve) == []
+
+  first = outbox.put(sensor_data('1'), RULES['a'])
+  second = outbox.put(sensor_data('2'), RULES['a'], [1])
+
+  assert outbox.get() is first
+  outbox.retry(first, [0], time.time() + 0.1)
+  assert outbox.get() is second
+  outbox.done(second)
+
+  # Retried entry is returned when due
+  start = time.time()
+  assert outbox.get(timeout=1) is first
+  assert 0.05 < time.time() - start < 0.5
+  assert (first['attempt'], first['actions'], second['actions']) == (1, [0], [1])
+
+  assert outbox.get(timeout=0.01) is None
+  outbox.close()
+  assert outbox.get() is None
+
+
+def test_restart(journal):
+  outbox = Outbox(journal)
+  outbox.load(resolve)
+  done = outbox.put(sensor_data('1'), RULES['a'])
+  retried = outbox.put(sensor_data('2'), RULES['a'])
+  outbox.put(sensor_data('3'), RULES['b'])
+  outbox.put(sensor_data('4'), RULES['b'])
+  outbox.done(done)
+  outbox.retry(retried, [1], 2000000000)
+  RULES['c'] = plan.Rule(id='c', actions=())
+  outbox.put(sensor_data('5'), RULES.pop('c'))
+
+  outbox = Outbox(journal)
+  entries = outbox.load(resolve)
+
+  # Done entries and entries of unknown rules are not loaded
+  assert [(entry['id'], entry['sensor_data']['board_id'], entry['rule'].id, entry['actions'], entry['attempt'])
+          for entry in entries] == [(1, '2', 'a', [1], 1), (2, '3', 'b', [0, 1], 0), (3, '4', 'b', [0, 1], 0)]
+  assert [outbox.get(timeout=0)['id'] for _ in range(2)] == [2, 3]
+  assert outbox.put(sensor_data(), RULES['a'])['id'] == 5
+
+  # Journal was compacted on load
+  with open(journal) as f:
+    assert [json.loads(line)[:2] for line in f] == [['put', 1], ['put', 2], ['put', 3], ['put', 5]]
+
+
+def test_truncated(journal):
+  outbox = Outbox(journal)
+  outbox.load(resolve)
+  outbox.put(sensor_data('1'), RULES['a'])
+  with open(journal, 'a') as f:
+    f.write('["put", 1, {"board_id"')
+
+  assert [entry['id'] for entry in Outbox(journal).load(resolve)] == [0]
+
+
+def test_compact(journal):
+  outbox = Outbox(journal, compact_size=10)
+  outbox.load(resolve)
+
+  for i in range(25):
+    outbox.done(outbox.put(sensor_data(str(i)), RULES['a']))
+  outbox.put(sensor_data(), RULES['b'])
+
+  with open(journal) as f:
+    assert len(f.readlines()) == 2 * 5 + 1
+
+
+def test_put_journaled(journal):
+  outbox = Outbox(journal)
+  outbox.load(resolve)
+  for i in xrange(100):
+    outbox.put(sensor_data(str(i)), RULES['a'])
+
+  # Every put is written before it returns
+  with open(journal) as f:
+    assert len(f.readlines()) == 100
+  assert len(Outbox(journal).load(resolve)) == 100
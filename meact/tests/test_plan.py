@@ -0,0 +1,191 @@
+import copy
+import hashlib
+import json
+import signal
+
+import pytest
+
+from meact import backends
+from meact import executor
+from meact import utils
+from meact.executor import plan
+from meact.executor.cooldown import CooldownTracker
+from meact.executor.dispatch import Dispatcher
+
+
+def action(data, action_config):
+  pass
+
+
+actions_mapping = {
+  'log': {'func': action, 'timeout': 10},
+  'send_mail': {'func': action, 'timeout': 30},
+}
+
+sensor_config = {
+  'priority': 50,
+  'actions': [
+    {
+      'action': [{'name': 'send_mail', 'failback': [{'name': 'log'}]}, {'name': 'unknown'}],
+      'threshold': {'lambda': 'lambda x: float(x) < 3.0', 'transform': 'lambda x: round(float(x), 1)'},
+      'board_ids': ['1', '2'],
+      'message_template': 'Voltage {sensor_data:.1f} on {board_desc} ({board_id})',
+      'check_metric': [
+        {'sensor_type': 'voltage', 'board_ids': ['{board_id}'], 'start_offset': -600,
+         'value_count': {'type': 'Metric', 'count': 2}, 'threshold': {'lambda': 'lambda x: len(x) == 2'}},
+      ],
+      'action_config': {'send_mail': {'recipient': ['rule@example.com']}},
+    }
+  ]
+}
+
+global_action_config = {'send_mail': {'recipient': ['global@example.com'], 'timeout': 5}, 'log': {'file': '/tmp/log'}}
+
+
+@pytest.fixture
+def sensor_plan():
+  validation_result, config = utils.validate_sensor_config(copy.deepcopy(sensor_config))
+  assert validation_result
+  return plan.compile_sensor_config('voltage', config, global_action_config, actions_mapping)
+
+
+def test_compile(sensor_plan):
+  rule = sensor_plan.rules[0]
+  validation_result, config = utils.validate_sensor_config(copy.deepcopy(sensor_config))
+
+  # Id is stored in actions table, it has to stay the same for the same rule
+  assert rule.id == hashlib.md5(json.dumps(config['actions'][0])).hexdigest()
+  assert (sensor_plan.priority, sensor_plan.coalesce) == (50, False)
+  assert (rule.board_ids, rule.action_interval) == (frozenset(['1', '2']), 0)
+  assert rule.threshold('2.94') == (2.9, True)
+  assert rule.threshold('x') == (False, True)
+
+  # Unknown action is dropped, config is merged and global config is untouched
+  assert [a.name for a in rule.actions] == ['send_mail']
+  assert (rule.actions[0].timeout, rule.actions[0].config['recipient']) == (5, ['rule@example.com'])
+  assert global_action_config['send_mail']['recipient'] == ['global@example.com']
+  assert [(a.name, a.timeout, a.config) for a in rule.actions[0].failback] == [('log', 10, {'file': '/tmp/log'})]
+
+  check_metric = rule.check_metric[0]
+  assert (check_metric.value_type, check_metric.count, check_metric.start_offset) == ('Metric', 2, -600)
+  assert [t.render({'board_id': '1'}) for t in check_metric.board_ids] == ['1']
+
+
+def test_immutable(sensor_plan):
+  with pytest.raises(AttributeError):
+    sensor_plan.priority = 10
+  with pytest.raises(AttributeError):
+    sensor_plan.rules[0].extra = 1
+
+
+@pytest.mark.parametrize('template, data', [
+  ('{sensor_type} on board {board_desc} ({board_id}) reports value {sensor_data}',
+   {'sensor_type': 'voltage', 'board_desc': None, 'board_id': '1', 'sensor_data': 2.9}),
+  ('Value {sensor_data:.2f}{{}}', {'sensor_data': 2.9}),
+  ('Value {sensor_data!r} {sensor_data[0]}', {'sensor_data': 'exit'}),
+  ('No fields', {}),
+])
+def test_template(template, data):
+  assert plan.Template.compile(template).render(data) == template.format(**data)
+
+
+@pytest.mark.parametrize('template, data, error', [
+  ('{missing}', {}, KeyError),
+  ('{sensor_data:.2f}', {'sensor_data': 'exit'}, ValueError),
+])
+def test_template_error(template, data, error):
+  with pytest.raises(error):
+    plan.Template.compile(template).render(data)
+
+
+@pytest.mark.parametrize('threshold', [
+  {'lambda': 'lambda x, y: True'},
+  {'lambda': 'not lambda'},
+  {'lambda': 'lambda: True', 'transform': 'lambda x:'},
+])
+def test_invalid_lambda(threshold):
+  config = copy.deepcopy(sensor_config)
+  config['actions'][0]['threshold'] = threshold
+
+  with pytest.raises(ValueError):
+    plan.compile_sensor_config('voltage', config, {}, actions_mapping)
+
+
+def test_action_helper(sensor_plan):
+  ex = executor.Executor.__new__(executor.Executor)
+  ex.status = {'armed': 1}
+  ex.db = backends.MemoryBackend()
+  ex.db.insert_metrics([{'board_id': '1', 'sensor_type': 'voltage', 'sensor_data': '2.9'}] * 2)
+  ex.cooldown = CooldownTracker(ex.db)
+  ex.cooldown.load(0)
+  executed = []
+  ex.dispatcher = Dispatcher(lambda sensor_data, action: executed.append((sensor_data['message'], action)) or 0,
+          ex._action_done, 1)
+
+  for board_id, value in (('1', '2.91'), ('1', '2.92'), ('2', '2.9'), ('3', '2.9'), ('1', '3.1')):
+    ex._action_helper({'board_id': board_id, 'sensor_type': 'voltage', 'sensor_data': value, 'board_desc': 'b'},
+            sensor_plan)
+  ex.dispatcher.join()
+  ex.cooldown.flush(force=True)
+
+  # Second event is within action_interval, board 2 has no metrics,
+  # board 3 is not in rule, 3.1 is over threshold
+  assert [message for message, _ in executed] == ['Voltage 2.9 on b (1)']
+  assert executed[0][1] is sensor_plan.rules[0].actions[0]
+  assert [a.sensor_action_id for a in ex.db.get_action()] == [sensor_plan.rules[0].id]
+
+
+def test_refresh_signal(monkeypatch):
+  ex = executor.Executor.__new__(executor.Executor)
+  ex._refresh = False
+  ex.cooldown = CooldownTracker(backends.MemoryBackend())
+  refreshed = []
+  monkeypatch.setattr(ex, '_refresh_maps', lambda: refreshed.append(1))
+
+  # Signal could come while lock is held by main thread, refresh is left to run()
+  with ex.cooldown._lock:
+    ex._handle_signal(signal.SIGHUP, None)
+  assert ex._refresh
+  assert refreshed == []
+
+
+def test_rule_index():
+  config = {'priority': 50, 'actions': [
+    {'action': [{'name': 'log'}], 'board_ids': board_ids, 'message_template': name}
+    for name, board_ids in (('all', []), ('one', ['1']), ('one_two', ['1', '2']), ('all_again', []))
+  ]}
+  validation_result, config = utils.validate_sensor_config(config)
+  sensor_plan = plan.compile_sensor_config('voltage', config, {}, actions_mapping)
+
+  for board_id, expected in (('1', ['all', 'one', 'one_two', 'all_again']), ('2', ['all', 'one_two', 'all_again']),
+                             ('3', ['all', 'all_again'])):
+    rules = sensor_plan.rules_for(board_id)
+    assert [rule.message.source for rule in rules] == expected
+    assert list(rules) == [rule for rule in sensor_plan.rules if rule.for_board(board_id)]
+
+
+@pytest.mark.parametrize('coalesce, expected', [
+  (True, True),
+  (False, True),
+  ('yes', False),
+  (1, False),
+])
+def test_coalesce(coalesce, expected):
+  config = copy.deepcopy(sensor_config)
+  config['coalesce'] = coalesce
+
+  validation_result, config = utils.validate_sensor_config(config)
+
+  assert validation_result == expected
+  if validation_result:
+    assert plan.compile_sensor_config('voltage', config, {}, actions_mapping).coalesce == coalesce
+
+
+@pytest.mark.parametrize('config, expected', [
+  ({}, None),
+  ({'digest_window': 30}, (30, 30)),
+  ({'digest_window': 30, 'digest_max_latency': 10}, (30, 10)),
+])
+def test_digest(config, expected):
+  actions = plan.compile_actions([{'name': 'log'}], {'log': config}, {}, actions_mapping)
+  assert actions[0].digest == expected
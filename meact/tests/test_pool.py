@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+import pytest
+
+from meact.executor import pool
+
+
+def succeed(data, action_config):
+  sys.exit(0)
+
+
+def fail(data, action_config):
+  sys.exit(action_config.get('code', 2))
+
+
+def sleep(data, action_config):
+  time.sleep(action_config['sleep'])
+  sys.exit(0)
+
+
+def crash(data, action_config):
+  raise RuntimeError('crash')
+
+
+def die(data, action_config):
+  os._exit(3)
+
+
+def pid(data, action_config):
+  sys.exit(os.getpid() % 200 + 1)
+
+
+@pytest.fixture
+def worker_pool(request):
+  worker_pool = pool.WorkerPool(1)
+  request.addfinalizer(worker_pool.close)
+  return worker_pool
+
+
+@pytest.mark.parametrize('code, expected', [
+  (None, 0),
+  (0, 0),
+  (5, 5),
+  ('message', 1),
+])
+def test_exit_status(code, expected):
+  assert pool.exit_status(code) == expected
+
+
+@pytest.mark.parametrize('func, action_config, expected', [
+  (succeed, {}, 0),
+  (fail, {}, 2),
+  (fail, {'code': 'error'}, 1),
+  (crash, {}, 1),
+  (die, {}, 3),
+])
+def test_execute(worker_pool, func, action_config, expected):
+  assert worker_pool.execute(func.__name__, func, ({}, action_config), 5) == expected
+  # Pool is usable after every result
+  assert worker_pool.execute('succeed', succeed, ({}, {}), 5) == 0
+
+
+def test_worker_reused(worker_pool):
+  first = worker_pool.execute('pid', pid, ({}, {}), 5)
+  assert worker_pool.execute('pid', pid, ({}, {}), 5) == first
+
+
+def test_timeout(worker_pool):
+  first = worker_pool.execute('pid', pid, ({}, {}), 5)
+
+  start = time.time()
+  assert worker_pool.execute('sleep', sleep, ({}, {'sleep': 10}), 0.2) == 255
+  assert time.time() - start < 5
+
+  # Hung worker was replaced
+  assert worker_pool.execute('pid', pid, ({}, {}), 5) != first
+
+  stats = worker_pool.snapshot()
+  assert (stats['timeout/sleep'], stats['replaced'], stats['workers'], stats['idle']) == (1, 1, 1, 1)
+  assert stats['execute/pid/count'] == 2
+  assert stats['queue_wait/sleep/count'] == 1
@@ -0,0 +1,109 @@
+import re
+
+import pytest
+from sqlalchemy import event
+
+from meact import database
+
+
+BOARDS = 20
+SENSOR_TYPES = ('voltage', 'rssi', 'temperature', 'humidity')
+METRICS_PER_SERIES = 250
+START = 1454284800
+END = START + METRICS_PER_SERIES * 60
+TABLES = ('metrics', 'metrics_201602', 'last_metrics', 'actions', 'feeds')
+
+
+def populate(db):
+  metrics = []
+  for i in range(METRICS_PER_SERIES):
+    for board_id in range(BOARDS):
+      for sensor_type in SENSOR_TYPES:
+        metrics.append({
+          'board_id': str(board_id),
+          'sensor_type': sensor_type,
+          'sensor_data': str(i),
+          'last_update': START + i * 60
+        })
+  database.insert_metrics(db, metrics)
+
+  s = database.create_session(db)
+  s.bulk_insert_mappings(database.Action, [{
+    'board_id': str(i % BOARDS),
+    'sensor_type': SENSOR_TYPES[i % len(SENSOR_TYPES)],
+    'sensor_action_id': str(i % 50),
+    'last_update': START + i
+  } for i in range(5000)])
+  s.bulk_insert_mappings(database.Feed, [{
+    'feed_name': 'feed' + str(i % 20),
+    'result': i % 2,
+    'last_update': START + i
+  } for i in range(5000)])
+  database.commit(s)
+
+
+@pytest.fixture(scope='module', params=['plain', 'analyze'])
+def db(request, tmpdir_factory):
+  db = database.connect('sqlite:///' + str(tmpdir_factory.mktemp('plan').join('meact.db')), partitioning='month')
+  database.create_db(db)
+  populate(db)
+  if request.param == 'analyze':
+    db.execute('ANALYZE')
+  return db
+
+
+def query_plans(db, func, **kwargs):
+  """Run func and return EXPLAIN QUERY PLAN details for every SELECT it issued
+  """
+  statements = []
+
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith('SELECT') and 'sqlite_master' not in statement:
+      statements.append((statement, parameters))
+
+  event.listen(db, 'before_cursor_execute', before_cursor_execute)
+  try:
+    func(db, **kwargs)
+  finally:
+    event.remove(db, 'before_cursor_execute', before_cursor_execute)
+
+  plans = []
+  for statement, parameters in statements:
+    rows = db.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    plans.append((statement, [row[len(row) - 1] for row in rows]))
+
+  return plans
+
+
+def full_scans(plan):
+  scan = re.compile(r'^SCAN ({})\b'.format('|'.join(TABLES)))
+  return [line for line in plan if scan.match(line)]
+
+
+@pytest.mark.parametrize('func, kwargs, ordered', [
+  # executor check_metric and api graph
+  (database.get_metric, {'board_ids': '1', 'sensor_type': 'voltage', 'last_available': 10}, True),
+  (database.get_metric, {'board_ids': '1', 'sensor_type': 'voltage', 'start': END - 600, 'end': END}, True),
+  (database.get_metric, {'board_ids': ['1', '2'], 'sensor_type': 'voltage', 'start': END - 600}, False),
+  # manage clean-metric and aggregate-metric
+  (database.get_metric, {'start': START, 'end': START + 600}, True),
+  (database.get_metric_aggregated, {'sensor_type': 'voltage', 'start': START, 'end': START + 600}, False),
+  # api and executor last metric
+  (database.get_last_metric, {'board_ids': '1'}, False),
+  (database.get_last_metric, {'sensor_type': 'voltage'}, False),
+  (database.get_last_metric, {'board_ids': '1', 'sensor_type': 'voltage'}, False),
+  # executor action_interval and manage clean-action
+  (database.get_action, {'board_ids': '1', 'sensor_type': 'voltage', 'sensor_action_id': '1', 'last_available': 1}, True),
+  (database.get_action, {'start': START, 'end': START + 100}, False),
+  # feeder feed_interval and manage clean-feed
+  (database.get_feed, {'feed_name': 'feed1', 'result': 1, 'last_available': 1}, True),
+  (database.get_feed, {'start': START, 'end': START + 100}, False),
+])
+def test_query_plan(db, func, kwargs, ordered):
+  plans = query_plans(db, func, **kwargs)
+  assert plans
+
+  for statement, plan in plans:
+    assert not full_scans(plan), '{}\n{}'.format(statement, '\n'.join(plan))
+    if ordered:
+      assert not [line for line in plan if 'TEMP B-TREE' in line], '{}\n{}'.format(statement, '\n'.join(plan))
@@ -0,0 +1,147 @@
+from threading import Thread
+import Queue
+import os
+import time
+
+import pytest
+
+from meact.utils.queues import EventQueue
+
+
+def drain(queue):
+  output = []
+  while True:
+    try:
+      output.append(queue.get(False))
+    except Queue.Empty:
+      return output
+
+
+def test_priority_order():
+  queue = EventQueue()
+  for priority, item in ((50, 'a'), (10, 'b'), (50, 'c'), (0, 'd'), (10, 'e')):
+    queue.put(priority, item)
+
+  assert drain(queue) == [(0, 'd'), (10, 'b'), (10, 'e'), (50, 'a'), (50, 'c')]
+
+
+def test_coalesce():
+  queue = EventQueue()
+  queue.put(50, '3.3', ('1', 'voltage'))
+  queue.put(50, '3.2', ('2', 'voltage'))
+  queue.put(10, 'exit', None)
+  queue.put(50, '3.1', ('1', 'voltage'))
+  queue.put(50, '3.0', ('1', 'voltage'))
+  queue.put(10, 'exit', None)
+
+  assert queue.snapshot()['depth'] == 4
+  assert drain(queue) == [(10, 'exit'), (10, 'exit'), (50, '3.0'), (50, '3.2')]
+
+  # Key is not pending after item was returned
+  queue.put(50, '2.9', ('1', 'voltage'))
+  assert drain(queue) == [(50, '2.9')]
+
+  stats = queue.snapshot()
+  assert (stats['coalesced'], stats['dropped/coalesce'], stats['depth']) == (1, 2, 0)
+
+
+def test_get_timeout():
+  queue = EventQueue()
+
+  start = time.time()
+  with pytest.raises(Queue.Empty):
+    queue.get(True, 0.1)
+  assert time.time() - start >= 0.1
+
+  Thread(target=lambda: (time.sleep(0.1), queue.put(1, 'late'))).start()
+  assert queue.get(True, 5) == (1, 'late')
+
+
+def put(queue, items):
+  for priority, item in items:
+    queue.put(priority, item)
+
+
+def test_drop_oldest():
+  queue = EventQueue(3, 'drop_oldest')
+  put(queue, ((50, 'a'), (10, 'b'), (50, 'c'), (0, 'd'), (10, 'e')))
+
+  assert drain(queue) == [(0, 'd'), (10, 'e'), (50, 'c')]
+  assert queue.snapshot()['dropped/oldest'] == 2
+
+
+def test_drop_lowest_priority():
+  queue = EventQueue(3, 'drop_lowest_priority')
+  put(queue, ((50, 'a'), (10, 'b'), (50, 'c'), (0, 'd'), (50, 'e'), (10, 'f')))
+
+  # Newest of lowest priority is dropped first, then older
+  assert drain(queue) == [(0, 'd'), (10, 'b'), (10, 'f')]
+  assert queue.snapshot()['dropped/priority'] == 3
+
+
+def test_drop_lowest_priority_many():
+  queue = EventQueue(100, 'drop_lowest_priority')
+  items = [((i * 37) % 11, i) for i in range(1000)]
+  put(queue, items)
+
+  # The same as stable sort keeping 100 items of highest priority
+  assert drain(queue) == sorted(items, key=lambda item: item[0])[:100]
+  assert queue.snapshot()['dropped/priority'] == 900
+  assert len(queue._worst) <= 200
+
+
+def test_removed_tombstones():
+  queue = EventQueue(10, 'drop_oldest')
+  put(queue, ((0, i) for i in range(15)))
+  assert queue._removed == 5
+
+  # Returned entries are not tombstones, skipped ones are not anymore
+  assert drain(queue) == [(0, i) for i in range(5, 15)]
+  assert queue._removed == 0
+  assert len(queue._heap) == 0
+
+
+def test_block():
+  queue = EventQueue(2, 'block')
+  put(queue, ((1, 'a'), (1, 'b')))
+
+  thread = Thread(target=put, args=(queue, ((0, 'c'), )))
+  thread.start()
+  thread.join(0.1)
+  assert thread.is_alive()
+
+  assert queue.get() == (1, 'a')
+  thread.join(5)
+  assert drain(queue) == [(0, 'c'), (1, 'b')]
+  assert queue.snapshot()['blocked'] == 1
+
+
+def test_spill(tmpdir):
+  spill_file = str(tmpdir.join('queue.spill'))
+  queue = EventQueue(2, 'spill', spill_file)
+  put(queue, ((1, 'a'), (0, 'b'), (0, 'c'), (0, 'd')))
+  queue.put(1, 'e', ('1', 'voltage'))
+  queue.put(1, 'f', ('1', 'voltage'))
+
+  stats = queue.snapshot()
+  assert (stats['depth'], stats['spill_depth'], stats['spilled']) == (2, 4, 4)
+
+  # Spilled items are loaded in order when there is room, key is
+  # coalesced when loaded
+  assert drain(queue) == [(0, 'b'), (0, 'c'), (0, 'd'), (1, 'a'), (1, 'f')]
+  assert os.path.getsize(spill_file) == 0
+  assert queue.snapshot()['dropped/coalesce'] == 1
+
+  # Spilled items are loaded after restart
+  put(queue, ((0, 'g'), (0, 'h'), (0, {'board_id': '1'})))
+  queue = EventQueue(2, 'spill', spill_file)
+  assert drain(queue) == [(0, {'board_id': '1'})]
+
+
+@pytest.mark.parametrize('policy, spill_file', [
+  ('drop', None),
+  ('spill', None),
+])
+def test_invalid_policy(policy, spill_file):
+  with pytest.raises(ValueError):
+    EventQueue(10, policy, spill_file)
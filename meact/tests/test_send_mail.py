@@ -0,0 +1,136 @@
+from threading import Event, Thread
+import asyncore
+import smtpd
+import time
+
+import pytest
+
+from meact.executor.actions import send_mail
+
+
+class Channel(smtpd.SMTPChannel):
+
+  def smtp_RCPT(self, arg):
+    # Recipient is refused as many times as set in server refused
+    for address, count in self.server.refused.items():
+      if count and address in arg:
+        self.server.refused[address] -= 1
+        self.push('450 Mailbox busy')
+        return
+    smtpd.SMTPChannel.smtp_RCPT(self, arg)
+
+
+class Server(smtpd.SMTPServer):
+  """Local SMTP server recording connections and received mails
+  """
+  def __init__(self):
+    smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+    self.port = self.socket.getsockname()[1]
+    self.connections = 0
+    self.channels = []
+    self.mails = []
+    self.refused = {}
+
+  def handle_accept(self):
+    pair = self.accept()
+    if pair is not None:
+      self.connections += 1
+      channel = Channel(self, *pair)
+      channel.server = self
+      self.channels.append(channel)
+
+  def process_message(self, peer, mailfrom, rcpttos, data):
+    self.mails.append((mailfrom, rcpttos, data))
+
+  def drop_connections(self):
+    for channel in self.channels:
+      channel.close()
+
+
+@pytest.fixture
+def smtp_server(request):
+  server = Server()
+  stopped = Event()
+
+  def loop():
+    while not stopped.is_set():
+      asyncore.loop(timeout=0.01, count=1)
+  thread = Thread(target=loop)
+  thread.start()
+
+  def stop():
+    send_mail.close_smtp_session()
+    stopped.set()
+    thread.join()
+    asyncore.close_all()
+  request.addfinalizer(stop)
+
+  return server
+
+
+def config(server, recipients):
+  return {'sender': 'meact@example.com', 'recipient': recipients, 'host': '127.0.0.1', 'port': server.port,
+          'tls': 0, 'enabled': 1}
+
+
+def send(action_config, message='power'):
+  with pytest.raises(SystemExit) as e:
+    send_mail.send_mail({'message': message}, action_config)
+  return e.value.code
+
+
+def test_all_recipients(smtp_server):
+  recipients = ['a@example.com', 'b@example.com', 'c@example.com']
+
+  assert send(config(smtp_server, recipients)) == 0
+  assert send(config(smtp_server, recipients[:1]), 'alarm') == 0
+
+  # Every recipient gets own mail, session is reused
+  assert [mail[1] for mail in smtp_server.mails] == [[r] for r in recipients + recipients[:1]]
+  assert ['To: ' + r in mail[2] for r, mail in zip(recipients, smtp_server.mails)] == [True] * 3
+  assert 'b@example.com' not in smtp_server.mails[0][2]
+  assert smtp_server.connections == 1
+
+
+def test_refused(smtp_server):
+  smtp_server.refused = {'busy@example.com': 1, 'full@example.com': 2}
+  recipients = ['busy@example.com', 'a@example.com', 'full@example.com']
+
+  # Only refused recipients are tried again, mail was sent so action
+  # is not retried
+  assert send(config(smtp_server, recipients)) == 0
+  assert [mail[1] for mail in smtp_server.mails] == [['a@example.com'], ['busy@example.com']]
+  assert smtp_server.refused == {'busy@example.com': 0, 'full@example.com': 0}
+
+  smtp_server.refused = {'full@example.com': 2}
+  assert send(config(smtp_server, ['full@example.com'])) == 2
+  assert len(smtp_server.mails) == 2
+
+
+def test_reconnect(smtp_server):
+  action_config = config(smtp_server, ['a@example.com'])
+
+  assert send(action_config) == 0
+  smtp_server.drop_connections()
+  time.sleep(0.05)
+  assert send(action_config) == 0
+
+  assert (len(smtp_server.mails), smtp_server.connections) == (2, 2)
+
+
+def test_failure(smtp_server):
+  action_config = config(smtp_server, ['a@example.com'])
+  action_config['port'] = 1
+
+  assert send(action_config) == 2
+  assert send_mail.SMTP_SESSION is None
+
+
+def test_reused_session(smtp_server):
+  recipients = ['user{}@example.com'.format(i) for i in range(20)]
+
+  for _ in range(10):
+    assert send(config(smtp_server, recipients)) == 0
+
+  assert [mail[1] for mail in smtp_server.mails] == [[r] for r in recipients] * 10
+  assert smtp_server.connections == 1
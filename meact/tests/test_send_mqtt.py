@@ -0,0 +1,157 @@
+from SocketServer import BaseRequestHandler, TCPServer, ThreadingMixIn
+from threading import Thread
+import json
+import socket
+import struct
+import time
+
+import pytest
+
+from meact.executor.actions import send_mqtt
+
+
+class Broker(ThreadingMixIn, TCPServer):
+  """Minimal MQTT broker recording published messages
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class Handler(BaseRequestHandler):
+
+  def read(self, size):
+    data = ''
+    while len(data) < size:
+      chunk = self.request.recv(size - len(data))
+      if not chunk:
+        raise EOFError
+      data += chunk
+    return data
+
+  def packet(self):
+    header = ord(self.read(1))
+    length, multiplier = 0, 1
+    while True:
+      byte = ord(self.read(1))
+      length += (byte & 127) * multiplier
+      multiplier *= 128
+      if not byte & 128:
+        break
+    return header, self.read(length)
+
+  def handle(self):
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.server.connections.append(self.request)
+    try:
+      while True:
+        header, body = self.packet()
+        command = header >> 4
+        if command == 1:
+          self.request.sendall('\x20\x02\x00\x00')
+        elif command == 3:
+          qos = (header >> 1) & 3
+          topic_length, = struct.unpack('!H', body[:2])
+          topic = body[2:2 + topic_length]
+          payload = body[2 + topic_length + (2 if qos else 0):]
+          self.server.messages.append((topic, payload))
+          if qos:
+            self.request.sendall('\x40\x02' + body[2 + topic_length:4 + topic_length])
+        elif command == 12:
+          self.request.sendall('\xd0\x00')
+        elif command == 14:
+          break
+    except (EOFError, socket.error):
+      pass
+
+
+@pytest.fixture
+def broker(request):
+  server = Broker(('127.0.0.1', 0), Handler)
+  server.connections = []
+  server.messages = []
+  Thread(target=server.serve_forever).start()
+
+  def stop():
+    send_mqtt.close_mqtt_client()
+    server.shutdown()
+    server.server_close()
+  request.addfinalizer(stop)
+
+  server.port = server.server_address[1]
+  return server
+
+
+def config(broker, qos=0):
+  return {'server': '127.0.0.1', 'port': broker.port, 'qos': qos, 'enabled': 1, 'message': [
+    {'topic': 'relay/{board_id}/1', 'payload': 'on'},
+    {'topic': 'relay/{board_id}/2', 'payload': '{value}'},
+    {'topic': 'relay/{missing}', 'payload': 'off'}]}
+
+
+def wait_for(broker, messages):
+  # QoS 0 messages are published once written to socket
+  deadline = time.time() + 2
+  while len(broker.messages) < messages and time.time() < deadline:
+    time.sleep(0.001)
+
+
+def send(action_config, board_id='kitchen'):
+  with pytest.raises(SystemExit) as e:
+    send_mqtt.send_mqtt({'board_id': board_id, 'value': 1}, action_config)
+  return e.value.code
+
+
+@pytest.mark.parametrize('qos', [0, 1])
+def test_reused_connection(broker, qos):
+  assert send(config(broker, qos)) == 0
+  assert send(config(broker, qos), 'garage') == 0
+  wait_for(broker, 4)
+
+  # Message which could not be formatted is skipped
+  assert broker.messages == [('relay/kitchen/1', 'on'), ('relay/kitchen/2', '1'),
+          ('relay/garage/1', 'on'), ('relay/garage/2', '1')]
+  assert len(broker.connections) == 1
+
+
+def test_reconnect(broker):
+  assert send(config(broker)) == 0
+  wait_for(broker, 2)
+  broker.connections[0].shutdown(socket.SHUT_RDWR)
+  time.sleep(0.05)
+  assert send(config(broker)) == 0
+  wait_for(broker, 4)
+
+  assert (len(broker.messages), len(broker.connections)) == (4, 2)
+
+
+def test_failure(broker):
+  action_config = config(broker)
+  action_config['port'] = 1
+
+  assert send(action_config) == 2
+  assert send_mqtt.MQTT_CLIENT is None
+
+
+def test_reused_many(broker):
+  for _ in range(20):
+    assert send(config(broker)) == 0
+  wait_for(broker, 40)
+
+  assert (len(broker.messages), len(broker.connections)) == (40, 1)
+
+
+def test_send_sms_at(broker):
+  pytest.importorskip('gsmmodem')
+  from meact.executor.actions import send_sms_at
+
+  action_config = {'recipient': ['+48100'], 'topic': 'gsm/sms', 'enabled': 1,
+          'mqtt': {'server': '127.0.0.1', 'port': broker.port}}
+  for _ in range(2):
+    with pytest.raises(SystemExit) as e:
+      send_sms_at.send_sms_at({'message': 'power'}, action_config)
+    assert e.value.code == 0
+
+  # SMS requests share connection with send_mqtt
+  assert [(topic, json.loads(payload)) for topic, payload in broker.messages] == \
+          [('gsm/sms', {'recipient': ['+48100'], 'message': 'power'})] * 2
+  assert len(broker.connections) == 1
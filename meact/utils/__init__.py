@@ -1,6 +1,7 @@
 from argparse import ArgumentParser
 from yaml import load as yaml_load
 import logging
+import math
 import os
 import pkgutil
 import requests
@@ -9,6 +10,8 @@ import time
 
 from jsonschema import Draft4Validator
 from jsonschema.exceptions import ValidationError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from meact.utils import schemas
 
@@ -16,6 +19,16 @@ LOG = logging.getLogger(__name__)
 logging.getLogger("requests").setLevel(logging.CRITICAL)
 requests.packages.urllib3.disable_warnings()
 
+HTTP_CONFIG = {
+  'pool_connections': 10,
+  'pool_maxsize': 2,
+  'pool_block': False,
+  'retries': 0,
+  'backoff_factor': 0,
+  'status_retries': ()
+}
+HTTP_SESSION = None
+
 def load_config(config_name):
   if not os.path.isfile(config_name):
     raise KeyError('Config {} is missing'.format(config_name))
@@ -95,9 +108,47 @@ def create_arg_parser(description):
   return parser
 
 
+def configure_http(**config):
+  """Set options of pooled HTTP session
+
+  pool_connections is number of hosts with kept connections,
+  pool_maxsize is number of connections kept per host (pool_block
+  makes requests wait for free connection instead of opening extra
+  one), retries is number of retries of failed connections with
+  backoff_factor (seconds), status_retries lists HTTP statuses which
+  are retried too.
+  """
+  global HTTP_SESSION
+  HTTP_CONFIG.update(config)
+  HTTP_SESSION = None
+
+
+def http_session():
+  """Return keep-alive session shared by HTTP requests of process
+
+  Session is created per process, sessions are not shared with
+  forked processes.
+  """
+  global HTTP_SESSION
+  pid = os.getpid()
+
+  if HTTP_SESSION is None or HTTP_SESSION[0] != pid:
+    retries = Retry(total=HTTP_CONFIG['retries'], read=False,
+            status_forcelist=HTTP_CONFIG['status_retries'], backoff_factor=HTTP_CONFIG['backoff_factor'],
+            method_whitelist=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=HTTP_CONFIG['pool_connections'], pool_maxsize=HTTP_CONFIG['pool_maxsize'],
+            pool_block=HTTP_CONFIG['pool_block'], max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    HTTP_SESSION = (pid, session)
+
+  return HTTP_SESSION[1]
+
+
 def http_request(url, method='GET', params=None, data=None, auth=None, headers=None, verify_ssl=False, timeout=2):
   try:
-    req = requests.request(method, url, params=params,
+    req = http_session().request(method, url, params=params,
             data=data, headers=headers, auth=auth, verify=verify_ssl, timeout=timeout)
     req.raise_for_status()
   except (requests.HTTPError, requests.ConnectionError, requests.exceptions.Timeout) as e:
@@ -121,35 +172,31 @@ def load_mapping(module):
   return mapping
 
 
-def treshold_helper(threshold, arg1=None):
-  transform = threshold.get('transform')
-
-  if transform:
-    transform_result = eval_helper(transform, arg1)
-  else:
-    transform_result = arg1
-
-  threshold_result = eval_helper(threshold['lambda'], transform_result)
-
-  return transform_result, threshold_result
-
-
-def eval_helper(threshold_lambda, arg1=None):
-  threshold_func = eval(threshold_lambda)
-  threshold_func_arg_number = threshold_func.func_code.co_argcount
+def compile_lambda(threshold_lambda):
+  """Compile lambda string once, returns function of single argument
 
+  Exception raised by lambda is logged and False is returned. Invalid
+  lambda raises ValueError.
+  """
   try:
-    if threshold_func_arg_number == 0:
-      threshold_result = threshold_func()
-    elif threshold_func_arg_number == 1:
-      threshold_result = threshold_func(arg1)
-    else:
-      LOG.warning('Too much arguments passed to threshold')
+    threshold_func = eval(threshold_lambda)
+    threshold_func_arg_number = threshold_func.func_code.co_argcount
   except Exception as e:
-    LOG.error("Exception '%s' in lambda '%s' args '%s'", e, threshold_lambda, arg1)
-    threshold_result = False
+    raise ValueError("Invalid lambda '{}' '{}'".format(threshold_lambda, e))
 
-  return threshold_result
+  if threshold_func_arg_number > 1:
+    raise ValueError("Too much arguments in lambda '{}'".format(threshold_lambda))
+
+  def call(arg1=None):
+    try:
+      if threshold_func_arg_number == 0:
+        return threshold_func()
+      return threshold_func(arg1)
+    except Exception as e:
+      LOG.error("Exception '%s' in lambda '%s' args '%s'", e, threshold_lambda, arg1)
+      return False
+
+  return call
 
 
 def prepare_sensor_data(sensor_data):
@@ -175,6 +222,20 @@ def prepare_sensor_data_mqtt(mqtt_msg):
   return prepare_sensor_data(sensor_data)
 
 
+def to_number(value):
+  """Return value as float or None when value is not a number
+  """
+  try:
+    number = float(value)
+  except (ValueError, TypeError):
+    return None
+
+  if math.isnan(number) or math.isinf(number):
+    return None
+
+  return number
+
+
 def time_offset(offset=None):
   now = int(time.time())
   if not offset is None:
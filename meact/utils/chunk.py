@@ -0,0 +1,160 @@
+import struct
+
+# Value bits for delta-of-delta encoded with '10', '110', '1110' and '1111' prefix
+DOD_BITS = (7, 9, 12, 32)
+
+
+class BitWriter(object):
+  def __init__(self):
+    self.data = bytearray()
+    self._acc = 0
+    self._bits = 0
+
+  def write(self, value, bits):
+    self._acc = (self._acc << bits) | value
+    self._bits += bits
+    while self._bits >= 8:
+      self._bits -= 8
+      self.data.append((self._acc >> self._bits) & 0xff)
+    self._acc &= (1 << self._bits) - 1
+
+  def getvalue(self):
+    data = bytearray(self.data)
+    if self._bits:
+      data.append((self._acc << (8 - self._bits)) & 0xff)
+    return bytes(data)
+
+
+class BitReader(object):
+  def __init__(self, data):
+    self.data = bytearray(data)
+    self._pos = 0
+    self._acc = 0
+    self._bits = 0
+
+  def read(self, bits):
+    while self._bits < bits:
+      self._acc = (self._acc << 8) | self.data[self._pos]
+      self._pos += 1
+      self._bits += 8
+    self._bits -= bits
+    value = self._acc >> self._bits
+    self._acc &= (1 << self._bits) - 1
+    return value
+
+
+def _float_bits(value):
+  return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+
+def _bits_float(bits):
+  return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+def _leading_zeros(value):
+  return 64 - value.bit_length()
+
+
+def _trailing_zeros(value):
+  return (value & -value).bit_length() - 1
+
+
+def encode(points):
+  """Encode (timestamp, value) points ordered by timestamp
+
+  Timestamps (seconds) are stored as delta-of-delta, values as XOR
+  with previous value (Gorilla, Pelkonen et al., VLDB 2015).
+  Points count, first timestamp and first value are stored in header.
+  """
+  w = BitWriter()
+  w.write(len(points), 32)
+  if not points:
+    return w.getvalue()
+
+  timestamp, value = points[0]
+  w.write(timestamp, 32)
+  prev_value = _float_bits(value)
+  w.write(prev_value, 64)
+
+  prev_timestamp, prev_delta = timestamp, 0
+  prev_leading, prev_trailing = 65, 0
+
+  for timestamp, value in points[1:]:
+    delta = timestamp - prev_timestamp
+    dod = delta - prev_delta
+    prev_timestamp, prev_delta = timestamp, delta
+
+    if dod == 0:
+      w.write(0, 1)
+    else:
+      for ones, bits in enumerate(DOD_BITS, 1):
+        if -(1 << (bits - 1)) < dod <= (1 << (bits - 1)) or ones == len(DOD_BITS):
+          break
+      if ones == len(DOD_BITS):
+        w.write((1 << ones) - 1, ones)
+      else:
+        w.write(((1 << ones) - 1) << 1, ones + 1)
+      w.write(dod & ((1 << bits) - 1), bits)
+
+    value = _float_bits(value)
+    xor = value ^ prev_value
+    prev_value = value
+
+    if xor == 0:
+      w.write(0, 1)
+      continue
+
+    leading, trailing = min(_leading_zeros(xor), 31), _trailing_zeros(xor)
+    if leading >= prev_leading and trailing >= prev_trailing:
+      w.write(0b10, 2)
+      w.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+    else:
+      meaningful = 64 - leading - trailing
+      w.write(0b11, 2)
+      w.write(leading, 5)
+      # 64 meaningful bits do not fit 6 bits, it is stored as 0
+      w.write(meaningful & 0x3f, 6)
+      w.write(xor >> trailing, meaningful)
+      prev_leading, prev_trailing = leading, trailing
+
+  return w.getvalue()
+
+
+def decode(data):
+  """Decode points encoded with encode
+  """
+  r = BitReader(data)
+  count = r.read(32)
+  if not count:
+    return []
+
+  timestamp = r.read(32)
+  value = r.read(64)
+  points = [(timestamp, _bits_float(value))]
+
+  delta = 0
+  leading, trailing = 0, 0
+
+  for i in xrange(count - 1):
+    ones = 0
+    while ones < len(DOD_BITS) and r.read(1):
+      ones += 1
+
+    if ones:
+      bits = DOD_BITS[ones - 1]
+      dod = r.read(bits)
+      if dod > (1 << (bits - 1)):
+        dod -= 1 << bits
+      delta += dod
+    timestamp += delta
+
+    if r.read(1):
+      if r.read(1):
+        leading = r.read(5)
+        meaningful = r.read(6) or 64
+        trailing = 64 - leading - meaningful
+      value ^= r.read(64 - leading - trailing) << trailing
+
+    points.append((timestamp, _bits_float(value)))
+
+  return points
@@ -0,0 +1,220 @@
+from collections import deque
+from threading import Condition
+import Queue
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+
+from meact.utils.stats import Stats
+
+LOG = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop_oldest', 'drop_lowest_priority', 'spill')
+
+
+class EventQueue(object):
+  """Bounded priority queue with coalescing
+
+  Items with lower priority value are returned first, items with the
+  same priority in order they were put. Item put with key which is
+  already pending replaces pending item and keeps its place in queue.
+
+  When maxsize items are queued, put follows policy:
+  - block: wait until item is returned (backpressure to MQTT loop)
+  - drop_oldest: drop item which waits longest
+  - drop_lowest_priority: drop item with highest priority value,
+    newest of them (possibly the one being put)
+  - spill: append item to spill_file (JSON lines), spilled items are
+    loaded back in order when there is room, items left in spill_file
+    are loaded on start. Items have to be JSON serializable and are not
+    coalesced while spilled.
+
+  maxsize 0 is unbounded.
+  """
+  def __init__(self, maxsize=0, policy='block', spill_file=None):
+    if policy not in POLICIES:
+      raise ValueError("Unknown queue policy '{}'".format(policy))
+    if policy == 'spill' and not spill_file:
+      raise ValueError('spill_file is required for spill policy')
+
+    self.maxsize = maxsize
+    self.policy = policy
+    self.stats = Stats()
+    self._cond = Condition()
+    self._heap = []
+    self._order = deque()
+    # (-priority, -seq, entry), lowest priority newest entry first
+    self._worst = [] if policy == 'drop_lowest_priority' else None
+    self._size = 0
+    self._removed = 0
+    self._pending = {}
+    self._seq = itertools.count()
+    self._spill = None
+    self._spill_offset = 0
+    self._spilled = 0
+
+    if policy == 'spill':
+      self._open_spill(spill_file)
+
+  def _open_spill(self, spill_file):
+    self._spill = open(spill_file, 'a+')
+    self._spill.seek(0)
+    self._spilled = sum(1 for _ in self._spill)
+    if self._spilled:
+      LOG.info('Loading %d spilled items from %s', self._spilled, spill_file)
+      with self._cond:
+        self._unspill()
+
+  def _full(self):
+    return self.maxsize and self._size >= self.maxsize
+
+  def _push(self, priority, item, key):
+    # priority, seq, item, replaced, key, removed
+    entry = [priority, next(self._seq), item, 0, key, False]
+    heapq.heappush(self._heap, entry)
+    self._order.append(entry)
+    if self._worst is not None:
+      heapq.heappush(self._worst, (-priority, -entry[1], entry))
+    self._size += 1
+    if key is not None:
+      self._pending[key] = entry
+    self._cond.notify()
+
+  def _remove(self, entry, tombstone=True):
+    # Dropped entry is left in heap (tombstone), it is skipped when
+    # reached. Returned entry was already popped from heap.
+    entry[5] = True
+    self._size -= 1
+    if tombstone:
+      self._removed += 1
+    if entry[4] is not None and self._pending.get(entry[4]) is entry:
+      del self._pending[entry[4]]
+
+    limit = max(self._size, 64)
+    if self._removed > limit:
+      self._heap = [e for e in self._heap if not e[5]]
+      heapq.heapify(self._heap)
+      self._removed = 0
+    # Order and worst keep both dropped and returned entries
+    if len(self._order) > self._size + limit:
+      self._order = deque(e for e in self._order if not e[5])
+    if self._worst is not None and len(self._worst) > self._size + limit:
+      self._worst = [w for w in self._worst if not w[2][5]]
+      heapq.heapify(self._worst)
+
+  def _coalesce(self, item, key):
+    entry = self._pending.get(key) if key is not None else None
+    if entry is None:
+      return False
+
+    entry[2] = item
+    entry[3] += 1
+    self.stats.incr('dropped/coalesce')
+    return True
+
+  def put(self, priority, item, key=None):
+    with self._cond:
+      if self._coalesce(item, key):
+        return
+
+      # Spilled items are older, new item waits behind them
+      if self._spilled or self._full() and self.policy == 'spill':
+        self._spill.seek(0, os.SEEK_END)
+        self._spill.write(json.dumps([priority, key, item]) + '\n')
+        self._spill.flush()
+        self._spilled += 1
+        self.stats.incr('spilled')
+        return
+
+      if self._full() and self.policy == 'block':
+        self.stats.incr('blocked')
+        start = time.time()
+        while self._full():
+          self._cond.wait()
+        self.stats.observe('blocked_wait', (time.time() - start) * 1000)
+
+      elif self._full() and self.policy == 'drop_oldest':
+        while self._order[0][5]:
+          self._order.popleft()
+        self._remove(self._order.popleft())
+        self.stats.incr('dropped/oldest')
+
+      elif self._full() and self.policy == 'drop_lowest_priority':
+        while self._worst[0][2][5]:
+          heapq.heappop(self._worst)
+        lowest = self._worst[0][2]
+        if lowest[0] <= priority:
+          self.stats.incr('dropped/priority')
+          return
+        heapq.heappop(self._worst)
+        self._remove(lowest)
+        self.stats.incr('dropped/priority')
+
+      self._push(priority, item, key)
+
+  def _unspill(self):
+    self._spill.seek(self._spill_offset)
+    while self._spilled and not self._full():
+      line = self._spill.readline()
+      if not line.endswith('\n'):
+        # Partial line written before crash
+        LOG.error('Spill file is truncated, %d items lost', self._spilled)
+        self._spilled = 0
+        break
+      priority, key, item = json.loads(line)
+      key = tuple(key) if isinstance(key, list) else key
+      if not self._coalesce(item, key):
+        self._push(priority, item, key)
+      self._spilled -= 1
+    self._spill_offset = self._spill.tell()
+
+    if not self._spilled:
+      self._spill.seek(0)
+      self._spill.truncate()
+      self._spill_offset = 0
+
+  def get(self, block=True, timeout=None):
+    """Return (priority, item), raises Queue.Empty as Queue.get
+    """
+    with self._cond:
+      if block:
+        end = time.time() + timeout if timeout is not None else None
+        while not self._size:
+          remaining = end - time.time() if end is not None else None
+          if remaining is not None and remaining <= 0:
+            break
+          self._cond.wait(remaining)
+
+      if not self._size:
+        raise Queue.Empty
+
+      entry = heapq.heappop(self._heap)
+      while entry[5]:
+        self._removed -= 1
+        entry = heapq.heappop(self._heap)
+      priority, _, item, replaced, key, _ = entry
+      self._remove(entry, tombstone=False)
+      while self._order and self._order[0][5]:
+        self._order.popleft()
+
+      if self._spilled:
+        self._unspill()
+      self._cond.notify_all()
+
+    if replaced:
+      self.stats.incr('coalesced')
+
+    return priority, item
+
+  def qsize(self):
+    with self._cond:
+      return self._size
+
+  def snapshot(self):
+    with self._cond:
+      self.stats.gauge('depth', self._size)
+      self.stats.gauge('spill_depth', self._spilled)
+    return self.stats.snapshot()
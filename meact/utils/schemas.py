@@ -90,6 +90,8 @@ SCHEMA_DEFINITIONS = {
               "value_count": {"$ref": "#/definitions/valueCount"},
               "start_offset": {"type": "integer"},
               "end_offset": {"type": "integer"},
+              "min_value": {"type": "number"},
+              "max_value": {"type": "number"},
             },
             "required": ["threshold", "value_count"]
           }
@@ -126,6 +128,7 @@ SCHEMA_SENSOR_CONFIG = {
   "type": "object",
   "properties": {
     "priority": {"$ref": "#/definitions/positiveInteger"},
+    "coalesce": {"type": "boolean"},
     "actions": {"$ref": "#/definitions/actions"}
   },
   "required": ["priority", "actions"]
@@ -140,6 +143,7 @@ SCHEMA_FEED_CONFIG = {
     "mqtt_topic": {"$ref": "#/definitions/notEmptyString"},
     "feed_interval": {"$ref": "#/definitions/positiveInteger"},
     "fail_interval": {"$ref": "#/definitions/positiveInteger"},
+    "jitter": {"type": "number", "minimum": 0},
     "params": {"type": "object"}
   },
   "required": [
@@ -0,0 +1,43 @@
+import threading
+
+
+class Stats(object):
+  """Thread safe counters, gauges and samples
+
+  Counters are cumulative, samples (count/avg/max) are reset
+  after each snapshot. Snapshot is flat dict which can be
+  published on mgmt/stats tree (see Mqtt.publish_stats).
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counters = {}
+    self._gauges = {}
+    self._samples = {}
+
+  def incr(self, name, value=1):
+    with self._lock:
+      self._counters[name] = self._counters.get(name, 0) + value
+
+  def gauge(self, name, value):
+    with self._lock:
+      self._gauges[name] = value
+
+  def observe(self, name, value):
+    with self._lock:
+      count, total, maximum = self._samples.get(name, (0, 0, value))
+      self._samples[name] = (count + 1, total + value, max(maximum, value))
+
+  def snapshot(self, reset=True):
+    with self._lock:
+      output = dict(self._counters)
+      output.update(self._gauges)
+
+      for name, (count, total, maximum) in self._samples.iteritems():
+        output[name + '/count'] = count
+        output[name + '/avg'] = round(float(total) / count, 3)
+        output[name + '/max'] = round(maximum, 3)
+
+      if reset:
+        self._samples = {}
+
+    return output